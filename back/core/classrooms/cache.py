@@ -0,0 +1,66 @@
+"""
+Cache of the facts behind classroom and session access checks.
+
+Three read-through caches answer every access check without queries in
+steady state:
+
+    session id -> classroom id
+    classroom id -> instructor id
+    (student id, classroom id) -> enrolled or not
+
+They are invalidated by Session, Classroom and Enrollment saves and
+deletes (see signals.py). The role of a user in a classroom is derived
+from them.
+"""
+from core.caching import configured_cache
+from session.models import Session
+from .models import Classroom, Enrollment
+
+# Global cache instances, configured by the ACCESS_CACHE setting
+session_classrooms = configured_cache('session_classroom', 'ACCESS_CACHE')
+classroom_instructors = configured_cache('classroom_instructor', 'ACCESS_CACHE')
+enrollments = configured_cache('enrollment', 'ACCESS_CACHE')
+
+
+def enrollment_key(student_id, classroom_id):
+    return f'{student_id}:{classroom_id}'
+
+
+def get_session_classroom(session_id):
+    """Classroom id of a session, None if the session does not exist"""
+    return session_classrooms.get_or_load(
+        str(session_id),
+        lambda: Session.objects.filter(id=session_id).values_list('classroom_id', flat=True).first()
+    )
+
+
+def get_classroom_instructor(classroom_id):
+    return classroom_instructors.get_or_load(
+        str(classroom_id),
+        lambda: Classroom.objects.filter(id=classroom_id).values_list('instructor_id', flat=True).first()
+    )
+
+
+def is_enrolled(student_id, classroom_id):
+    return enrollments.get_or_load(
+        enrollment_key(student_id, classroom_id),
+        lambda: Enrollment.objects.filter(student_id=student_id, classroom_id=classroom_id).exists()
+    )
+
+
+def get_role(user, classroom_id):
+    """'instructor' or 'student' if the user belongs to the classroom, else None"""
+    if user.role == 'instructor':
+        return 'instructor' if get_classroom_instructor(classroom_id) == user.id else None
+    return 'student' if is_enrolled(user.id, classroom_id) else None
+
+
+def get_session_role(user, session_id):
+    """Role of a user in the classroom of a session, None without access"""
+    try:
+        classroom_id = get_session_classroom(int(session_id))
+    except (TypeError, ValueError):
+        return None
+    if classroom_id is None:
+        return None
+    return get_role(user, classroom_id)
@@ -1,5 +1,5 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
-from .models import Enrollment
+from .cache import get_role
 
 class IsInstructor(BasePermission):
     """
@@ -28,19 +28,11 @@ class IsEnrolled(BasePermission):
         if not classroom_id:
             return False
 
-        # Instructors have full access to their classrooms
-        if request.user.role == 'instructor':
-            return request.user.taught_classrooms.filter(pk=classroom_id).exists()
-
-        # Students must be enrolled to have any access
-        if request.user.role == 'student':
-            is_enrolled = Enrollment.objects.filter(
-                classroom_id=classroom_id,
-                student=request.user
-            ).exists()
+        role = get_role(request.user, classroom_id)
 
-            # Grant read-only access for enrolled students
-            if is_enrolled and request.method in SAFE_METHODS:
-                return True
+        # Instructors have full access to their classrooms
+        if role == 'instructor':
+            return True
 
-        return False
\ No newline at end of file
+        # Grant read-only access for enrolled students
+        return role == 'student' and request.method in SAFE_METHODS
\ No newline at end of file
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from session.models import Session
+from .cache import classroom_instructors, enrollment_key, enrollments, session_classrooms
+from .models import Classroom, Enrollment
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def invalidate_enrollment(sender, instance, **kwargs):
+    enrollments.delete(enrollment_key(instance.student_id, instance.classroom_id))
+
+
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def invalidate_classroom(sender, instance, **kwargs):
+    classroom_instructors.delete(str(instance.pk))
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def invalidate_session(sender, instance, **kwargs):
+    session_classrooms.delete(str(instance.pk))
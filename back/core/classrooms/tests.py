@@ -3,7 +3,12 @@ from django.contrib.auth import get_user_model
 from django.db.utils import IntegrityError
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
+from unittest.mock import Mock
+from django.utils import timezone
+from session.models import Session
+from .cache import classroom_instructors, enrollments, get_role, get_session_role, session_classrooms
 from .models import Classroom, Enrollment
+from .permissions import IsEnrolled
 from .serializers import ClassroomSerializer, EnrollmentSerializer
 import uuid
 
@@ -156,3 +161,52 @@ class ClassroomViewSetTest(APITestCase):
         self.client.force_authenticate(user=self.student1)
         response = self.client.delete(f'/api/classrooms/{self.classroom.id}/')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class AccessCacheTest(TestCase):
+    def setUp(self):
+        for cache in (session_classrooms, classroom_instructors, enrollments):
+            cache.clear()
+        self.instructor = User.objects.create_user(
+            email='instructor@example.com', password='password123', full_name='Instructor', role='instructor')
+        self.other_instructor = User.objects.create_user(
+            email='other@example.com', password='password123', full_name='Other', role='instructor')
+        self.student = User.objects.create_user(
+            email='student@example.com', password='password123', full_name='Student', role='student')
+        self.classroom = Classroom.objects.create(
+            name='Math 101', description='Algebra', instructor=self.instructor, join_code='MATH101')
+        self.enrollment = Enrollment.objects.create(student=self.student, classroom=self.classroom)
+        self.session = Session.objects.create(classroom=self.classroom, start_time=timezone.now())
+
+    def test_access_checks_are_cached(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(get_session_role(self.instructor, self.session.id), 'instructor')
+            self.assertEqual(get_session_role(self.student, self.session.id), 'student')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_session_role(self.instructor, self.session.id), 'instructor')
+            self.assertEqual(get_session_role(self.student, str(self.session.id)), 'student')
+            self.assertIsNone(get_session_role(self.other_instructor, self.session.id))
+        self.assertIsNone(get_session_role(self.student, self.session.id + 1))
+
+    def test_changes_invalidate_the_cache(self):
+        get_session_role(self.student, self.session.id)
+        self.enrollment.delete()
+        self.assertIsNone(get_session_role(self.student, self.session.id))
+        Enrollment.objects.create(student=self.student, classroom=self.classroom)
+        self.assertEqual(get_role(self.student, self.classroom.id), 'student')
+
+        self.classroom.instructor = self.other_instructor
+        self.classroom.save()
+        self.assertIsNone(get_role(self.instructor, self.classroom.id))
+        self.assertEqual(get_role(self.other_instructor, self.classroom.id), 'instructor')
+
+        self.session.delete()
+        self.assertIsNone(get_session_role(self.other_instructor, self.session.id))
+
+    def test_is_enrolled_permission(self):
+        permission = IsEnrolled()
+        view = Mock(kwargs={'classroom_id': self.classroom.id})
+        self.assertTrue(permission.has_permission(Mock(user=self.instructor, method='PATCH'), view))
+        self.assertTrue(permission.has_permission(Mock(user=self.student, method='GET'), view))
+        self.assertFalse(permission.has_permission(Mock(user=self.student, method='PATCH'), view))
+        self.assertFalse(permission.has_permission(Mock(user=self.other_instructor, method='GET'), view))
@@ -0,0 +1,115 @@
+"""
+Two-tier read-through cache.
+
+A TieredCache keeps recently used values in an in-process LRU with a short
+TTL, in front of an optional shared Django cache with a longer one. Reads
+that miss both tiers are loaded by the caller and stored in both.
+Invalidation deletes the key from the local LRU and the shared tier; the
+LRUs of other processes hold a stale value for at most their local TTL, so
+keep it short for data whose changes must propagate quickly.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Sentinel for cache misses
+MISSING = object()
+
+DEFAULTS = {
+    # Django cache alias of the shared tier, None to only cache in-process
+    'CACHE_ALIAS': None,
+    # Seconds an entry stays in the shared tier
+    'TIMEOUT': 300,
+    # Seconds an entry stays in the in-process LRU
+    'LOCAL_TIMEOUT': 30,
+    # Entries kept in the in-process LRU
+    'MAX_ENTRIES': 10000,
+}
+
+
+class TieredCache:
+    def __init__(self, prefix, timeout=300, local_timeout=30, max_entries=10000, alias=None):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self.max_entries = max_entries
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def shared_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key, default=None):
+        value = self.get_local(key, MISSING)
+        if value is not MISSING:
+            return value
+        if self.shared is None:
+            return default
+        value = self.shared.get(self.shared_key(key), MISSING)
+        if value is MISSING:
+            return default
+        self.set_local(key, value)
+        return value
+
+    def get_local(self, key, default=None):
+        """Value of key in the in-process LRU, without reaching the shared tier"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+        return default
+
+    def set(self, key, value):
+        self.set_local(key, value)
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), value, self.timeout)
+
+    def set_local(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.local_timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self.shared_key(key))
+
+    def get_or_load(self, key, load):
+        """Return the cached value of key, calling load() on a miss"""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = load()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop the local entries, e.g. between tests"""
+        with self.lock:
+            self.entries.clear()
+
+
+def configured_cache(prefix, setting):
+    """TieredCache configured by the Django setting of that name, a dict of DEFAULTS keys"""
+    options = {**DEFAULTS, **getattr(settings, setting, {})}
+    return TieredCache(
+        prefix,
+        timeout=options['TIMEOUT'],
+        local_timeout=options['LOCAL_TIMEOUT'],
+        max_entries=options['MAX_ENTRIES'],
+        alias=options['CACHE_ALIAS']
+    )
@@ -0,0 +1,39 @@
+"""
+JSON codec of the hot paths.
+
+WebSocket frames and REST responses are encoded and decoded with orjson when
+it is installed, which is several times faster than the standard library,
+and with the json module otherwise. Both backends produce the same values
+but not the same whitespace, so nothing should depend on the exact text of
+an encoded payload beyond it being a JSON object.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Raised by loads() on malformed input, orjson's error is a subclass
+DecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def dumps_bytes(obj, default=None):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    def dumps(obj, default=None):
+        return dumps_bytes(obj, default).decode()
+
+    loads = orjson.loads
+else:
+    BACKEND = 'json'
+
+    def dumps(obj, default=None):
+        return json.dumps(obj, default=default)
+
+    def dumps_bytes(obj, default=None):
+        return dumps(obj, default).encode()
+
+    loads = json.loads
@@ -0,0 +1,31 @@
+"""
+DRF renderer and parser using the JSON codec (core.codec).
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from . import codec
+
+
+class CodecJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Indented output (e.g. for the browsable API) is left to the stdlib
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = codec.dumps_bytes(data, default=self.encoder_class().default)
+        # Keep the output a strict javascript subset, as JSONRenderer does
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class CodecJSONParser(JSONParser):
+    renderer_class = CodecJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return codec.loads(stream.read())
+        except (codec.DecodeError, UnicodeDecodeError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
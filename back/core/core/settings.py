@@ -63,6 +63,48 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Shared cache used to coordinate real-time workers (e.g. session ticker leases)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'real_time': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
+# Real-time settings (see real_time/conf.py for the defaults)
+REAL_TIME = {
+    'CACHE_ALIAS': 'real_time',
+    'TICKER_INTERVAL': 0.5,
+    'TICKER_LEASE_TIMEOUT': 5,
+    'STATS_INTERVAL': 2.0,
+    'DASHBOARD_INTERVAL': 0.5,
+    'WEBINAR_THRESHOLD': 200,
+    'OUTBOUND_MAX_FRAMES': 256,
+    'OUTBOUND_MAX_LAG': 10.0,
+    'FOCUS_WRITE_MODE': 'buffered',
+    'FOCUS_FLUSH_INTERVAL_MS': 1000,
+    'FOCUS_FLUSH_MAX_ROWS': 500,
+    'FOCUS_BATCH_MAX_SAMPLES': 100,
+    'REDIS_URL': 'redis://127.0.0.1:6379/2',
+}
+
+USER_CACHE = {
+    # Set to a shared cache alias (e.g. 'real_time') to share cached users
+    # between workers
+    'CACHE_ALIAS': None,
+    'TIMEOUT': 300,
+    'LOCAL_TIMEOUT': 30,
+}
+
+ACCESS_CACHE = {
+    'CACHE_ALIAS': None,
+    'TIMEOUT': 300,
+    'LOCAL_TIMEOUT': 30,
+}
 # Application definition
 
 INSTALLED_APPS = [
@@ -103,11 +145,20 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.CodecJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.renderers.CodecJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('performance', '0003_focuschunk'),
+        ('session', '0002_session_pause_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FocusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('min_score', models.FloatField()),
+                ('max_score', models.FloatField()),
+                ('mean_score', models.FloatField()),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='focus_rollups', to='session.session')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='focus_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'student', 'resolution', 'bucket_start'], name='performance_session_dd0d39_idx')],
+            },
+        ),
+    ]
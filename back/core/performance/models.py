@@ -14,4 +14,46 @@ class Performance(models.Model):
         unique_together = ['session', 'student']
 
     def __str__(self):
-        return f"{self.student} - {self.session}"
\ No newline at end of file
+        return f"{self.student} - {self.session}"
+
+class FocusChunk(models.Model):
+    """
+    A run of focus samples of one student, packed by performance.timeseries.
+    """
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='focus_chunks')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='focus_chunks')
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    sample_count = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'student', 'start_time']),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.session} ({self.sample_count} samples)"
+
+
+class FocusRollup(models.Model):
+    """
+    Focus statistics of one time bucket, per student or for the whole
+    session (student is null), maintained by performance.rollups.
+    """
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='focus_rollups')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='focus_rollups')
+    resolution = models.PositiveIntegerField()
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    min_score = models.FloatField()
+    max_score = models.FloatField()
+    mean_score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'student', 'resolution', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.session} - {self.student or 'session'} @ {self.resolution}s {self.bucket_start}"
@@ -0,0 +1,162 @@
+"""
+Multi-resolution rollups of focus samples.
+
+Samples are folded as they arrive into min/max/mean/count buckets at every
+resolution in RESOLUTIONS, per student and for the whole session. Closed
+buckets are written as FocusRollup rows by the real-time focus write buffer;
+open ones stay in memory and are merged into timeline queries, which read
+the coarsest resolution that still yields the requested number of points.
+"""
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .models import FocusRollup, Performance
+
+# Bucket widths in seconds, finest first
+RESOLUTIONS = (10, 60, 300)
+
+
+def pick_resolution(span, points):
+    """Coarsest resolution giving at least `points` buckets over `span` seconds"""
+    for resolution in reversed(RESOLUTIONS):
+        if span / resolution >= points:
+            return resolution
+    return RESOLUTIONS[0]
+
+
+class LiveRollups:
+    """
+    Open buckets of the series fed in this process, and the closed buckets
+    waiting to be written. A bucket is [start, count, min, max, sum] with
+    start in epoch seconds.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.closed = []
+
+    def add(self, session_id, student_id, timestamp, focus_score):
+        epoch = timestamp.timestamp()
+        with self.lock:
+            for key in ((session_id, student_id), (session_id, None)):
+                buckets = self.series.setdefault(key, {})
+                for resolution in RESOLUTIONS:
+                    start = int(epoch // resolution) * resolution
+                    bucket = buckets.get(resolution)
+                    if bucket is not None and start < bucket[0]:
+                        # Late samples count towards the open bucket
+                        start = bucket[0]
+                    if bucket is None or bucket[0] != start:
+                        if bucket is not None:
+                            self.closed.append((key, resolution, bucket))
+                        bucket = buckets[resolution] = [start, 0, focus_score, focus_score, 0.0]
+                    bucket[1] += 1
+                    bucket[2] = min(bucket[2], focus_score)
+                    bucket[3] = max(bucket[3], focus_score)
+                    bucket[4] += focus_score
+
+    def take(self, session_id=None, final=False):
+        """
+        Remove and return the closed buckets, optionally of a single session.
+        With final, the open buckets of the session are closed first.
+        """
+        with self.lock:
+            if final:
+                for key in list(self.series):
+                    if session_id is None or key[0] == session_id:
+                        for resolution, bucket in self.series.pop(key).items():
+                            self.closed.append((key, resolution, bucket))
+            taken = [item for item in self.closed if session_id is None or item[0][0] == session_id]
+            self.closed = [item for item in self.closed if session_id is not None and item[0][0] != session_id]
+        return taken
+
+    def restore(self, buckets):
+        with self.lock:
+            self.closed[:0] = buckets
+
+    def buckets(self, session_id, student_id, resolution):
+        """Buckets of a series at a resolution that are not written yet"""
+        with self.lock:
+            pending = [
+                list(bucket) for key, bucket_resolution, bucket in self.closed
+                if key == (session_id, student_id) and bucket_resolution == resolution
+            ]
+            bucket = self.series.get((session_id, student_id), {}).get(resolution)
+            if bucket is not None:
+                pending.append(list(bucket))
+        return pending
+
+
+def to_model(key, resolution, bucket):
+    start, count, low, high, total = bucket
+    return FocusRollup(
+        session_id=key[0],
+        student_id=key[1],
+        resolution=resolution,
+        bucket_start=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+        count=count,
+        min_score=low,
+        max_score=high,
+        mean_score=total / count
+    )
+
+
+def get_timeline(session, student_id=None, points=120):
+    """
+    Focus timeline of a session, or of one of its students.
+
+    Returns (resolution, buckets) where buckets is a list of dicts with
+    bucket_start, count, min, max and mean, oldest first.
+    """
+    end = session.end_time or timezone.now()
+    resolution = pick_resolution((end - session.start_time).total_seconds(), points)
+
+    merged = {}
+
+    def merge(start, count, low, high, total):
+        bucket = merged.get(start)
+        if bucket is None:
+            merged[start] = [count, low, high, total]
+        else:
+            bucket[0] += count
+            bucket[1] = min(bucket[1], low)
+            bucket[2] = max(bucket[2], high)
+            bucket[3] += total
+
+    rows = FocusRollup.objects.filter(
+        session=session,
+        student_id=student_id,
+        resolution=resolution
+    ).values_list('bucket_start', 'count', 'min_score', 'max_score', 'mean_score')
+    for bucket_start, count, low, high, mean in rows:
+        merge(int(bucket_start.timestamp()), count, low, high, mean * count)
+    for bucket in live_rollups.buckets(session.id, student_id, resolution):
+        merge(*bucket)
+
+    if not merged:
+        # Sessions recorded before rollups existed only have the latest
+        # score of each student
+        performances = Performance.objects.filter(session=session)
+        if student_id is not None:
+            performances = performances.filter(student_id=student_id)
+        for focus_score, timestamp in performances.values_list('focus_score', 'timestamp'):
+            focus_score = focus_score or 0.0
+            start = int(timestamp.timestamp() // resolution) * resolution
+            merge(start, 1, focus_score, focus_score, focus_score)
+
+    return resolution, [
+        {
+            'bucket_start': datetime.fromtimestamp(start, tz=dt_timezone.utc).isoformat(),
+            'count': count,
+            'min': low,
+            'max': high,
+            'mean': round(total / count, 4),
+        }
+        for start, (count, low, high, total) in sorted(merged.items())
+    ]
+
+
+# Global live rollups instance, fed by the real-time focus write buffer
+live_rollups = LiveRollups()
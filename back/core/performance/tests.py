@@ -2,10 +2,13 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
-from .models import Performance
+from .models import FocusRollup, Performance
+from .rollups import LiveRollups, live_rollups, pick_resolution, to_model as rollup_to_model
+from .timeseries import CHUNK_SIZE, SCORE_LEVELS, ChunkBuilder, read_session_series
 from session.models import Session
-from classrooms.models import Classroom
+from classrooms.models import Classroom, Enrollment
 from django.utils import timezone
+from datetime import timedelta
 import uuid
 
 User = get_user_model()
@@ -98,3 +101,143 @@ class PerformanceViewSetTest(APITestCase):
         url = f'/api/session/{self.session.id}/performances/aggregate/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class FocusTimeSeriesTest(TestCase):
+    def setUp(self):
+        self.instructor = User.objects.create_user(
+            email='instructor@example.com',
+            password='password123',
+            full_name='Instructor User',
+            role='instructor'
+        )
+        self.student = User.objects.create_user(
+            email='student@example.com',
+            password='password123',
+            full_name='Student User',
+            role='student'
+        )
+        self.classroom = Classroom.objects.create(
+            name='Test Classroom',
+            description='A classroom for testing',
+            instructor=self.instructor,
+            join_code=str(uuid.uuid4()).split('-')[0]
+        )
+        self.session = Session.objects.create(
+            classroom=self.classroom,
+            start_time=timezone.now()
+        )
+
+    def test_chunk_round_trip(self):
+        start = timezone.now()
+        chunk = ChunkBuilder(start)
+        for i in range(CHUNK_SIZE):
+            self.assertTrue(chunk.append(start + timedelta(milliseconds=200 * i), (i % 100) / 100))
+        self.assertFalse(chunk.append(start + timedelta(minutes=1), 0.5))
+
+        record = chunk.to_model(self.session.id, self.student.id)
+        self.assertEqual(len(record.data), 3 * CHUNK_SIZE - 2)
+        record.save()
+
+        timestamps, scores = read_session_series(self.session.id)[self.student.id]
+        self.assertEqual(len(timestamps), CHUNK_SIZE)
+        self.assertAlmostEqual(timestamps[-1] - timestamps[0], 0.2 * (CHUNK_SIZE - 1), places=3)
+        self.assertAlmostEqual(scores[42], 0.42, delta=1 / SCORE_LEVELS)
+
+    def test_long_gaps_start_a_new_chunk(self):
+        start = timezone.now()
+        chunk = ChunkBuilder(start)
+        chunk.append(start, 0.5)
+        self.assertFalse(chunk.append(start + timedelta(minutes=2), 0.5))
+        self.assertEqual(len(chunk), 1)
+
+
+class FocusRollupTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.instructor = User.objects.create_user(
+            email='instructor@example.com',
+            password='password123',
+            full_name='Instructor User',
+            role='instructor'
+        )
+        self.student = User.objects.create_user(
+            email='student@example.com',
+            password='password123',
+            full_name='Student User',
+            role='student'
+        )
+        self.classroom = Classroom.objects.create(
+            name='Test Classroom',
+            description='A classroom for testing',
+            instructor=self.instructor,
+            join_code=str(uuid.uuid4()).split('-')[0]
+        )
+        Enrollment.objects.create(student=self.student, classroom=self.classroom)
+        self.session = Session.objects.create(
+            classroom=self.classroom,
+            start_time=timezone.now() - timedelta(minutes=30)
+        )
+        self.url = f'/api/sessions/{self.session.id}/performances/timeline/'
+        live_rollups.take(final=True)
+
+    def tearDown(self):
+        live_rollups.take(final=True)
+
+    def test_pick_resolution(self):
+        self.assertEqual(pick_resolution(3600, 120), 10)
+        self.assertEqual(pick_resolution(3600, 12), 300)
+        self.assertEqual(pick_resolution(3600, 60), 60)
+        self.assertEqual(pick_resolution(30, 120), 10)
+
+    def test_buckets_close_as_time_moves_on(self):
+        rollups = LiveRollups()
+        start = self.session.start_time.replace(second=0, microsecond=0)
+        for i, score in enumerate((0.2, 0.4, 0.9)):
+            rollups.add(self.session.id, self.student.id, start + timedelta(seconds=6 * i), score)
+
+        closed = rollups.take()
+        # The third sample opened a new 10s bucket, per student and for the session
+        self.assertEqual({(key[1], resolution) for key, resolution, _ in closed},
+                         {(None, 10), (self.student.id, 10)})
+        record = rollup_to_model(*closed[0])
+        self.assertEqual(record.count, 2)
+        self.assertAlmostEqual(record.min_score, 0.2)
+        self.assertAlmostEqual(record.max_score, 0.4)
+        self.assertAlmostEqual(record.mean_score, 0.3)
+
+        final = rollups.take(final=True)
+        self.assertEqual(len(final), 2 * 3)
+        self.assertEqual(rollups.take(final=True), [])
+
+    def test_timeline_merges_stored_and_live_buckets(self):
+        start = self.session.start_time.replace(second=0, microsecond=0)
+        for i in range(3):
+            live_rollups.add(self.session.id, self.student.id, start + timedelta(seconds=i), 0.5 + i / 10)
+        records = [rollup_to_model(*rollup) for rollup in live_rollups.take(final=True)]
+        FocusRollup.objects.bulk_create(records)
+        live_rollups.add(self.session.id, self.student.id, start + timedelta(seconds=5), 0.1)
+
+        self.client.force_authenticate(user=self.instructor)
+        response = self.client.get(self.url, {'points': 120})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['resolution'], 10)
+        bucket = response.data['buckets'][0]
+        self.assertEqual(bucket['count'], 4)
+        self.assertAlmostEqual(bucket['min'], 0.1)
+        self.assertAlmostEqual(bucket['max'], 0.7)
+        self.assertAlmostEqual(bucket['mean'], 0.475)
+
+    def test_timeline_falls_back_to_performance_rows(self):
+        Performance.objects.create(session=self.session, student=self.student, focus_score=0.8)
+        self.client.force_authenticate(user=self.instructor)
+        response = self.client.get(self.url, {'student': self.student.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['buckets']), 1)
+        self.assertEqual(response.data['buckets'][0]['mean'], 0.8)
+
+    def test_student_only_sees_own_timeline(self):
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(self.url, {'student': self.instructor.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['student'], self.student.id)
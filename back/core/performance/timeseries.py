@@ -0,0 +1,108 @@
+"""
+Compact chunked encoding of focus samples.
+
+Samples of one student are packed into FocusChunk rows of up to CHUNK_SIZE
+samples: scores are quantized to one byte and timestamps are stored as
+millisecond deltas from the previous sample on two bytes, so a sample costs
+three bytes instead of a full ORM row.
+"""
+import sys
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+
+from .models import FocusChunk
+
+CHUNK_SIZE = 256
+SCORE_LEVELS = 255
+MAX_DELTA_MS = 0xFFFF
+
+
+def quantize(focus_score):
+    return round(min(max(focus_score, 0.0), 1.0) * SCORE_LEVELS)
+
+
+def dequantize(level):
+    return level / SCORE_LEVELS
+
+
+class ChunkBuilder:
+    """An open chunk that samples are appended to until it is full"""
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.end_time = start_time
+        self.scores = array('B')
+        self.deltas = array('H')
+
+    def __len__(self):
+        return len(self.scores)
+
+    @property
+    def full(self):
+        return len(self.scores) >= CHUNK_SIZE
+
+    def append(self, timestamp, focus_score):
+        """Add a sample. Returns False if it does not fit in this chunk."""
+        if self.full:
+            return False
+        if self.scores:
+            delta = round((timestamp - self.end_time).total_seconds() * 1000)
+            if delta > MAX_DELTA_MS:
+                return False
+            # Out-of-order samples are pinned to the previous timestamp
+            delta = max(delta, 0)
+            self.deltas.append(delta)
+            self.end_time += timedelta(milliseconds=delta)
+        self.scores.append(quantize(focus_score))
+        return True
+
+    def encode(self):
+        deltas = array('H', self.deltas)
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        return self.scores.tobytes() + deltas.tobytes()
+
+    def to_model(self, session_id, student_id):
+        return FocusChunk(
+            session_id=session_id,
+            student_id=student_id,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            sample_count=len(self),
+            data=self.encode()
+        )
+
+
+def decode_chunk(chunk):
+    """Return (timestamps in epoch seconds, focus scores) of a chunk"""
+    data = bytes(chunk.data)
+    count = chunk.sample_count
+    scores = array('B', data[:count])
+    deltas = array('H', data[count:count + 2 * (count - 1)])
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+
+    timestamps = array('d', [chunk.start_time.timestamp()])
+    for delta in deltas:
+        timestamps.append(timestamps[-1] + delta / 1000)
+    return timestamps, array('f', (dequantize(level) for level in scores))
+
+
+def read_session_series(session_id, student_id=None):
+    """
+    Decode the stored focus history of a session into arrays.
+
+    Returns {student_id: (timestamps, scores)} where timestamps is an
+    array('d') of epoch seconds and scores an array('f') of focus scores.
+    """
+    chunks = FocusChunk.objects.filter(session_id=session_id)
+    if student_id is not None:
+        chunks = chunks.filter(student_id=student_id)
+
+    series = defaultdict(lambda: (array('d'), array('f')))
+    for chunk in chunks.order_by('student_id', 'start_time').iterator():
+        timestamps, scores = decode_chunk(chunk)
+        student_timestamps, student_scores = series[chunk.student_id]
+        student_timestamps.extend(timestamps)
+        student_scores.extend(scores)
+    return dict(series)
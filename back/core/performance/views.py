@@ -4,8 +4,10 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Avg, Count
 from .models import Performance
+from .rollups import get_timeline
 from .serializers import PerformanceCreateUpdateSerializer, PerformanceSerializer, PerformanceAggregateSerializer
 from session.models import Session
+from classrooms.cache import get_session_role
 from django.shortcuts import get_object_or_404
 
 class PerformanceViewSet(viewsets.ModelViewSet):
@@ -60,4 +62,37 @@ class PerformanceViewSet(viewsets.ModelViewSet):
         }
 
         serializer = PerformanceAggregateSerializer(data)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def timeline(self, request, session_pk=None):
+        # Focus timeline of the session (instructor) or of one student.
+        # Students can only see their own timeline.
+        session = get_object_or_404(Session, pk=session_pk)
+        student_id = request.query_params.get('student')
+
+        role = get_session_role(request.user, session.id)
+        if role is None:
+            return Response(
+                {'error': 'You do not have access to this session'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if role != 'instructor':
+            student_id = request.user.id
+
+        try:
+            points = min(max(int(request.query_params.get('points', 120)), 1), 1000)
+            student_id = int(student_id) if student_id is not None else None
+        except ValueError:
+            return Response(
+                {'error': 'points and student must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resolution, buckets = get_timeline(session, student_id, points)
+        return Response({
+            'session': session.id,
+            'student': student_id,
+            'resolution': resolution,
+            'buckets': buckets,
+        })
@@ -0,0 +1,140 @@
+"""
+Admission control of WebSocket handshakes.
+
+After a Redis or server restart every client reconnects at once, and each
+handshake costs a token check and several queries before it is accepted.
+Handshakes are admitted in front of that work:
+
+    - at most ADMISSION_MAX_HANDSHAKES handshakes run at once in a process
+    - every client address draws from a token bucket, refilled at
+      ADMISSION_IP_RATE per second
+    - tokens that failed to authenticate are remembered for
+      ADMISSION_NEGATIVE_TTL seconds and refused by the JWT middleware
+      without being decoded again
+
+These three are checked by the outermost middleware of the WebSocket stack
+(middleware.AdmissionMiddleware) and the JWT middleware, before the token
+is decoded and the user loaded. A handshake holds its slot until it is
+accepted or refused. Once authenticated, every user also draws from a
+bucket refilled at ADMISSION_USER_RATE per second, checked by the consumer.
+
+Rejected clients are accepted then closed with code 4429 and a
+"retry_after=<seconds>" reason. The delay is the time until the client
+would be admitted plus a random jitter of up to ADMISSION_RETRY_JITTER
+seconds, which spreads the retries of a reconnect storm evenly over that
+window instead of sending them back in lockstep.
+
+Sessions that do not exist are refused from the negative entries of the
+access cache (classrooms.cache), which Session saves invalidate.
+
+Like the rest of the runtime state this is kept per process.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from classrooms.cache import session_classrooms
+from core.caching import MISSING, TieredCache
+
+from .conf import get_setting
+from .metrics import metrics
+
+# Close code of rejected handshakes
+CLOSE_RETRY_LATER = 4429
+
+# Token buckets kept per kind, the least recently used ones are dropped
+MAX_BUCKETS = 10000
+
+
+class Admission:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handshakes = 0
+        self.buckets = OrderedDict()
+        self.bad_tokens = TieredCache(
+            'admission_token',
+            local_timeout=get_setting('ADMISSION_NEGATIVE_TTL'),
+            max_entries=MAX_BUCKETS
+        )
+
+    def enter(self, client_host=None, now=None):
+        """
+        Take a handshake slot for a client address.
+        Returns None if admitted, else the seconds the client should wait.
+        """
+        with self.lock:
+            if self.handshakes >= get_setting('ADMISSION_MAX_HANDSHAKES'):
+                return self.reject('handshakes', 0.0)
+            if client_host is not None:
+                wait = self.take('ip', client_host, now)
+                if wait:
+                    return self.reject('ip', wait)
+            self.handshakes += 1
+            metrics.set('admission.handshakes', self.handshakes)
+            return None
+
+    def leave(self):
+        """Release the handshake slot taken by enter()"""
+        with self.lock:
+            self.handshakes -= 1
+            metrics.set('admission.handshakes', self.handshakes)
+
+    def throttle(self, user_id, now=None):
+        """Draw a handshake of an authenticated user, returns the wait as enter() does"""
+        with self.lock:
+            wait = self.take('user', user_id, now)
+            return self.reject('user', wait) if wait else None
+
+    def take(self, kind, key, now=None):
+        """Take a token from a bucket, returns 0 or the seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        rate = get_setting(f'ADMISSION_{kind.upper()}_RATE')
+        burst = get_setting(f'ADMISSION_{kind.upper()}_BURST')
+        tokens, updated = self.buckets.pop((kind, key), (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self.buckets[(kind, key)] = (tokens, now)
+        while len(self.buckets) > MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        return wait
+
+    def reject(self, reason, wait):
+        """Retry delay of a rejected handshake, jittered"""
+        metrics.incr(f'admission.rejected.{reason}')
+        retry_after = max(wait, get_setting('ADMISSION_RETRY_AFTER'))
+        return round(retry_after + random.uniform(0, get_setting('ADMISSION_RETRY_JITTER')), 1)
+
+    def token_key(self, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def is_bad_token(self, token):
+        if self.bad_tokens.get(self.token_key(token)):
+            metrics.incr('admission.negative_hits')
+            return True
+        return False
+
+    def remember_bad_token(self, token):
+        self.bad_tokens.set_local(self.token_key(token), True)
+
+    def is_missing_session(self, session_id):
+        """True if the access cache of this process knows the session does not exist"""
+        if session_classrooms.get_local(str(session_id), MISSING) is None:
+            metrics.incr('admission.negative_hits')
+            return True
+        return False
+
+    def clear(self):
+        """Forget the buckets and bad tokens, e.g. between tests"""
+        with self.lock:
+            self.buckets.clear()
+        self.bad_tokens.clear()
+
+
+# Global admission instance
+admission = Admission()
@@ -0,0 +1,341 @@
+"""
+Incremental, in-memory focus aggregation for live sessions.
+
+A SessionAggregator keeps, for every student of the session roster, the
+latest focus score and the time it was received in flat arrays indexed by
+roster position. The roster is kept sorted by user id, so the position of a
+student is found by bisection without a dict. Students with a sample inside the sliding window are kept
+in a recency-ordered linked list (also array-backed), so both recording a
+sample and expiring old ones are O(1), and session stats are read from
+running sums without touching the database.
+
+Only samples of students on the roster are counted, anything else (e.g. the
+id of an instructor or a stale client) is ignored and counted as the
+aggregator.unknown_samples metric. Students enrolled after the roster was
+loaded are added when they connect.
+
+Every worker serving a session keeps its own aggregator. Samples recorded
+on one worker are published to the others over the channel layer (in the
+session's aggregator group, which every worker joins with a process channel),
+so each aggregator holds the samples of the whole session rather than those
+of its local students.
+"""
+import asyncio
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from channels.layers import get_channel_layer
+from django.utils import timezone
+
+from classrooms.models import Enrollment
+from performance.models import Performance
+from .conf import get_setting
+from .db import db_sync_to_async
+from .metrics import metrics
+from .ticker import tickers
+
+logger = logging.getLogger(__name__)
+
+# Scores are stored as unsigned 16-bit ten-thousandths
+SCORE_SCALE = 10000
+HIGH_FOCUS = 8000
+MEDIUM_FOCUS = 6000
+
+# Sample times are stored as deciseconds since the aggregator epoch,
+# starting at 1 so that 0 means "not in the window"
+TICKS_PER_SECOND = 10
+NIL = 0xFFFF
+# Roster positions must stay below NIL
+MAX_ROSTER = NIL - 1
+
+
+class SessionAggregator:
+    """
+    Running focus statistics of one session.
+
+    Memory per roster entry is 14 bytes: user id, score, last sample time
+    and the two links of the recency list. Rosters are limited to
+    MAX_ROSTER students, further students are not counted.
+    """
+    def __init__(self, roster=(), window=None, now=None):
+        window = window or get_setting('STATS_WINDOW')
+        self.window = TICKS_PER_SECOND * window
+        # Start one window early so samples seeded from the database fit
+        self.epoch = (time.monotonic() if now is None else now) - window
+        self.user_ids = array('I')
+        self.scores = array('H')
+        self.seen = array('I')
+        self.prev = array('H')
+        self.next = array('H')
+        self.head = self.tail = NIL
+        self.active = 0
+        self.total = 0
+        self.distribution = [0, 0, 0]  # high, medium, low
+        # Bumped whenever the window changes, stats are stale until resent
+        self.version = 0
+        for user_id in sorted(set(roster)):
+            self.enroll(user_id)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def position(self, user_id):
+        """Roster position of a student, None if not on the roster"""
+        index = bisect_left(self.user_ids, user_id)
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            return index
+        return None
+
+    def enroll(self, user_id):
+        """
+        Roster position of a student, inserting them if not on the roster yet.
+        Returns None if the roster is full.
+        """
+        index = bisect_left(self.user_ids, user_id)
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            return index
+        if len(self.user_ids) >= MAX_ROSTER:
+            metrics.incr('aggregator.roster_full')
+            return None
+
+        if index < len(self.user_ids):
+            # Students after the new one move up one position
+            for links in (self.prev, self.next):
+                for i, link in enumerate(links):
+                    if link != NIL and link >= index:
+                        links[i] = link + 1
+            if self.head != NIL and self.head >= index:
+                self.head += 1
+            if self.tail != NIL and self.tail >= index:
+                self.tail += 1
+        self.user_ids.insert(index, user_id)
+        self.scores.insert(index, 0)
+        self.seen.insert(index, 0)
+        self.prev.insert(index, NIL)
+        self.next.insert(index, NIL)
+        return index
+
+    def ticks(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(int((now - self.epoch) * TICKS_PER_SECOND) + 1, 1)
+
+    def add(self, user_id, focus_score, now=None):
+        """Record the latest focus score of a student. Returns False if not on the roster."""
+        index = self.position(user_id)
+        if index is None:
+            metrics.incr('aggregator.unknown_samples')
+            return False
+        tick = self.ticks(now)
+        self.expire(tick)
+        if self.seen[index]:
+            self.drop(index)
+
+        score = round(min(max(focus_score, 0.0), 1.0) * SCORE_SCALE)
+        self.scores[index] = score
+        self.seen[index] = tick
+        self.total += score
+        self.distribution[self.bucket(score)] += 1
+        self.active += 1
+        self.version += 1
+
+        # Append to the tail of the recency list
+        self.prev[index] = self.tail
+        self.next[index] = NIL
+        if self.tail == NIL:
+            self.head = index
+        else:
+            self.next[self.tail] = index
+        self.tail = index
+        return True
+
+    def remove(self, user_id):
+        """Take a student out of the window, e.g. when they leave"""
+        index = self.position(user_id)
+        if index is not None and self.seen[index]:
+            self.drop(index)
+
+    def expire(self, tick):
+        threshold = tick - self.window
+        while self.head != NIL and self.seen[self.head] < threshold:
+            self.drop(self.head)
+
+    def drop(self, index):
+        score = self.scores[index]
+        self.total -= score
+        self.distribution[self.bucket(score)] -= 1
+        self.active -= 1
+        self.version += 1
+        self.seen[index] = 0
+
+        before, after = self.prev[index], self.next[index]
+        if before == NIL:
+            self.head = after
+        else:
+            self.next[before] = after
+        if after == NIL:
+            self.tail = before
+        else:
+            self.prev[after] = before
+
+    @staticmethod
+    def bucket(score):
+        if score >= HIGH_FOCUS:
+            return 0
+        if score >= MEDIUM_FOCUS:
+            return 1
+        return 2
+
+    def focus_map(self, now=None):
+        """Latest focus score of every student inside the window"""
+        self.expire(self.ticks(now))
+        scores = {}
+        index = self.head
+        while index != NIL:
+            scores[self.user_ids[index]] = round(self.scores[index] / SCORE_SCALE, 3)
+            index = self.next[index]
+        return scores
+
+    def get_stats(self, session_duration=0.0, now=None):
+        """Session stats in the shape broadcast as session.stats"""
+        self.expire(self.ticks(now))
+        average = self.total / self.active / SCORE_SCALE if self.active else 0
+        high, medium, low = self.distribution
+        return {
+            'total_participants': len(self),
+            'active_participants': self.active,
+            'average_focus_score': round(average, 3),
+            'session_duration': session_duration,
+            'focus_distribution': {
+                'high': high,
+                'medium': medium,
+                'low': low
+            }
+        }
+
+
+def feed_group(session_id):
+    return f'session_{session_id}_aggregators'
+
+
+class AggregatorRegistry:
+    """Process-wide registry of the aggregators of the sessions served locally"""
+    def __init__(self):
+        self.aggregators = {}
+        # Process channel receiving the samples of the other workers
+        self.layer = None
+        self.channel = None
+        self.task = None
+
+    def get(self, session_id):
+        return self.aggregators.get(str(session_id))
+
+    async def load(self, session_id):
+        """Return the aggregator of a session, building it on first use"""
+        session_id = str(session_id)
+        if session_id not in self.aggregators:
+            roster, recent = await load_session_roster(session_id)
+            # Another connection may have loaded it in the meantime
+            if session_id not in self.aggregators:
+                aggregator = SessionAggregator(roster)
+                now = time.monotonic()
+                for student_id, focus_score, age in recent:
+                    aggregator.add(student_id, focus_score, now=now - age)
+                self.aggregators[session_id] = aggregator
+                await self.subscribe(session_id)
+        return self.aggregators[session_id]
+
+    def discard(self, session_id):
+        session_id = str(session_id)
+        if self.aggregators.pop(session_id, None) is not None and self.channel is not None:
+            try:
+                asyncio.get_running_loop().create_task(self.layer.group_discard(feed_group(session_id), self.channel))
+            except RuntimeError:
+                pass
+
+    async def subscribe(self, session_id):
+        """Receive the samples recorded by the other workers of a session"""
+        layer = get_channel_layer()
+        if self.task is None or self.task.done() or self.layer is not layer \
+                or self.task.get_loop() is not asyncio.get_running_loop():
+            self.layer = layer
+            self.channel = await layer.new_channel('aggregators.')
+            self.task = asyncio.create_task(self.receive())
+        await layer.group_add(feed_group(session_id), self.channel)
+
+    async def receive(self):
+        while True:
+            message = await self.layer.receive(self.channel)
+            try:
+                self.apply(message)
+            except Exception as e:
+                logger.exception(f"Invalid aggregator message {message}: {e}")
+
+    def apply(self, message):
+        """Apply a sample published by another worker"""
+        aggregator = self.get(message['session_id'])
+        if aggregator is None or message.get('origin') == self.channel:
+            return
+        if message['type'] == 'focus.sample':
+            # The worker of the student checked their access to the session
+            aggregator.enroll(message['user_id'])
+            aggregator.add(message['user_id'], message['focus_score'])
+        elif message['type'] == 'focus.remove':
+            aggregator.remove(message['user_id'])
+
+    async def publish(self, session_id, message):
+        try:
+            await get_channel_layer().group_send(
+                feed_group(session_id),
+                {**message, 'session_id': str(session_id), 'origin': self.channel}
+            )
+        except Exception as e:
+            logger.warning(f"Could not publish {message['type']} of session {session_id}: {e}")
+
+    async def record(self, session_id, user_id, focus_score):
+        """Record the latest focus score of a student on every worker of the session"""
+        aggregator = self.get(session_id)
+        if aggregator is not None:
+            aggregator.add(user_id, focus_score)
+        await self.publish(session_id, {'type': 'focus.sample', 'user_id': user_id, 'focus_score': focus_score})
+
+    async def remove(self, session_id, user_id):
+        """Take a student out of the window on every worker of the session"""
+        aggregator = self.get(session_id)
+        if aggregator is not None:
+            aggregator.remove(user_id)
+        await self.publish(session_id, {'type': 'focus.remove', 'user_id': user_id})
+
+
+@db_sync_to_async
+def load_session_roster(session_id):
+    """
+    Enrolled students of a session, and the scores still inside the window
+    as (student id, focus score, age in seconds) sorted oldest first.
+    """
+    now = timezone.now()
+    window = get_setting('STATS_WINDOW')
+    roster = list(
+        Enrollment.objects.filter(
+            classroom__sessions__id=session_id,
+            student__role='student'
+        ).values_list('student_id', flat=True)
+    )
+    recent = [
+        (student_id, focus_score or 0.0, (now - timestamp).total_seconds())
+        for student_id, focus_score, timestamp in Performance.objects.filter(
+            session_id=session_id,
+            attended=True,
+            student__role='student',
+            timestamp__gte=now - timedelta(seconds=window)
+        ).order_by('timestamp').values_list('student_id', 'focus_score', 'timestamp')
+    ]
+    return roster, recent
+
+
+# Global aggregator registry instance, dropping a session's aggregator
+# together with its ticker
+aggregators = AggregatorRegistry()
+tickers.register_stop(aggregators.discard)
@@ -0,0 +1,112 @@
+"""
+Compact binary framing of the busiest session events.
+
+Clients opt in by offering the SUBPROTOCOL WebSocket subprotocol; JSON text
+frames stay the default and are still used for rare events (controls, chat,
+stats, clock syncs, errors). With the subprotocol, focus updates and
+joins/leaves are sent as little-endian binary frames that refer to users by
+their index in a per-connection roster, sent once after connecting and
+extended with an entry frame the first time an unknown user shows up.
+
+Frames start with an opcode byte:
+
+    ROSTER        B Q H {H I B B name}*  base time (epoch ms), entry count, entries
+    ROSTER_ENTRY  B H I B B name         index, user id, role, name length, name
+    FOCUS         B H I B                index, ms since base time, score (0-255)
+    JOINED, LEFT  B H I                  index, ms since base time
+
+Clients may send FOCUS_SAMPLE frames (B B, quantized score) instead of JSON
+focus updates.
+"""
+import struct
+import time
+from datetime import datetime
+
+from performance.timeseries import SCORE_LEVELS, quantize
+
+SUBPROTOCOL = 'edufocus.bin.v1'
+
+# Server to client
+OP_ROSTER = 0x01
+OP_ROSTER_ENTRY = 0x02
+OP_FOCUS = 0x10
+OP_JOINED = 0x11
+OP_LEFT = 0x12
+
+# Client to server
+OP_FOCUS_SAMPLE = 0x20
+
+ROLES = ('student', 'instructor')
+MAX_NAME_BYTES = 255
+
+ROSTER_HEADER = struct.Struct('<BQH')
+ROSTER_ENTRY = struct.Struct('<HIBB')
+FOCUS = struct.Struct('<BHIB')
+PRESENCE = struct.Struct('<BHI')
+FOCUS_SAMPLE = struct.Struct('<BB')
+
+
+def encode_name(name):
+    return (name or '').encode('utf-8')[:MAX_NAME_BYTES].decode('utf-8', 'ignore').encode('utf-8')
+
+
+class RosterEncoder:
+    """Binary encoder of the events sent to one connection"""
+    def __init__(self, now=None):
+        self.base = int((time.time() if now is None else now) * 1000)
+        self.indexes = {}
+
+    def entry(self, user_id, name, role):
+        index = self.indexes[user_id] = len(self.indexes)
+        name = encode_name(name)
+        role = ROLES.index(role) if role in ROLES else 0xFF
+        return ROSTER_ENTRY.pack(index, user_id, role, len(name)) + name
+
+    def roster(self, users):
+        """Roster frame of (user id, name, role), resetting the indexes"""
+        self.indexes = {}
+        entries = b''.join(self.entry(*user) for user in users)
+        return ROSTER_HEADER.pack(OP_ROSTER, self.base, len(self.indexes)) + entries
+
+    def index(self, event):
+        """Roster index of the user of an event, and the entry frame to send first if new"""
+        user_id = event['user_id']
+        index = self.indexes.get(user_id)
+        if index is not None:
+            return index, None
+        frame = bytes([OP_ROSTER_ENTRY]) + self.entry(user_id, event.get('user_name'), event.get('user_role'))
+        return self.indexes[user_id], frame
+
+    def offset(self, timestamp):
+        """Milliseconds between the base time and an ISO timestamp"""
+        if not timestamp:
+            return max(int(time.time() * 1000) - self.base, 0)
+        epoch_ms = int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+        return min(max(epoch_ms - self.base, 0), 0xFFFFFFFF)
+
+    def focus(self, event):
+        """Frames of a focus.update event"""
+        index, entry = self.index(event)
+        frame = FOCUS.pack(OP_FOCUS, index, self.offset(event.get('timestamp')), quantize(event['focus_score']))
+        return [entry, frame] if entry else [frame]
+
+    def presence(self, opcode, event):
+        """Frames of a session.joined or session.left event"""
+        index, entry = self.index(event)
+        frame = PRESENCE.pack(opcode, index, self.offset(event.get('timestamp')))
+        return [entry, frame] if entry else [frame]
+
+
+def decode_client_frame(data):
+    """
+    Decode a binary frame sent by a client into the equivalent JSON message.
+    Raises ValueError on unknown or malformed frames.
+    """
+    if not data:
+        raise ValueError('Empty frame')
+    if data[0] == OP_FOCUS_SAMPLE:
+        if len(data) != FOCUS_SAMPLE.size:
+            raise ValueError('Malformed focus frame')
+        _, level = FOCUS_SAMPLE.unpack(data)
+        return {'type': 'focus_update', 'focus_score': level / SCORE_LEVELS}
+    raise ValueError(f'Unknown opcode {data[0]}')
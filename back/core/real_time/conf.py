@@ -0,0 +1,91 @@
+"""
+Settings for the real_time app.
+
+Values are read from the ``REAL_TIME`` dict in Django settings and fall back
+to the defaults below, so every knob can be tuned per deployment.
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    # Cache alias of the ticker leases when REDIS_URL is not set
+    'CACHE_ALIAS': 'default',
+    # Threads running the database work of consumers, tickers and aggregators
+    'DB_EXECUTOR_THREADS': 8,
+    # Seconds between two ticks of a session ticker, jobs rate limit themselves
+    'TICKER_INTERVAL': 0.5,
+    # Seconds a ticker lease stays valid without being renewed
+    'TICKER_LEASE_TIMEOUT': 5,
+    # Seconds between two reloads of the session row by its ticker
+    'TICKER_REFRESH_INTERVAL': 5.0,
+    # Minimum seconds between two session.stats broadcasts of a session
+    'STATS_INTERVAL': 2.0,
+    # Seconds a focus sample counts towards the live session stats
+    'STATS_WINDOW': 120,
+    # Roster size from which a session runs in webinar mode
+    'WEBINAR_THRESHOLD': 200,
+    # Seconds between two class.summary broadcasts of a webinar session
+    'CLASS_SUMMARY_INTERVAL': 5.0,
+    # Minimum seconds between two dashboard.delta frames of a session
+    'DASHBOARD_INTERVAL': 0.5,
+    # Smallest focus score change sent in a dashboard.delta frame
+    'DASHBOARD_THRESHOLD': 0.02,
+    # 'buffered' writes focus scores behind, 'immediate' flushes every sample
+    'FOCUS_WRITE_MODE': 'buffered',
+    # Milliseconds between two flushes of the focus write buffer
+    'FOCUS_FLUSH_INTERVAL_MS': 1000,
+    # Pending rows that trigger an early flush of the focus write buffer
+    'FOCUS_FLUSH_MAX_ROWS': 500,
+    # Milliseconds between two flushes of the chat write buffer
+    'CHAT_FLUSH_INTERVAL_MS': 500,
+    # Pending messages that trigger an early flush of the chat write buffer
+    'CHAT_FLUSH_MAX_ROWS': 200,
+    # Seconds after which an open focus chunk is written even if not full
+    'FOCUS_CHUNK_MAX_AGE': 60,
+    # Frames queued for a connection before the oldest droppable one is dropped
+    'OUTBOUND_MAX_FRAMES': 256,
+    # Seconds a queued frame may wait before its connection is closed
+    'OUTBOUND_MAX_LAG': 10.0,
+    # Longest batching window, in milliseconds, a client may negotiate
+    'OUTBOUND_BATCH_MAX_MS': 50,
+    # Maximum number of samples in a focus_batch message
+    'FOCUS_BATCH_MAX_SAMPLES': 100,
+    # Longest time, in milliseconds, the samples of a focus_batch may span
+    'FOCUS_BATCH_MAX_SPAN_MS': 600000,
+    # Redis URL of the presence and event log shared by workers, None to keep
+    # them in process
+    'REDIS_URL': None,
+    # Seconds a connection stays present without a heartbeat from its worker
+    'PRESENCE_TTL': 30,
+    # Seconds between two presence heartbeats of a worker
+    'PRESENCE_HEARTBEAT_INTERVAL': 10,
+    # Handling of users connected more than once to a session: 'all' keeps
+    # every connection, 'newest' closes the older ones, 'reject' the new one
+    'DUPLICATE_CONNECTIONS': 'all',
+    # Seconds between two heartbeats sent to every connection
+    'HEARTBEAT_INTERVAL': 15,
+    # Seconds without a message from a client before its connection is reaped
+    'IDLE_TIMEOUT': 45,
+    # Events of a session kept for clients resuming after a reconnect
+    'EVENT_LOG_SIZE': 1000,
+    # Seconds the shared event log of an idle session is kept
+    'EVENT_LOG_TTL': 3600,
+    # WebSocket handshakes a process runs at once, others are told to retry
+    'ADMISSION_MAX_HANDSHAKES': 50,
+    # Handshakes per second and burst allowed per client address
+    'ADMISSION_IP_RATE': 20.0,
+    'ADMISSION_IP_BURST': 100,
+    # Handshakes per second and burst allowed per user
+    'ADMISSION_USER_RATE': 0.5,
+    'ADMISSION_USER_BURST': 10,
+    # Seconds a token that failed to authenticate is refused without a check
+    'ADMISSION_NEGATIVE_TTL': 30,
+    # Shortest retry delay given to a rejected client, in seconds
+    'ADMISSION_RETRY_AFTER': 1.0,
+    # Random seconds added to retry delays to spread reconnects
+    'ADMISSION_RETRY_JITTER': 5.0,
+}
+
+
+def get_setting(name):
+    """Return a real-time setting, falling back to its default."""
+    return getattr(settings, 'REAL_TIME', {}).get(name, DEFAULTS[name])
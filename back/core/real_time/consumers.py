@@ -1,21 +1,36 @@
 # core/real_time/consumers.py
-import json
 import logging
 import urllib.parse
 import asyncio
+import time
+from channels.exceptions import StopConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from session.models import Session
 from performance.models import Performance
+from classrooms.cache import get_session_classroom, get_session_role
 from classrooms.models import Enrollment
+from users.cache import get_user
 from django.utils import timezone
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from django.db.models import Avg, Count, Q
-from datetime import timedelta
+from core import codec
+from .admission import CLOSE_RETRY_LATER, admission
+from .aggregator import aggregators
+from .conf import get_setting
+from .binary import OP_JOINED, OP_LEFT, SUBPROTOCOL, RosterEncoder, decode_client_frame
+from .dashboard import dashboard_group, dashboard_stream
+from .db import db_sync_to_async
+from .eventlog import event_log
+from .groups import ALL, local_group, role_group, send_event
+from .ingest import InvalidBatch, align_samples, focus_batches, parse_batch
+from .outbound import CHAT, CONTROL, STATE, OutboundQueue
+from .persistence import chat_buffer, focus_buffer
+from .presence import CLOSE_DUPLICATE, CLOSE_REPLACED, presence
+from .protocol import protocol
+from .reaper import CLOSE_IDLE, reaper
+from .stats import stats_broadcaster
+from .ticker import tickers
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -25,25 +40,41 @@ class SessionConsumer(AsyncWebsocketConsumer):
         super().__init__(*args, **kwargs)
         self.session_id = None
         self.session_group_name = None
+        self.role_group_name = None
         self.user = None
         self.user_role = None
-        self.timer_task = None
-        self.running = True
-        self.connected_users = set()
+        self.ticker_joined = False
+        self.stats_subscribed = False
+        self.dashboard_subscribed = False
+        self.binary = None
+        self.outbound = None
+        # Forced disconnect of a stalled connection, referenced until it ran
+        self.close_task = None
+        self.present = False
+        self.replayed_seq = 0
+        self.last_seen = None
+        self.cleaned_up = False
 
     async def connect(self):
+        # Handshakes were admitted by AdmissionMiddleware, before authentication
         try:
             self.session_id = self.scope['url_route']['kwargs']['session_id']
             self.session_group_name = f'session_{self.session_id}'
             logger.info(f'Connecting to session {self.session_id}')
 
+            qs = self.scope.get('query_string', b'').decode()
+            params = urllib.parse.parse_qs(qs)
+
             # Authentication
             self.user = self.scope.get('user')
             user_is_auth = getattr(self.user, "is_authenticated", False)
             
+            if admission.is_missing_session(self.session_id):
+                logger.error(f'Session {self.session_id} does not exist')
+                await self.close(code=4003)
+                return
+
             if not user_is_auth:
-                qs = self.scope.get('query_string', b'').decode()
-                params = urllib.parse.parse_qs(qs)
                 token = params.get('token', [None])[0]
                 
                 if token:
@@ -61,6 +92,11 @@ class SessionConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4001)
                 return
 
+            retry_after = admission.throttle(self.user.id)
+            if retry_after is not None:
+                await self.reject(retry_after)
+                return
+
             # Check session access
             has_access = await self.check_session_access()
             if not has_access:
@@ -68,14 +104,41 @@ class SessionConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4003)
                 return
 
-            # Join session group
-            await self.channel_layer.group_add(self.session_group_name, self.channel_name)
-            await self.accept()
+            # Join the session and role groups, using the binary protocol if offered
+            self.role_group_name = role_group(self.session_id, getattr(self.user, 'role', None))
+            for group in (self.session_group_name, self.role_group_name):
+                await self.channel_layer.group_add(group, self.channel_name)
+                await self.channel_layer.group_add(local_group(group), self.channel_name)
+            if SUBPROTOCOL in self.scope.get('subprotocols', []):
+                self.binary = RosterEncoder()
+                await self.accept(subprotocol=SUBPROTOCOL)
+            else:
+                await self.accept()
+
+            # JSON clients may have their frames batched over a short window
+            batch_ms = self.get_batch_window(params)
+            self.outbound = OutboundQueue(
+                super().send,
+                self.outbound_stalled,
+                batch_window=batch_ms / 1000 if batch_ms else None
+            )
 
-            # Store user connection
+            # Register the connection in the session presence, applying the
+            # policy for users already connected
             user_id = getattr(self.user, 'id', None)
-            if user_id:
-                self.connected_users.add(user_id)
+            connections = await presence.join(self.session_id, user_id, self.user.role, self.channel_name)
+            self.present = True
+            if connections > 1:
+                policy = get_setting('DUPLICATE_CONNECTIONS')
+                if policy == 'reject':
+                    logger.warning(f"User {user_id} is already connected to session {self.session_id}, rejecting")
+                    await self.close(code=CLOSE_DUPLICATE)
+                    return
+                if policy == 'newest':
+                    for channel_name in await presence.channels(self.session_id, user_id):
+                        if channel_name != self.channel_name:
+                            await self.channel_layer.send(channel_name, {'type': 'connection.replaced'})
+            reaper.track(self)
 
             # Send connection confirmation
             try:
@@ -85,22 +148,47 @@ class SessionConsumer(AsyncWebsocketConsumer):
                     'session_id': int(self.session_id),
                     'user_id': user_id,
                     'user_role': getattr(self.user, 'role', None),
+                    'protocol': SUBPROTOCOL if self.binary else 'json',
+                    'batch_ms': batch_ms,
+                    'seq': await event_log.latest(self.session_id),
                 }
-                await self.send(text_data=json.dumps(payload))
+                await self.send(text_data=codec.dumps(payload))
             except Exception as e:
                 logger.exception("Failed while sending connection confirmation: %s", e)
                 await self.close(code=4002)
                 return
 
-            # Start background timer task
-            await self.start_session_timer()
-
-            # Notify join and update attendance
+            # Send the session clock so the client can run the timer locally
+            clock = await self.get_clock_state()
+            if clock:
+                await self.send(text_data=codec.dumps({
+                    'type': 'timer.sync',
+                    'server_time': await self.get_current_time(),
+                    **clock
+                }))
+
+            # Binary clients get the roster once, events refer to its indexes
+            if self.binary:
+                await self.send(bytes_data=self.binary.roster(await self.get_roster()))
+
+            # Reconnecting clients get the events they missed
+            if 'resume_from' in params:
+                await self.resume(params['resume_from'][0])
+
+            # Count this connection in the session ticker and make sure the
+            # session aggregator is loaded
+            aggregator = await aggregators.load(self.session_id)
+            if self.user.role == 'student':
+                aggregator.enroll(self.user.id)
+            tickers.join(self.session_id)
+            self.ticker_joined = True
+
+            # Notify join and update attendance, once per user
             user_role = getattr(self.user, 'role', None)
-            if user_role == 'student':
+            if user_role == 'student' and connections == 1:
                 await self.update_attendance(True)
-                await self.channel_layer.group_send(
-                    self.session_group_name,
+                await send_event(
+                    self.session_id,
                     {
                         'type': 'session.joined',
                         'user_id': getattr(self.user, 'id', None),
@@ -110,8 +198,17 @@ class SessionConsumer(AsyncWebsocketConsumer):
                     }
                 )
 
-            # Send initial stats
-            await self.broadcast_session_stats()
+            # Instructors subscribe to stats, everyone gets fresh ones
+            if user_role == 'instructor':
+                stats_broadcaster.subscribe(self.session_id)
+                self.stats_subscribed = True
+            stats_broadcaster.request(self.session_id)
+
+            # Instructor dashboards get a focus map instead of every focus.update
+            if user_role == 'instructor' and params.get('dashboard', ['0'])[0] == '1':
+                await self.channel_layer.group_add(dashboard_group(self.session_id), self.channel_name)
+                self.dashboard_subscribed = True
+                await self.send(text_data=codec.dumps(dashboard_stream.subscribe(self.session_id)))
 
             logger.info(f"User {getattr(self.user, 'id', 'unknown')} connected to session {self.session_id}")
 
@@ -120,30 +217,65 @@ class SessionConsumer(AsyncWebsocketConsumer):
             await self.close(code=4000)
 
     async def disconnect(self, close_code):
+        await self.cleanup()
+
+    async def connection_reap(self, event):
+        """Drop a connection the client stopped answering on, see reaper.py"""
+        logger.warning(f"User {getattr(self.user, 'id', 'unknown')} is idle, reaping connection to session {self.session_id}")
+        await self.drop(CLOSE_IDLE)
+
+    async def connection_replaced(self, event):
+        """Drop a connection superseded by a newer one of the same user"""
+        logger.info(f"User {getattr(self.user, 'id', 'unknown')} reconnected, closing older connection to session {self.session_id}")
+        await self.drop(CLOSE_REPLACED)
+
+    async def drop(self, code):
+        await self.cleanup()
+        await self.close(code=code)
+        raise StopConsumer()
+
+    async def cleanup(self):
+        """Release everything the connection holds. Runs once, on disconnect or reap."""
+        if self.cleaned_up:
+            return
+        self.cleaned_up = True
         try:
-            self.running = False
+            reaper.untrack(self)
+            if self.outbound is not None:
+                self.outbound.close()
+
+            # Leaves are only notified after the last connection of a user
+            last_connection = False
+            if self.present:
+                self.present = False
+                last_connection = await presence.leave(self.session_id, self.user.id, self.user.role, self.channel_name)
             
-            # Remove user from connected set
-            user_id = getattr(self.user, 'id', None)
-            if user_id and user_id in self.connected_users:
-                self.connected_users.remove(user_id)
-            
-            # Cancel timer task
-            if self.timer_task and not self.timer_task.done():
-                self.timer_task.cancel()
+            if self.stats_subscribed:
+                self.stats_subscribed = False
+                stats_broadcaster.unsubscribe(self.session_id)
+
+            if self.dashboard_subscribed:
+                self.dashboard_subscribed = False
+                dashboard_stream.unsubscribe(self.session_id)
+                await self.channel_layer.group_discard(dashboard_group(self.session_id), self.channel_name)
+
+            # Count this connection out of the session ticker
+            if self.ticker_joined:
+                self.ticker_joined = False
+                await tickers.leave(self.session_id)
             
-            # Leave session group
-            if self.session_group_name:
-                await self.channel_layer.group_discard(
-                    self.session_group_name,
-                    self.channel_name
-                )
+            # Leave session and role groups
+            for group in (self.session_group_name, self.role_group_name):
+                if group:
+                    await self.channel_layer.group_discard(group, self.channel_name)
+                    await self.channel_layer.group_discard(local_group(group), self.channel_name)
             
             # Notify group about user leaving (only for students)
-            if self.user and self.user.role == 'student':
+            if last_connection and self.user.role == 'student':
+                await aggregators.remove(self.session_id, self.user.id)
                 await self.update_attendance(False)
-                await self.channel_layer.group_send(
-                    self.session_group_name,
+                await send_event(
+                    self.session_id,
                     {
                         'type': 'session.left',
                         'user_id': self.user.id,
@@ -152,12 +284,70 @@ class SessionConsumer(AsyncWebsocketConsumer):
                         'timestamp': await self.get_current_time()
                     }
                 )
+                stats_broadcaster.request(self.session_id)
                 
             logger.info(f"User {getattr(self.user, 'id', 'unknown')} disconnected from session {self.session_id}")
             
         except Exception as e:
             logger.exception(f"Error in WebSocket disconnection: {str(e)}")
 
+    async def reject(self, retry_after):
+        """Turn a handshake away, telling the client when to retry"""
+        logger.warning(f"Handshake to session {self.scope['url_route']['kwargs']['session_id']} rejected, retry after {retry_after}s")
+        await self.accept()
+        await self.close(code=CLOSE_RETRY_LATER, reason=f'retry_after={retry_after}')
+
+    async def resume(self, resume_from):
+        """
+        Replay the events of this connection's groups sent after a seq, or
+        tell the client to fetch a snapshot if they are no longer logged
+        """
+        try:
+            resume_from = int(resume_from)
+        except ValueError:
+            resume_from = -1
+        latest, events = (None, None) if resume_from < 0 else await event_log.since(self.session_id, resume_from)
+        if events is None:
+            await self.send(text_data=codec.dumps({'type': 'snapshot.required', 'seq': latest}))
+            return
+
+        groups = {self.session_group_name, self.role_group_name}
+        for group, event in events:
+            if group in groups:
+                await self.dispatch(event)
+        # Live events already replayed are dropped by dispatch()
+        self.replayed_seq = latest
+
+    async def dispatch(self, message):
+        if message.get('seq', float('inf')) <= self.replayed_seq:
+            return
+        await super().dispatch(message)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, lane=CONTROL, key=None):
+        """Queue a frame for the client, frames are written by the outbound queue"""
+        if self.outbound is None or close:
+            await super().send(text_data, bytes_data, close)
+        else:
+            self.outbound.put(text_data if text_data is not None else bytes_data, lane, key)
+
+    def get_batch_window(self, params):
+        """Batching window in milliseconds requested with ?batch_ms=, capped"""
+        if self.binary:
+            return None
+        try:
+            batch_ms = int(params.get('batch_ms', [0])[0])
+        except ValueError:
+            return None
+        if batch_ms <= 0:
+            return None
+        return min(batch_ms, get_setting('OUTBOUND_BATCH_MAX_MS'))
+
+    def outbound_stalled(self):
+        """Disconnect a client that cannot keep up with its frames"""
+        logger.warning(f"User {getattr(self.user, 'id', 'unknown')} is too slow, closing connection to session {self.session_id}")
+        if self.close_task is None:
+            self.close_task = asyncio.create_task(self.close(code=4008))
+
     async def broadcast_message(self, event):
         """
         Handle broadcast messages from the channel layer.
@@ -173,41 +363,48 @@ class SessionConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.exception(f"Error in broadcast_message: {e}")
 
-    async def receive(self, text_data):
-        try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid JSON format'}))
-            return
+    async def receive(self, text_data=None, bytes_data=None):
+        # Any message, heartbeat answers included, keeps the connection alive
+        self.last_seen = time.monotonic()
+        if bytes_data is not None:
+            if not self.binary:
+                await self.send(text_data=codec.dumps({'type': 'error', 'message': protocol.reject('frame', f'Binary frames require the {SUBPROTOCOL} subprotocol')}))
+                return
+            try:
+                data = decode_client_frame(bytes_data)
+            except ValueError as e:
+                await self.send(text_data=codec.dumps({'type': 'error', 'message': protocol.reject('frame', str(e))}))
+                return
+        else:
+            try:
+                data = codec.loads(text_data)
+            except codec.DecodeError:
+                await self.send(text_data=codec.dumps({'type': 'error', 'message': protocol.reject('frame', 'Invalid JSON format')}))
+                return
 
-        message_type = data.get('type')
-        if not message_type:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Missing message type'}))
+        # Malformed messages are refused before any handler work
+        try:
+            message_type, error = protocol.validate(data)
+        except Exception as e:
+            logger.exception(f"Message validation error: {e}")
+            message_type, error = None, protocol.reject('frame', 'Invalid message')
+        if error:
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': error}))
             return
+        # A failing handler answers an error, the connection stays up
+        try:
+            await self.handlers[message_type](self, data)
+        except Exception as e:
+            logger.exception(f"Error handling {message_type}: {e}")
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Failed to process message'}))
 
-        # Better message type normalization
-        normalized = message_type.replace('.', '_').lower()
+    async def handle_ping(self, data):
+        """Answer with the server time, used by clients to sync their clock"""
+        await self.send(text_data=codec.dumps({'type': 'pong', 'ts': await self.get_current_time()}))
 
-        # Handle ping first
-        if normalized == 'ping':
-            await self.send(text_data=json.dumps({'type': 'pong', 'ts': await self.get_current_time()}))
-            return
-
-        # Route to appropriate handlers
-        handler_map = {
-            'focus_update': self.handle_focus_update,
-            'timer_update': self.handle_timer_update,
-            'session_control': self.handle_session_control,
-            'chat_message': self.handle_chat_message,
-            'request_session_stats': self.broadcast_session_stats,
-        }
-
-        handler = handler_map.get(normalized)
-        if handler:
-            await handler(data)
-        else:
-            logger.warning(f"Unknown message type: {message_type} (normalized: {normalized})")
-            await self.send(text_data=json.dumps({'type': 'error', 'message': f'Unknown message type: {message_type}'}))
+    async def handle_pong(self, data):
+        """Pongs answer heartbeats, receiving them was enough"""
+        pass
 
     async def handle_focus_update(self, data):
         """Handle focus score updates - ONLY from students"""
@@ -215,60 +412,83 @@ class SessionConsumer(AsyncWebsocketConsumer):
         if not self.user or self.user.role != 'student':
             error_msg = 'Only students can submit focus scores'
             logger.warning(f"Focus update rejected: User {getattr(self.user, 'id', 'unknown')} is {getattr(self.user, 'role', 'unknown')}")
-            await self.send(text_data=json.dumps({'type': 'error', 'message': error_msg}))
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': error_msg}))
             return
 
-        focus_score = data.get('focus_score')
-        if focus_score is None:
-            focus_score = data.get('focus')
+        focus_score = float(data['focus_score'])
+        if await self.ingest_focus([(focus_score, timezone.now())]):
+            await self.send(text_data=codec.dumps({'type': 'focus.update.ack', 'message': 'Focus score updated successfully'}))
 
-        try:
-            focus_score = float(focus_score)
-            if not (0.0 <= focus_score <= 1.0):
-                focus_score = max(0.0, min(1.0, focus_score))
-        except (TypeError, ValueError):
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid focus score'}))
+    async def handle_focus_batch(self, data):
+        """Handle a batch of focus samples, acknowledged as a unit"""
+        if not self.user or self.user.role != 'student':
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Only students can submit focus scores'}))
             return
 
-        # Update DB
-        success = await self.update_focus_score(focus_score)
-        if not success:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Failed to update focus score'}))
+        try:
+            seq, samples = parse_batch(data)
+        except InvalidBatch as e:
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': protocol.reject('focus_batch', str(e))}))
             return
 
-        # BROADCAST TO ALL PARTICIPANTS (including instructor)
-        await self.channel_layer.group_send(
-            self.session_group_name,
+        accepted, not_before = focus_batches.accept(self.session_id, self.user.id, seq)
+        if accepted:
+            aligned = align_samples(samples, not_before=not_before)
+            if not await self.ingest_focus(aligned):
+                return
+            focus_batches.record(self.session_id, self.user.id, seq, aligned[-1][1])
+
+        await self.send(text_data=codec.dumps({
+            'type': 'focus_batch.ack',
+            'seq': seq,
+            'accepted': len(samples) if accepted else 0,
+            'duplicate': not accepted
+        }))
+
+    async def ingest_focus(self, samples):
+        """
+        Record (focus_score, timestamp) samples of the current student.
+        Every sample is buffered for the DB; the aggregator and the other
+        participants only get the latest one. Returns False on failure.
+        """
+        # Buffer the samples, they are written to the DB in bulk
+        try:
+            await focus_buffer.write_many(self.session_id, self.user.id, samples)
+        except Exception as e:
+            logger.exception(f"update_focus_score error: {e}")
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Failed to update focus score'}))
+            return False
+
+        focus_score, timestamp = samples[-1]
+
+        # Broadcast to the instructors, students do not see each other's scores
+        await send_event(
+            self.session_id,
             {
                 'type': 'focus.update',  # This triggers the focus_update method below
                 'user_id': self.user.id,
                 'user_name': self.user.full_name,
                 'user_role': self.user.role,
                 'focus_score': focus_score,
-                'timestamp': await self.get_current_time()
-            }
+                'timestamp': timestamp.isoformat()
+            },
+            key=f'focus.{self.user.id}'
         )
 
-        # Also broadcast updated stats
-        await self.broadcast_session_stats()
-
-        await self.send(text_data=json.dumps({'type': 'focus.update.ack', 'message': 'Focus score updated successfully'}))
+        # Stats are recomputed by the session tickers from the aggregators
+        await aggregators.record(self.session_id, self.user.id, focus_score)
+        stats_broadcaster.request(self.session_id)
+        return True
 
     async def handle_timer_update(self, data):
         """Handle timer updates from instructor"""
         if not self.user or self.user.role != 'instructor':
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Only instructors can update timer'}))
-            return
-            
-        elapsed_time = data.get('elapsed_time')
-        try:
-            elapsed_time = float(elapsed_time)
-        except (TypeError, ValueError):
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid elapsed time'}))
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Only instructors can update timer'}))
             return
 
-        await self.channel_layer.group_send(
-            self.session_group_name,
+        elapsed_time = float(data['elapsed_time'])
+        await send_event(
+            self.session_id,
             {
                 'type': 'timer.update',
                 'elapsed_time': elapsed_time,
@@ -280,30 +500,31 @@ class SessionConsumer(AsyncWebsocketConsumer):
     async def handle_session_control(self, data):
         """Handle session control commands from instructor"""
         if not self.user or self.user.role != 'instructor':
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Only instructors can control sessions'}))
-            return
-            
-        control_type = data.get('control_type')
-        if control_type not in ['start', 'pause', 'resume', 'end']:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid control type'}))
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Only instructors can control sessions'}))
             return
-            
+
+        control_type = data['control_type']
         logger.info(f"Session control: {control_type} by instructor {self.user.id}")
         
         if control_type == 'end':
+            await focus_buffer.flush_session(self.session_id)
+            await chat_buffer.flush_session(self.session_id)
             success = await self.end_session()
             if not success:
-                await self.send(text_data=json.dumps({'type': 'error', 'message': 'Failed to end session'}))
+                await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Failed to end session'}))
                 return
             else:
-                # Stop the timer loop when session ends
-                self.running = False
-                if self.timer_task and not self.timer_task.done():
-                    self.timer_task.cancel()
+                # Stop the session ticker when session ends
+                await tickers.stop(self.session_id)
+        else:
+            error = await self.update_session_clock(control_type)
+            if error:
+                await self.send(text_data=codec.dumps({'type': 'error', 'message': error}))
+                return
 
         # Broadcast control message to ALL participants
-        await self.channel_layer.group_send(
-            self.session_group_name,
+        await send_event(
+            self.session_id,
             {
                 'type': 'session.control',
                 'control_type': control_type,
@@ -316,8 +537,8 @@ class SessionConsumer(AsyncWebsocketConsumer):
 
         # Also broadcast session ended separately for reliable handling
         if control_type == 'end':
-            await self.channel_layer.group_send(
-                self.session_group_name,
+            await send_event(
+                self.session_id,
                 {
                     'type': 'session.ended',
                     'message': 'Session has ended',
@@ -326,239 +547,157 @@ class SessionConsumer(AsyncWebsocketConsumer):
                 }
             )
 
+        # Every control changes the session clock, resync all clients
+        await self.broadcast_clock_sync()
+
+    async def handle_stats_request(self, data):
+        """Ask for fresh stats, sent with the next coalesced broadcast"""
+        stats_broadcaster.request(self.session_id)
+
     async def handle_chat_message(self, data):
         """Handle chat messages from all participants"""
-        message = data.get('message')
-        if not message or not isinstance(message, str):
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid chat message'}))
-            return
-        
-        # Validate message length
-        if len(message.strip()) == 0:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Message cannot be empty'}))
-            return
-            
-        if len(message) > 1000:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Message too long'}))
+        # Type and length are checked by the protocol, blank messages are not
+        message = data['message'].strip()
+        if not message:
+            await self.send(text_data=codec.dumps({'type': 'error', 'message': 'Message cannot be empty'}))
             return
 
-        # Broadcast to all participants
-        await self.channel_layer.group_send(
-            self.session_group_name,
+        # Store the message, written to the DB in batches
+        timestamp = timezone.now()
+        await chat_buffer.write(self.session_id, self.user.id, message, timestamp)
+
+        # Broadcast to all participants, in webinar mode student messages
+        # only reach instructors
+        await send_event(
+            self.session_id,
             {
                 'type': 'chat.message',
                 'user_id': self.user.id,
                 'user_name': self.user.full_name,
                 'user_role': self.user.role,
-                'message': message.strip(),
-                'timestamp': await self.get_current_time()
-            }
+                'message': message,
+                'timestamp': timestamp.isoformat()
+            },
+            audience=ALL if self.user.role == 'instructor' else None
         )
 
-    # Group event handlers
+    # Handlers of client messages by normalized type, see protocol.py
+    handlers = {
+        'focus_update': handle_focus_update,
+        'focus_batch': handle_focus_batch,
+        'timer_update': handle_timer_update,
+        'session_control': handle_session_control,
+        'chat_message': handle_chat_message,
+        'request_session_stats': handle_stats_request,
+        'ping': handle_ping,
+        'pong': handle_pong,
+    }
+
+    # Group event handlers. Senders serialize the client payload once
+    # (groups.encode_event), handlers forward the encoded text as is in the
+    # outbound lane of the event.
+    async def forward(self, event, lane=CONTROL, key=None):
+        await self.send(text_data=event['text'], lane=lane, key=key)
+
+    async def send_frames(self, frames, lane, key=None):
+        """Send binary frames, roster entries going first"""
+        *entries, frame = frames
+        for entry in entries:
+            await self.send(bytes_data=entry, lane=CONTROL)
+        await self.send(bytes_data=frame, lane=lane, key=key)
+
     async def session_joined(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session.joined',
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'user_role': event['user_role'],
-            'timestamp': event['timestamp']
-        }))
+        if self.binary:
+            await self.send_frames(self.binary.presence(OP_JOINED, codec.loads(event['text'])), CHAT)
+            return
+        await self.forward(event, CHAT)
 
     async def session_left(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session.left',
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'user_role': event['user_role'],
-            'timestamp': event['timestamp']
-        }))
+        if self.binary:
+            await self.send_frames(self.binary.presence(OP_LEFT, codec.loads(event['text'])), CHAT)
+            return
+        await self.forward(event, CHAT)
 
     async def focus_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'focus.update',
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'user_role': event['user_role'],
-            'focus_score': event['focus_score'],
-            'timestamp': event['timestamp']
-        }))
+        if self.dashboard_subscribed:
+            return
+        if self.binary:
+            await self.send_frames(self.binary.focus(codec.loads(event['text'])), STATE, event.get('key'))
+            return
+        await self.forward(event, STATE, event.get('key'))
 
     async def timer_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'timer.update',
-            'elapsed_time': event['elapsed_time'],
-            'sent_by': event['sent_by'],
-            'timestamp': event['timestamp']
-        }))
+        await self.forward(event, STATE, 'timer.update')
 
     async def session_control(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session.control',
-            'control_type': event['control_type'],
-            'sent_by': event['sent_by'],
-            'sent_by_name': event.get('sent_by_name', 'Instructor'),
-            'timestamp': event['timestamp'],
-            'message': event.get('message', '')
-        }))
+        await self.forward(event, CONTROL)
+
+    async def timer_sync(self, event):
+        await self.forward(event, CONTROL)
 
     async def session_ended(self, event):
-        """Handle session ended event"""
-        await self.send(text_data=json.dumps({
-            'type': 'session.ended',
-            'message': event.get('message', 'Session has ended'),
-            'end_time': event.get('end_time'),
-            'sent_by': event.get('sent_by')
-        }))
+        await self.forward(event, CONTROL)
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat.message',
-            'user_id': event['user_id'],
-            'user_name': event['user_name'],
-            'user_role': event['user_role'],
-            'message': event['message'],
-            'timestamp': event['timestamp']
-        }))
-
-    async def session_stats(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'session.stats',
-            'stats': event['stats'],
-            'timestamp': event['timestamp']
-        }))
+        await self.forward(event, CHAT)
 
-    # Timer and stats methods
-    async def start_session_timer(self):
-        """Start background timer task"""
-        self.timer_task = asyncio.create_task(self.update_timer_loop())
+    async def class_summary(self, event):
+        await self.forward(event, STATE, 'class.summary')
 
-    async def update_timer_loop(self):
-        """Continuously update and broadcast session timer"""
-        try:
-            session = await self.get_session()
-            if not session or not session.is_active:
-                return
-                
-            while self.running and session.is_active:
-                elapsed = await self.calculate_elapsed_time(session)
-                
-                await self.channel_layer.group_send(
-                    self.session_group_name,
-                    {
-                        'type': 'timer.update',
-                        'elapsed_time': elapsed,
-                        'sent_by': None,
-                        'timestamp': await self.get_current_time()
-                    }
-                )
-                
-                await asyncio.sleep(1)
-                session = await self.get_session()
-                
-        except asyncio.CancelledError:
-            logger.info("Timer task cancelled")
-        except Exception as e:
-            logger.exception(f"Timer loop error: {e}")
-
-    async def broadcast_session_stats(self):
-        """Calculate and broadcast session statistics"""
-        stats = await self.calculate_session_stats()
-        
-        await self.channel_layer.group_send(
-            self.session_group_name,
-            {
-                'type': 'session.stats',
-                'stats': stats,
-                'timestamp': await self.get_current_time()
-            }
-        )
-
-    @database_sync_to_async
-    def calculate_session_stats(self):
-        """Calculate comprehensive session statistics - STUDENTS ONLY with proper filtering"""
-        try:
-            session = Session.objects.get(id=self.session_id)
-            
-            # Get all student performances for this session
-            performances = Performance.objects.filter(
-                session=session, 
-                attended=True,
-                student__role='student'  # CRITICAL: Only students
-            )
-            
-            # Get recent performances (last 2 minutes)
-            recent_threshold = timezone.now() - timedelta(minutes=2)
-            recent_performances = performances.filter(timestamp__gte=recent_threshold)
-            
-            # Use conditional aggregation for a single, efficient query
-            stats_agg = recent_performances.aggregate(
-                avg_focus=Avg('focus_score'),
-                high_focus=Count('pk', filter=Q(focus_score__gte=0.8)),
-                medium_focus=Count('pk', filter=Q(focus_score__gte=0.6, focus_score__lt=0.8)),
-                low_focus=Count('pk', filter=Q(focus_score__lt=0.6)),
-                active_students=Count('student', distinct=True)
-            )
-            avg_focus = stats_agg['avg_focus'] or 0
-            
-            # Count only students enrolled in the classroom
-            total_students = Enrollment.objects.filter(
-                classroom=session.classroom, 
-                student__role='student'
-            ).count()
-
-            # Session duration
-            if session.end_time:
-                session_duration = (session.end_time - session.start_time).total_seconds()
-            else:
-                session_duration = (timezone.now() - session.start_time).total_seconds()
-            
-            stats = {
-                'total_participants': total_students,
-                'active_participants': stats_agg['active_students'],
-                'average_focus_score': round(avg_focus, 3),
-                'session_duration': session_duration,
-                'focus_distribution': {
-                    'high': stats_agg['high_focus'],
-                    'medium': stats_agg['medium_focus'],
-                    'low': stats_agg['low_focus']
+    async def session_stats(self, event):
+        await self.forward(event, STATE, 'session.stats')
+
+    async def dashboard_delta(self, event):
+        # Deltas build on each other, losing one would leave the dashboard
+        # wrong for good, so they are never dropped
+        await self.forward(event, CONTROL)
+
+    # Clock methods
+    async def broadcast_clock_sync(self):
+        """Broadcast the persisted session clock after a state change"""
+        ticker = tickers.get(self.session_id)
+        if ticker is not None:
+            ticker.invalidate()
+
+        clock = await self.get_clock_state()
+        if clock:
+            await send_event(
+                self.session_id,
+                {
+                    'type': 'timer.sync',
+                    'server_time': await self.get_current_time(),
+                    **clock
                 }
-            }
-            
-            logger.debug(f"Session stats calculated: {stats}")
-            return stats
-            
-        except Exception as e:
-            logger.exception(f"Error calculating session stats: {e}")
-            return {}
+            )
 
     # Database operations
-    @database_sync_to_async
+    @db_sync_to_async
     def authenticate_user(self, token):
         try:
             access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            return User.objects.get(id=user_id)
-        except (InvalidToken, TokenError, User.DoesNotExist) as e:
+            return get_user(access_token['user_id'])
+        except (InvalidToken, TokenError, KeyError) as e:
             logger.debug(f"Token auth error: {e}")
             return None
 
-    @database_sync_to_async
+    @db_sync_to_async
     def check_session_access(self):
-        try:
-            session = Session.objects.get(id=self.session_id)
-            if self.user.role == 'instructor':
-                return session.classroom.instructor == self.user
-            else:
-                return Enrollment.objects.filter(
-                    classroom=session.classroom, 
-                    student=self.user
-                ).exists()
-        except Session.DoesNotExist:
+        if get_session_classroom(self.session_id) is None:
             logger.error(f'Session {self.session_id} does not exist')
             return False
+        return get_session_role(self.user, self.session_id) is not None
+
+    @db_sync_to_async
+    def get_roster(self):
+        """(id, name, role) of the students enrolled in the session"""
+        return list(
+            Enrollment.objects.filter(
+                classroom__sessions__id=self.session_id,
+                student__role='student'
+            ).order_by('id').values_list('student_id', 'student__full_name', 'student__role')
+        )
 
-    @database_sync_to_async
+    @db_sync_to_async
     def update_attendance(self, attended):
         try:
             session = Session.objects.get(id=self.session_id)
@@ -578,25 +717,7 @@ class SessionConsumer(AsyncWebsocketConsumer):
             logger.exception(f"update_attendance error: {e}")
             return False
 
-    @database_sync_to_async
-    def update_focus_score(self, focus_score):
-        try:
-            session = Session.objects.get(id=self.session_id)
-            performance, created = Performance.objects.get_or_create(
-                session=session,
-                student=self.user,
-                defaults={'focus_score': focus_score, 'attended': True}
-            )
-            if not created:
-                performance.focus_score = focus_score
-                performance.timestamp = timezone.now()
-                performance.save()
-            return True
-        except Exception as e:
-            logger.exception(f"update_focus_score error: {e}")
-            return False
-
-    @database_sync_to_async
+    @db_sync_to_async
     def end_session(self):
         """End the session and update all records"""
         try:
@@ -608,6 +729,7 @@ class SessionConsumer(AsyncWebsocketConsumer):
 
             session.is_active = False
             session.end_time = timezone.now()
+            session.resume(session.end_time, save=False)
             session.save()
             
             # Update all performance records to mark as not attended
@@ -621,20 +743,29 @@ class SessionConsumer(AsyncWebsocketConsumer):
             logger.exception(f"end_session error: {e}")
             return False
 
-    @database_sync_to_async
-    def get_session(self):
+    @db_sync_to_async
+    def update_session_clock(self, control_type):
+        """Persist a start/pause/resume control. Returns an error message if refused."""
         try:
-            return Session.objects.get(id=self.session_id)
+            session = Session.objects.get(id=self.session_id)
         except Session.DoesNotExist:
-            return None
+            return 'Session not found'
 
-    @database_sync_to_async
-    def calculate_elapsed_time(self, session):
-        if session.end_time:
-            return (session.end_time - session.start_time).total_seconds()
-        else:
-            return (timezone.now() - session.start_time).total_seconds()
+        if control_type == 'pause':
+            return None if session.pause() else 'Session cannot be paused'
+        if control_type == 'resume':
+            return None if session.resume() else 'Session is not paused'
+
+        # 'start' resumes a paused session and is a no-op otherwise
+        session.resume()
+        return None
+
+    @db_sync_to_async
+    def get_clock_state(self):
+        try:
+            return Session.objects.get(id=self.session_id).get_clock_state()
+        except Session.DoesNotExist:
+            return None
 
-    @database_sync_to_async
-    def get_current_time(self):
+    async def get_current_time(self):
         return timezone.now().isoformat()
\ No newline at end of file
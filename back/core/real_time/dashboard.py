@@ -0,0 +1,133 @@
+"""
+Fixed-rate, delta-encoded focus map for instructor dashboards.
+
+Instructors that opt in get a dashboard.snapshot with the focus score of
+every active student, then a dashboard.delta every DASHBOARD_INTERVAL
+holding only the students whose score moved by at least
+DASHBOARD_THRESHOLD since the last frame, joined or dropped out of the
+stats window. Their bandwidth is bounded by the frame rate instead of the
+class size times the sampling rate, and they no longer need the individual
+focus.update events.
+
+Snapshots are taken from the state the deltas are computed against, so a
+client that applies the deltas with a seq above the snapshot's stays exact.
+That state is kept by every worker for its own dashboards, which join the
+dashboard group of their worker, and computed from the worker's aggregator,
+which holds the samples of the whole session.
+"""
+import time
+from collections import defaultdict
+
+from channels.layers import get_channel_layer
+from django.utils import timezone
+
+from .aggregator import aggregators
+from .conf import get_setting
+from .groups import encode_event, local_group
+from .ticker import tickers
+
+
+def dashboard_group(session_id):
+    """Group of the dashboards of a session served by this process"""
+    return local_group(f'session_{session_id}_dashboard')
+
+
+def focus_map(session_id):
+    """Focus map of a session keyed by student id strings, as sent to clients"""
+    aggregator = aggregators.get(session_id)
+    if aggregator is None:
+        return None
+    return {str(user_id): score for user_id, score in aggregator.focus_map().items()}
+
+
+class DashboardStream:
+    """Last focus map sent to the dashboards of every session"""
+    def __init__(self):
+        self.subscribers = defaultdict(int)
+        self.state = {}
+        self.seq = {}
+        self.last_sent = {}
+
+    def subscribe(self, session_id):
+        """Count a dashboard in and return its snapshot frame"""
+        session_id = str(session_id)
+        self.subscribers[session_id] += 1
+        if session_id not in self.state:
+            self.state[session_id] = focus_map(session_id) or {}
+            self.seq[session_id] = 0
+        return {
+            'type': 'dashboard.snapshot',
+            'seq': self.seq[session_id],
+            'students': dict(self.state[session_id]),
+            'timestamp': timezone.now().isoformat()
+        }
+
+    def unsubscribe(self, session_id):
+        session_id = str(session_id)
+        self.subscribers[session_id] -= 1
+        if self.subscribers[session_id] <= 0:
+            self.discard(session_id)
+
+    def discard(self, session_id):
+        session_id = str(session_id)
+        self.subscribers.pop(session_id, None)
+        self.state.pop(session_id, None)
+        self.seq.pop(session_id, None)
+        self.last_sent.pop(session_id, None)
+
+    def diff(self, session_id, current):
+        """
+        Apply the current focus map to the session state.
+        Returns (changed scores, removed student ids).
+        """
+        threshold = get_setting('DASHBOARD_THRESHOLD')
+        state = self.state[session_id]
+        changes = {
+            user_id: score for user_id, score in current.items()
+            if user_id not in state or abs(score - state[user_id]) >= threshold
+        }
+        removed = [user_id for user_id in state if user_id not in current]
+        state.update(changes)
+        for user_id in removed:
+            del state[user_id]
+        return changes, removed
+
+    async def flush(self, ticker, now=None):
+        session_id = ticker.session_id
+        if not self.subscribers.get(session_id):
+            return
+        now = time.monotonic() if now is None else now
+        if now - self.last_sent.get(session_id, float('-inf')) < get_setting('DASHBOARD_INTERVAL'):
+            return
+        current = focus_map(session_id)
+        if current is None:
+            return
+        self.last_sent[session_id] = now
+
+        changes, removed = self.diff(session_id, current)
+        if not changes and not removed:
+            return
+        self.seq[session_id] += 1
+
+        await get_channel_layer().group_send(
+            dashboard_group(session_id),
+            encode_event({
+                'type': 'dashboard.delta',
+                'seq': self.seq[session_id],
+                'changes': changes,
+                'removed': removed,
+                'timestamp': timezone.now().isoformat()
+            })
+        )
+
+
+# Global dashboard stream instance, dropping a session's state together with
+# its ticker
+dashboard_stream = DashboardStream()
+tickers.register_stop(dashboard_stream.discard)
+
+
+@tickers.register
+async def broadcast_dashboard(ticker):
+    """Send the focus map changes of the ticker's session"""
+    await dashboard_stream.flush(ticker)
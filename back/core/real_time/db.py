@@ -0,0 +1,73 @@
+"""
+Sized executor for the database work of the real-time path.
+
+channels' database_sync_to_async is thread sensitive by default: every ORM
+call of every connection runs on the one thread shared with all other
+sync code, one at a time. Functions decorated with db_sync_to_async run on
+a pool of DB_EXECUTOR_THREADS threads instead, each with its own database
+connection, closed or reused according to CONN_MAX_AGE before and after
+every call like channels does.
+
+The executor records how many calls wait for a thread and for how long.
+"""
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+
+from .conf import get_setting
+from .metrics import metrics
+
+
+class DatabaseExecutor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.queued = 0
+
+    @property
+    def executor(self):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(
+                max_workers=get_setting('DB_EXECUTOR_THREADS'),
+                thread_name_prefix='real-time-db'
+            )
+        return self.pool
+
+    def adjust(self, count):
+        with self.lock:
+            self.queued += count
+            metrics.set('db.queue_depth', self.queued)
+        if count > 0:
+            metrics.max('db.max_queue_depth', self.queued)
+
+    def run(self, func, enqueued_at, *args, **kwargs):
+        started = time.monotonic()
+        self.adjust(-1)
+        wait_ms = round((started - enqueued_at) * 1000, 1)
+        metrics.set('db.wait_ms', wait_ms)
+        metrics.max('db.max_wait_ms', wait_ms)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.incr('db.calls')
+            metrics.max('db.max_run_ms', round((time.monotonic() - started) * 1000, 1))
+
+    async def call(self, func, *args, **kwargs):
+        self.adjust(1)
+        run = DatabaseSyncToAsync(self.run, thread_sensitive=False, executor=self.executor)
+        return await run(func, time.monotonic(), *args, **kwargs)
+
+
+# Global executor instance
+db_executor = DatabaseExecutor()
+
+
+def db_sync_to_async(func):
+    """database_sync_to_async running on the real-time DB executor"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.call(func, *args, **kwargs)
+    return wrapper
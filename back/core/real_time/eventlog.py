@@ -0,0 +1,151 @@
+"""
+Sequenced log of the events sent to each session.
+
+Every event of LOGGED_EVENTS sent through groups.send_event gets the next
+sequence number of its session, carried as "seq" in the client payload, and
+is kept in a ring buffer of the last EVENT_LOG_SIZE events of the session
+together with the group it was sent to. Only events a client cannot rebuild
+are logged: state events (focus updates, timers, stats) are superseded by
+the next one or by a snapshot, and logging them would cost a round trip per
+focus sample and evict the chat and controls within seconds in a large
+class. A client reconnecting with ?resume_from=<seq> gets the
+events of its groups sent after that seq replayed, or a snapshot.required
+message when some of them have already been evicted.
+
+With REDIS_URL set the sequence and the buffer are shared by workers (a
+counter and a ZSET scored by seq, updated by one script so numbers and
+entries stay in step); otherwise they are kept in process and dropped with
+the session ticker. If Redis is unavailable events are sent unsequenced.
+"""
+import logging
+from collections import defaultdict, deque
+
+import redis.asyncio as redis
+from core import codec
+
+from .conf import get_setting
+from .metrics import metrics
+from .shared import get_redis
+from .ticker import tickers
+
+logger = logging.getLogger(__name__)
+
+# Event types kept for resuming clients
+LOGGED_EVENTS = frozenset({
+    'chat.message',
+    'session.control',
+    'session.ended',
+    'session.joined',
+    'session.left',
+})
+
+# Numbers and stores an entry, trimming the buffer. Returns the seq.
+APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, cjson.encode({seq, ARGV[1]}))
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+def seq_key(session_id):
+    return f'events:{session_id}:seq'
+
+
+def log_key(session_id):
+    return f'events:{session_id}'
+
+
+def sequenced(seq, event):
+    """Group event with its seq, also inserted as first field of the client payload"""
+    return {**event, 'seq': seq, 'text': f'{{"seq": {seq}, {event["text"][1:]}'}
+
+
+class EventLog:
+    def __init__(self):
+        self.seqs = defaultdict(int)
+        self.entries = {}
+
+    async def append(self, session_id, group, event):
+        """
+        Number and store an encoded event sent to a group. Returns the seq,
+        or None if the event could not be logged.
+        """
+        session_id = str(session_id)
+        entry = codec.dumps([group, event])
+        client = get_redis()
+        if client is None:
+            self.seqs[session_id] += 1
+            seq = self.seqs[session_id]
+            if session_id not in self.entries:
+                self.entries[session_id] = deque(maxlen=get_setting('EVENT_LOG_SIZE'))
+            self.entries[session_id].append((seq, entry))
+            return seq
+        try:
+            return await client.eval(
+                APPEND_SCRIPT, 2, seq_key(session_id), log_key(session_id),
+                entry, get_setting('EVENT_LOG_SIZE'), get_setting('EVENT_LOG_TTL')
+            )
+        except redis.RedisError as e:
+            metrics.incr('event_log.errors')
+            logger.warning(f"Event log append failed, sending unsequenced: {e}")
+            return None
+
+    async def since(self, session_id, seq):
+        """
+        (latest seq, [(group, event)] of the events logged after seq), the
+        list being None if some of them are no longer in the buffer.
+        """
+        session_id = str(session_id)
+        client = get_redis()
+        if client is None:
+            latest = self.seqs.get(session_id, 0)
+            entries = [entry for entry in self.entries.get(session_id, ()) if entry[0] > seq]
+        else:
+            try:
+                async with client.pipeline(transaction=True) as pipe:
+                    pipe.get(seq_key(session_id))
+                    pipe.zrangebyscore(log_key(session_id), f'({seq}', '+inf')
+                    latest, members = await pipe.execute()
+            except redis.RedisError as e:
+                metrics.incr('event_log.errors')
+                logger.warning(f"Event log read failed: {e}")
+                return None, None
+            latest = int(latest or 0)
+            entries = [codec.loads(member) for member in members]
+
+        # Resuming from the future means the log was lost, e.g. on restart
+        if seq > latest or (latest > seq and (not entries or entries[0][0] != seq + 1)):
+            metrics.incr('event_log.snapshots')
+            return latest, None
+        metrics.incr('event_log.replayed', len(entries))
+        replay = []
+        for entry_seq, entry in entries:
+            group, event = codec.loads(entry)
+            replay.append((group, sequenced(entry_seq, event)))
+        return latest, replay
+
+    async def latest(self, session_id):
+        """Seq of the last event logged for a session, None if unknown"""
+        client = get_redis()
+        if client is None:
+            return self.seqs.get(str(session_id), 0)
+        try:
+            return int(await client.get(seq_key(session_id)) or 0)
+        except redis.RedisError as e:
+            metrics.incr('event_log.errors')
+            logger.warning(f"Event log read failed: {e}")
+            return None
+
+    def discard(self, session_id):
+        session_id = str(session_id)
+        self.seqs.pop(session_id, None)
+        self.entries.pop(session_id, None)
+
+
+# Global event log instance. The in-process log of a session is dropped with
+# its ticker, Redis keys expire after EVENT_LOG_TTL.
+event_log = EventLog()
+tickers.register_stop(event_log.discard)
@@ -0,0 +1,114 @@
+"""
+Role-aware fan-out of session events.
+
+Every connection joins the session group and the group of its role. Events
+are sent to the audience EVENT_ROUTES gives for their type, so per-student
+events (focus updates, joins and leaves) only reach instructors instead of
+every student of the session.
+
+Sessions whose roster reaches WEBINAR_THRESHOLD run in webinar mode: on top
+of that, stats and student chat only go to instructors, and students get a
+periodic class.summary instead. A student then only receives their own
+acks, control messages and the summary, whatever the size of the session.
+
+Events are serialized once by the sender: the group event only carries its
+type, its seq in the session event log and the encoded client payload,
+which consumers forward as is.
+
+Every group also has a local counterpart holding the connections of this
+process only. Events computed by every worker from its own state, like
+stats, are sent there so that each client gets them once.
+"""
+import uuid
+
+from channels.layers import get_channel_layer
+from core import codec
+
+from .aggregator import aggregators
+from .conf import get_setting
+from .eventlog import LOGGED_EVENTS, event_log, sequenced
+
+# Suffix of the local groups of this process
+WORKER = uuid.uuid4().hex[:12]
+
+ALL = 'all'
+INSTRUCTORS = 'instructors'
+STUDENTS = 'students'
+
+# Audience of every event type, events not listed go to everyone
+EVENT_ROUTES = {
+    'focus.update': INSTRUCTORS,
+    'session.joined': INSTRUCTORS,
+    'session.left': INSTRUCTORS,
+    'session.stats': ALL,
+    'class.summary': STUDENTS,
+    'chat.message': ALL,
+    'session.control': ALL,
+    'session.ended': ALL,
+    'timer.update': ALL,
+    'timer.sync': ALL,
+}
+
+WEBINAR_ROUTES = {
+    **EVENT_ROUTES,
+    'session.stats': INSTRUCTORS,
+    'chat.message': INSTRUCTORS,
+}
+
+
+def session_group(session_id, audience=ALL):
+    if audience == ALL:
+        return f'session_{session_id}'
+    return f'session_{session_id}_{audience}'
+
+
+def role_group(session_id, role):
+    return session_group(session_id, INSTRUCTORS if role == 'instructor' else STUDENTS)
+
+
+def local_group(group):
+    """Connections of this process among those of a group"""
+    return f'{group}.{WORKER}'
+
+
+def is_webinar(session_id):
+    """True if the session is large enough to run in webinar mode"""
+    aggregator = aggregators.get(session_id)
+    return aggregator is not None and len(aggregator) >= get_setting('WEBINAR_THRESHOLD')
+
+
+def route(session_id, event_type, audience=None):
+    """Group an event is sent to, audience overriding the routing table"""
+    if audience is None:
+        routes = WEBINAR_ROUTES if is_webinar(session_id) else EVENT_ROUTES
+        audience = routes.get(event_type, ALL)
+    return session_group(session_id, audience)
+
+
+def encode_event(event, key=None):
+    """
+    Group event carrying the client payload of an event, serialized once.
+    Events with a key replace the queued ones of the same key on slow
+    connections.
+    """
+    encoded = {'type': event['type'], 'text': codec.dumps(event)}
+    if key is not None:
+        encoded['key'] = key
+    return encoded
+
+
+async def send_event(session_id, event, audience=None, key=None):
+    """Send an event to the audience of its type, numbered in the session event log if logged"""
+    group = route(session_id, event['type'], audience)
+    encoded = encode_event(event, key)
+    if event['type'] in LOGGED_EVENTS:
+        seq = await event_log.append(session_id, group, encoded)
+        if seq is not None:
+            encoded = sequenced(seq, encoded)
+    await get_channel_layer().group_send(group, encoded)
+
+
+async def send_local(session_id, event, audience=None, key=None):
+    """Send an event to the connections of this process in its audience, unlogged"""
+    group = local_group(route(session_id, event['type'], audience))
+    await get_channel_layer().group_send(group, encode_event(event, key))
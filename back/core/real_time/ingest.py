@@ -0,0 +1,115 @@
+"""
+Batched focus samples sent by clients.
+
+A focus_batch message carries a client sequence number and a list of
+[client_ts, focus_score] samples, client_ts being client milliseconds. The
+batch is validated and ingested as a unit: every sample goes to the focus
+write buffer (so the stored series keeps the client's sampling rate), while
+the aggregator, the stats and the focus.update broadcast only see the latest
+score of the batch.
+
+Client clocks are not trusted: samples are placed on the server timeline by
+anchoring the last sample of the batch to the time it was received, keeping
+the spacing between samples. Batches whose sequence number is not above the
+last one seen for the student are duplicates (typically resent after a
+reconnect) and are dropped. Sequence numbers are kept per process, like the
+rest of the session runtime state.
+"""
+import math
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .conf import get_setting
+from .ticker import tickers
+
+
+class InvalidBatch(ValueError):
+    pass
+
+
+def parse_batch(data):
+    """
+    Validate a focus_batch message.
+
+    Returns (seq, [(client_ts, focus_score)]) with scores clamped to [0, 1].
+    Raises InvalidBatch with a client-facing message, also for batches
+    spanning more than FOCUS_BATCH_MAX_SPAN_MS, which could not be placed on
+    the server timeline.
+    """
+    seq = data.get('seq')
+    if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+        raise InvalidBatch('Invalid batch sequence number')
+
+    samples = data.get('samples')
+    if not isinstance(samples, list) or not samples:
+        raise InvalidBatch('Batch has no samples')
+    if len(samples) > get_setting('FOCUS_BATCH_MAX_SAMPLES'):
+        raise InvalidBatch('Too many samples in batch')
+
+    parsed = []
+    for sample in samples:
+        if not isinstance(sample, (list, tuple)) or len(sample) != 2:
+            raise InvalidBatch('Invalid sample')
+        try:
+            client_ts, focus_score = float(sample[0]), float(sample[1])
+        except (TypeError, ValueError):
+            raise InvalidBatch('Invalid sample')
+        if not math.isfinite(focus_score) or not math.isfinite(client_ts):
+            raise InvalidBatch('Invalid sample')
+        if parsed and client_ts < parsed[-1][0]:
+            raise InvalidBatch('Samples are not in time order')
+        parsed.append((client_ts, max(0.0, min(1.0, focus_score))))
+    if parsed[-1][0] - parsed[0][0] > get_setting('FOCUS_BATCH_MAX_SPAN_MS'):
+        raise InvalidBatch('Batch spans too long')
+    return seq, parsed
+
+
+def align_samples(samples, received_at=None, not_before=None):
+    """
+    Place (client_ts, focus_score) samples on the server timeline.
+
+    The last sample is anchored at received_at. Samples are never placed
+    before not_before, the last sample time of the previous batch.
+    Returns [(focus_score, timestamp)].
+    """
+    received_at = received_at or timezone.now()
+    last_ts = samples[-1][0]
+    aligned = []
+    for client_ts, focus_score in samples:
+        timestamp = received_at - timedelta(milliseconds=last_ts - client_ts)
+        if not_before is not None and timestamp < not_before:
+            timestamp = not_before
+        aligned.append((focus_score, timestamp))
+    return aligned
+
+
+class FocusBatchLog:
+    """Last sequence number and sample time of every student's batches"""
+    def __init__(self):
+        self.students = {}
+
+    def accept(self, session_id, student_id, seq):
+        """
+        Record a batch. Returns (accepted, last sample time of the previous
+        batch); duplicates are not accepted.
+        """
+        key = (str(session_id), student_id)
+        last = self.students.get(key)
+        if last is not None and seq <= last[0]:
+            return False, last[1]
+        return True, last[1] if last is not None else None
+
+    def record(self, session_id, student_id, seq, last_timestamp):
+        self.students[(str(session_id), student_id)] = (seq, last_timestamp)
+
+    def discard(self, session_id):
+        session_id = str(session_id)
+        for key in [key for key in self.students if key[0] == session_id]:
+            del self.students[key]
+
+
+# Global batch log instance, dropping a session's entries together with its
+# ticker
+focus_batches = FocusBatchLog()
+tickers.register_stop(focus_batches.discard)
@@ -0,0 +1,113 @@
+"""
+Compare the JSON codec (core.codec) with the standard library on the
+payloads the server encodes most: session.stats frames, focus updates and
+chat history pages.
+
+Frames are built the way the server builds them, from a SessionAggregator
+and through groups.encode_event, and history pages with the chat message
+serializer, on unsaved rows.
+
+    python manage.py bench_codec --number 20000
+"""
+import json
+import random
+import timeit
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core import codec
+from core.renderers import CodecJSONRenderer
+from real_time.aggregator import SessionAggregator
+from real_time.groups import encode_event
+from session.models import ChatMessage, Session
+from session.pagination import ChatCursorPagination
+from session.serializers import ChatMessageSerializer
+
+User = get_user_model()
+
+
+def stats_event(students=120):
+    aggregator = SessionAggregator(range(1, students + 1), window=120)
+    for user_id in range(1, students + 1):
+        aggregator.add(user_id, random.random())
+    return {
+        'type': 'session.stats',
+        'stats': aggregator.get_stats(1834.5),
+        'timestamp': timezone.now().isoformat()
+    }
+
+
+def focus_event():
+    return {
+        'type': 'focus.update',
+        'user_id': 4821,
+        'user_name': 'Student 4821',
+        'user_role': 'student',
+        'focus_score': 0.82,
+        'timestamp': timezone.now().isoformat()
+    }
+
+
+def focus_batch_frame(samples=20):
+    """focus_batch message of a client, as decoded by the consumer"""
+    return {'type': 'focus_batch', 'seq': 42, 'samples': [[1000 * i, random.random()] for i in range(samples)]}
+
+
+def chat_page(size=50):
+    """Chat history page as returned by the session chat endpoint"""
+    session = Session(id=12)
+    users = [
+        User(id=user_id, full_name=f'User {user_id}', role='instructor' if user_id == 1 else 'student')
+        for user_id in range(1, 31)
+    ]
+    now = timezone.now()
+    messages = [
+        ChatMessage(
+            id=1000 - i,
+            session=session,
+            user=random.choice(users),
+            message='Could you go over the last slide again? ' * random.randint(1, 4),
+            timestamp=now - timedelta(seconds=7 * i)
+        )
+        for i in range(size)
+    ]
+    return {
+        'next': f'http://testserver/api/sessions/12/chat/?cursor={ChatCursorPagination().encode_cursor(messages[-1])}',
+        'results': ChatMessageSerializer(messages, many=True).data
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the JSON codec against the standard library'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=10000, help='Iterations per measurement')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        self.stdout.write(f'Codec backend: {codec.BACKEND}, {number} iterations')
+
+        for name, event in (('stats', stats_event()), ('focus update', focus_event())):
+            self.report(f'{name} dumps', number, lambda: json.dumps(event), lambda: codec.dumps(event))
+            self.stdout.write(f'{name + " encode_event":<20} {self.time(lambda: encode_event(event), number):8.2f}us')
+
+        text = json.dumps(focus_batch_frame())
+        self.report('focus batch loads', number, lambda: json.loads(text), lambda: codec.loads(text))
+
+        page = chat_page()
+        stdlib, fast = JSONRenderer(), CodecJSONRenderer()
+        self.report('chat page render', number, lambda: stdlib.render(page), lambda: fast.render(page))
+        rendered = stdlib.render(page)
+        self.report('chat page loads', number, lambda: json.loads(rendered), lambda: codec.loads(rendered))
+
+    def time(self, function, number):
+        """Best time of a call, in microseconds"""
+        return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+    def report(self, name, number, baseline, candidate):
+        before, after = self.time(baseline, number), self.time(candidate, number)
+        self.stdout.write(f'{name:<20} json {before:8.2f}us  codec {after:8.2f}us  x{before / after:.1f}')
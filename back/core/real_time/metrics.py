@@ -0,0 +1,44 @@
+"""
+In-process metrics for the real-time path.
+
+Components record counters and gauges here under dotted names; the
+snapshot is exposed to staff users through the real-time metrics endpoint.
+"""
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def max(self, name, value):
+        """Keep the highest value seen for a gauge"""
+        with self.lock:
+            if value > self.gauges.get(name, float('-inf')):
+                self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+
+
+# Global metrics instance
+metrics = Metrics()
@@ -1,11 +1,56 @@
 from channels.middleware import BaseMiddleware
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from users.cache import get_user
+from .admission import CLOSE_RETRY_LATER, admission
+from .db import db_sync_to_async
 
 User = get_user_model()
 
+
+class AdmissionMiddleware:
+    """
+    Admit WebSocket handshakes before any work is done for them, see
+    admission.py. Must wrap the authentication middleware.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        client = scope.get('client')
+        retry_after = admission.enter(client[0] if client else None)
+        if retry_after is not None:
+            await self.reject(receive, send, retry_after)
+            return
+
+        admitted = True
+
+        def release():
+            nonlocal admitted
+            if admitted:
+                admitted = False
+                admission.leave()
+
+        async def admitted_send(message):
+            # The slot is held until the handshake is answered
+            if message['type'] in ('websocket.accept', 'websocket.close'):
+                release()
+            await send(message)
+
+        try:
+            return await self.app(scope, receive, admitted_send)
+        finally:
+            release()
+
+    async def reject(self, receive, send, retry_after):
+        """Turn a handshake away, telling the client when to retry"""
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.close', 'code': CLOSE_RETRY_LATER, 'reason': f'retry_after={retry_after}'})
+
 class WebSocketJWTAuthMiddleware:
     """
     Custom middleware to authenticate WebSocket connections using JWT tokens
@@ -24,10 +69,12 @@ class WebSocketJWTAuthMiddleware:
 
         if token:
             try:
-                user = await self.get_user_from_token(token)
+                # Tokens known to be bad are refused without decoding them again
+                user = None if admission.is_bad_token(token) else await self.get_user_from_token(token)
                 if user:
                     scope['user'] = user
                 else:
+                    admission.remember_bad_token(token)
                     # Close connection if user not found
                     await send({
                         "type": "websocket.close",
@@ -51,11 +98,10 @@ class WebSocketJWTAuthMiddleware:
 
         return await self.app(scope, receive, send)
 
-    @database_sync_to_async
+    @db_sync_to_async
     def get_user_from_token(self, token):
         try:
             access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            return User.objects.get(id=user_id)
-        except (InvalidToken, TokenError, User.DoesNotExist):
+            return get_user(access_token['user_id'])
+        except (InvalidToken, TokenError, KeyError):
             return None
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Bounded, prioritized outbound queue of a WebSocket connection.
+
+Frames for a client are queued in three lanes, written by one task per
+connection in priority order:
+
+    CONTROL  session controls, clock syncs, dashboard deltas, acks and
+             errors, never dropped
+    CHAT     chat messages and other ordered events
+    STATE    focus updates, stats and timers, where only the newest frame of
+             a key is kept
+
+When the queue holds more than OUTBOUND_MAX_FRAMES frames the oldest STATE
+frame is dropped, then the oldest CHAT frame. A connection whose queue
+still overflows, or whose oldest frame has waited more than
+OUTBOUND_MAX_LAG seconds, is stalled: its queue is cleared and the
+consumer disconnects it. The lag is checked when frames are queued and by
+the connection reaper, so a connection whose writer is stuck is stalled
+even if nothing more is sent to it. The writer awaits every send, so frames back up
+here (and are bounded) rather than in the transport when the server
+applies flow control, and a slow client only costs its own bounded queue.
+
+Clients may negotiate a batching window. The writer then waits that long
+after the first frame and sends everything queued meanwhile as a single
+{"type": "batch", "events": [...]} text frame, built by joining the
+already encoded JSON payloads.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+
+from .conf import get_setting
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTROL = 0
+CHAT = 1
+STATE = 2
+
+
+class OutboundQueue:
+    # Frames queued over all the connections of the process
+    queued = 0
+
+    def __init__(self, send, on_stalled, max_frames=None, max_lag=None, batch_window=None):
+        self.send = send
+        self.on_stalled = on_stalled
+        self.max_frames = max_frames or get_setting('OUTBOUND_MAX_FRAMES')
+        self.max_lag = max_lag or get_setting('OUTBOUND_MAX_LAG')
+        self.batch_window = batch_window
+        self.lanes = (deque(), deque(), OrderedDict())
+        self.keys = itertools.count()
+        self.ready = asyncio.Event()
+        self.task = None
+        self.lag = 0.0
+        self.stalled = False
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    @classmethod
+    def adjust(cls, count):
+        cls.queued += count
+        metrics.set('outbound.queued_frames', cls.queued)
+
+    def put(self, frame, lane=CONTROL, key=None):
+        """Queue a text or bytes frame. STATE frames replace the queued frame of their key."""
+        if self.stalled:
+            return
+        now = time.monotonic()
+        if lane == STATE:
+            state = self.lanes[STATE]
+            key = next(self.keys) if key is None else key
+            if key in state:
+                # Keep the slot, and its age, of the frame being replaced
+                state[key] = (state[key][0], frame)
+                metrics.incr('outbound.replaced')
+                return
+            state[key] = (now, frame)
+        else:
+            self.lanes[lane].append((now, frame))
+        self.adjust(1)
+
+        if len(self) > self.max_frames and not self.evict():
+            self.stall('queue full')
+            return
+        if self.check(now):
+            return
+        self.start()
+        self.ready.set()
+
+    def oldest(self, now):
+        """Enqueue time of the oldest queued frame"""
+        control, chat, state = self.lanes
+        heads = [lane[0][0] for lane in (control, chat) if lane]
+        if state:
+            heads.append(next(iter(state.values()))[0])
+        return min(heads, default=now)
+
+    def current_lag(self, now=None):
+        """Seconds the oldest queued frame has waited, 0 if none is queued"""
+        now = time.monotonic() if now is None else now
+        return now - self.oldest(now)
+
+    def check(self, now=None):
+        """Stall the queue if it is too far behind. Returns True if stalled."""
+        if not self.stalled and self.current_lag(now) > self.max_lag:
+            self.stall(f'behind by more than {self.max_lag}s')
+        return self.stalled
+
+    def evict(self):
+        """Drop the oldest droppable frame. Returns False if only control frames are left."""
+        if self.lanes[STATE]:
+            self.lanes[STATE].popitem(last=False)
+        elif self.lanes[CHAT]:
+            self.lanes[CHAT].popleft()
+        else:
+            return False
+        self.adjust(-1)
+        metrics.incr('outbound.dropped')
+        return True
+
+    def pop(self):
+        for lane in (CONTROL, CHAT):
+            if self.lanes[lane]:
+                return self.lanes[lane].popleft()
+        return self.lanes[STATE].popitem(last=False)[1]
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            self.ready.clear()
+            batch = []
+            while len(self):
+                enqueued_at, frame = self.pop()
+                self.adjust(-1)
+                self.lag = time.monotonic() - enqueued_at
+                metrics.max('outbound.max_lag_ms', round(self.lag * 1000, 1))
+                if isinstance(frame, bytes):
+                    await self.send_batch(batch)
+                    await self.send(bytes_data=frame)
+                elif self.batch_window:
+                    batch.append(frame)
+                else:
+                    await self.send(text_data=frame)
+            await self.send_batch(batch)
+
+    async def send_batch(self, batch):
+        """Send the text frames collected in the batching window"""
+        if len(batch) == 1:
+            await self.send(text_data=batch[0])
+        elif batch:
+            metrics.incr('outbound.batches')
+            metrics.incr('outbound.batched_events', len(batch))
+            await self.send(text_data='{"type": "batch", "events": [' + ', '.join(batch) + ']}')
+        batch.clear()
+
+    def stall(self, reason):
+        logger.warning(f"Outbound queue stalled ({reason}), disconnecting client")
+        metrics.incr('outbound.disconnects')
+        self.close()
+        self.stalled = True
+        self.on_stalled()
+
+    def close(self):
+        """Stop the writer and drop whatever is still queued"""
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.adjust(-len(self))
+        for lane in self.lanes:
+            lane.clear()
@@ -0,0 +1,350 @@
+"""
+Write-behind persistence of focus scores.
+
+Focus samples only update an in-memory buffer keyed by (session, student),
+so repeated samples of a student collapse into their latest score. The
+buffer is written with one bulk_update/bulk_create every
+FOCUS_FLUSH_INTERVAL_MS, as soon as FOCUS_FLUSH_MAX_ROWS rows are pending,
+when a session ends and when the process exits.
+
+Every sample is also appended to the student's open FocusChunk and folded
+into the live focus rollups. Full chunks, open ones older than
+FOCUS_CHUNK_MAX_AGE and closed rollup buckets are written with the same
+flush; the remaining open chunks and buckets are written when the session
+ends.
+
+Chat messages are appended to a ChatWriteBuffer and inserted with one
+bulk_create every CHAT_FLUSH_INTERVAL_MS, or as soon as CHAT_FLUSH_MAX_ROWS
+are pending, so the event loop never waits for a chat insert.
+"""
+import asyncio
+import atexit
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from performance.models import FocusChunk, FocusRollup, Performance
+from performance.rollups import live_rollups, to_model as rollup_to_model
+from performance.timeseries import ChunkBuilder
+from session.models import ChatMessage
+from .conf import get_setting
+from .db import db_sync_to_async
+from .metrics import metrics
+from .ticker import tickers
+
+logger = logging.getLogger(__name__)
+
+
+class FocusWriteBuffer:
+    """Latest focus score per (session, student), waiting to be written"""
+    def __init__(self):
+        self.pending = {}
+        self.series = {}
+        self.sealed = []
+        self.oldest = None
+        self.task = None
+        self.wakeup = None
+        self.lock = None
+
+    def add(self, session_id, student_id, focus_score, timestamp=None):
+        """Buffer the latest focus score of a student and append it to their series"""
+        key = (int(session_id), student_id)
+        timestamp = timestamp or timezone.now()
+        self.pending[key] = (focus_score, timestamp)
+
+        chunk = self.series.get(key)
+        if chunk is None or not chunk.append(timestamp, focus_score):
+            if chunk is not None:
+                self.sealed.append((key, chunk))
+            chunk = self.series[key] = ChunkBuilder(timestamp)
+            chunk.append(timestamp, focus_score)
+        if chunk.full:
+            self.sealed.append((key, self.series.pop(key)))
+        live_rollups.add(key[0], key[1], timestamp, focus_score)
+
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        metrics.set('focus_buffer.pending_rows', len(self.pending))
+
+    async def write(self, session_id, student_id, focus_score, timestamp=None):
+        """Buffer a focus score, flushing according to the durability settings"""
+        await self.write_many(session_id, student_id, [(focus_score, timestamp)])
+
+    async def write_many(self, session_id, student_id, samples):
+        """Buffer (focus_score, timestamp) samples of a student as a unit"""
+        for focus_score, timestamp in samples:
+            self.add(session_id, student_id, focus_score, timestamp)
+        if get_setting('FOCUS_WRITE_MODE') == 'immediate':
+            await self.flush()
+            return
+        self.start()
+        if len(self.pending) >= get_setting('FOCUS_FLUSH_MAX_ROWS'):
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        interval = get_setting('FOCUS_FLUSH_INTERVAL_MS') / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Focus buffer flush failed: {e}")
+
+    def take(self, session_id=None, final=False):
+        """
+        Remove and return the pending rows, chunks and rollup buckets ready to
+        be written, optionally of a single session. With final, open chunks
+        and buckets are included.
+        """
+        if session_id is None:
+            rows, self.pending = self.pending, {}
+        else:
+            session_id = int(session_id)
+            rows = {key: value for key, value in self.pending.items() if key[0] == session_id}
+            for key in rows:
+                del self.pending[key]
+
+        # Seal the open chunks that are due
+        max_age = timezone.now() - timedelta(seconds=get_setting('FOCUS_CHUNK_MAX_AGE'))
+        for key, chunk in list(self.series.items()):
+            if session_id is not None and key[0] != session_id:
+                continue
+            if final or chunk.start_time <= max_age:
+                self.sealed.append((key, self.series.pop(key)))
+
+        chunks = [item for item in self.sealed if session_id is None or item[0][0] == session_id]
+        self.sealed = [item for item in self.sealed if session_id is not None and item[0][0] != session_id]
+
+        rollups = live_rollups.take(session_id, final)
+
+        oldest = self.oldest
+        if not self.pending:
+            self.oldest = None
+        return rows, chunks, rollups, oldest
+
+    def restore(self, rows, chunks, rollups):
+        """Put back what failed to flush, unless a newer score arrived"""
+        for key, value in rows.items():
+            self.pending.setdefault(key, value)
+        self.sealed[:0] = chunks
+        live_rollups.restore(rollups)
+        if self.pending and self.oldest is None:
+            self.oldest = time.monotonic()
+
+    async def flush(self, session_id=None, final=False):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            rows, chunks, rollups, oldest = self.take(session_id, final)
+            if not rows and not chunks and not rollups:
+                return
+            try:
+                await db_sync_to_async(write_focus_rows)(rows, chunks, rollups)
+            except Exception:
+                self.restore(rows, chunks, rollups)
+                metrics.incr('focus_buffer.flush_errors')
+                raise
+            finally:
+                metrics.set('focus_buffer.pending_rows', len(self.pending))
+            self.record_flush(rows, chunks, rollups, oldest)
+
+    async def flush_session(self, session_id):
+        """Write everything buffered for a session, e.g. when it ends"""
+        try:
+            await self.flush(session_id, final=True)
+        except Exception as e:
+            logger.exception(f"Focus buffer flush failed for session {session_id}: {e}")
+
+    def flush_sync(self):
+        """Flush everything from synchronous code, e.g. at process exit"""
+        rows, chunks, rollups, oldest = self.take(final=True)
+        if not rows and not chunks and not rollups:
+            return
+        try:
+            write_focus_rows(rows, chunks, rollups)
+        except Exception as e:
+            logger.exception(f"Final focus buffer flush failed, {len(rows)} rows lost: {e}")
+            return
+        self.record_flush(rows, chunks, rollups, oldest)
+
+    def record_flush(self, rows, chunks, rollups, oldest):
+        lag = (time.monotonic() - oldest) * 1000 if oldest is not None else 0.0
+        metrics.incr('focus_buffer.flushes')
+        metrics.incr('focus_buffer.rows_flushed', len(rows))
+        metrics.incr('focus_buffer.chunks_flushed', len(chunks))
+        metrics.incr('focus_buffer.rollups_flushed', len(rollups))
+        metrics.set('focus_buffer.flush_lag_ms', round(lag, 1))
+        metrics.max('focus_buffer.max_flush_lag_ms', round(lag, 1))
+
+
+def write_focus_rows(rows, chunks=(), rollups=()):
+    """
+    Write {(session_id, student_id): (focus_score, timestamp)}, a list of
+    ((session_id, student_id), ChunkBuilder) and a list of closed rollup
+    buckets in bulk.
+    """
+    session_ids = {session_id for session_id, _ in rows}
+    student_ids = {student_id for _, student_id in rows}
+    with transaction.atomic():
+        existing = {
+            (performance.session_id, performance.student_id): performance
+            for performance in Performance.objects.filter(
+                session_id__in=session_ids,
+                student_id__in=student_ids
+            )
+        }
+        to_update, to_create = [], []
+        for key, (focus_score, timestamp) in rows.items():
+            performance = existing.get(key)
+            if performance is None:
+                to_create.append(Performance(
+                    session_id=key[0],
+                    student_id=key[1],
+                    focus_score=focus_score,
+                    attended=True
+                ))
+            else:
+                performance.focus_score = focus_score
+                performance.timestamp = timestamp
+                to_update.append(performance)
+        Performance.objects.bulk_update(to_update, ['focus_score', 'timestamp'], batch_size=500)
+        # A row created since the lookup, by another worker or the session
+        # views, takes the buffered score rather than dropping it
+        Performance.objects.bulk_create(
+            to_create,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['session', 'student'],
+            update_fields=['focus_score', 'timestamp']
+        )
+        FocusChunk.objects.bulk_create(
+            [chunk.to_model(*key) for key, chunk in chunks],
+            batch_size=500
+        )
+        FocusRollup.objects.bulk_create(
+            [rollup_to_model(*rollup) for rollup in rollups],
+            batch_size=500
+        )
+
+
+class ChatWriteBuffer:
+    """Chat messages waiting to be written, in the order they were sent"""
+    def __init__(self):
+        self.pending = []
+        self.task = None
+        self.wakeup = None
+        self.lock = None
+
+    def add(self, session_id, user_id, message, timestamp):
+        self.pending.append(ChatMessage(
+            session_id=int(session_id),
+            user_id=user_id,
+            message=message,
+            timestamp=timestamp
+        ))
+        metrics.set('chat_buffer.pending_rows', len(self.pending))
+
+    async def write(self, session_id, user_id, message, timestamp):
+        """Buffer a chat message, flushed within CHAT_FLUSH_INTERVAL_MS"""
+        self.add(session_id, user_id, message, timestamp)
+        self.start()
+        if len(self.pending) >= get_setting('CHAT_FLUSH_MAX_ROWS'):
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        interval = get_setting('CHAT_FLUSH_INTERVAL_MS') / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Chat buffer flush failed: {e}")
+
+    def take(self, session_id=None):
+        """Remove and return the pending messages, optionally of a single session"""
+        if session_id is None:
+            messages, self.pending = self.pending, []
+        else:
+            session_id = int(session_id)
+            messages = [message for message in self.pending if message.session_id == session_id]
+            self.pending = [message for message in self.pending if message.session_id != session_id]
+        return messages
+
+    async def flush(self, session_id=None):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            messages = self.take(session_id)
+            if not messages:
+                return
+            try:
+                await db_sync_to_async(ChatMessage.objects.bulk_create)(messages, batch_size=500)
+            except Exception:
+                self.pending[:0] = messages
+                metrics.incr('chat_buffer.flush_errors')
+                raise
+            finally:
+                metrics.set('chat_buffer.pending_rows', len(self.pending))
+            metrics.incr('chat_buffer.flushes')
+            metrics.incr('chat_buffer.rows_flushed', len(messages))
+
+    async def flush_session(self, session_id):
+        """Write everything buffered for a session, e.g. when it ends"""
+        try:
+            await self.flush(session_id)
+        except Exception as e:
+            logger.exception(f"Chat buffer flush failed for session {session_id}: {e}")
+
+    def flush_sync(self):
+        """Flush everything from synchronous code, e.g. at process exit"""
+        messages = self.take()
+        if not messages:
+            return
+        try:
+            ChatMessage.objects.bulk_create(messages, batch_size=500)
+        except Exception as e:
+            logger.exception(f"Final chat buffer flush failed, {len(messages)} messages lost: {e}")
+
+
+def flush_session(session_id):
+    """Flush the scores and chat of a session once its ticker stops"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    loop.create_task(focus_buffer.flush_session(session_id))
+    loop.create_task(chat_buffer.flush_session(session_id))
+
+
+# Global write-behind buffer instances, flushed when a session's ticker
+# stops and when the process exits
+focus_buffer = FocusWriteBuffer()
+chat_buffer = ChatWriteBuffer()
+tickers.register_stop(flush_session)
+atexit.register(focus_buffer.flush_sync)
+atexit.register(chat_buffer.flush_sync)
@@ -0,0 +1,220 @@
+"""
+Presence registry of live sessions.
+
+Tracks which users are connected to a session, with which role and through
+how many connections, so participant counts and listings are read from
+here rather than derived from Performance rows.
+
+With REDIS_URL set (see shared.py), presence is shared by every worker
+through Redis:
+
+    presence:<session>:<role>             ZSET user id -> expiry
+    presence:<session>:user:<user id>     ZSET channel name -> expiry
+
+Every worker refreshes the expiry of its own connections each
+PRESENCE_HEARTBEAT_INTERVAL seconds. Connections of a worker that died stop
+being counted PRESENCE_TTL seconds after its last heartbeat: counts are a
+ZCOUNT of the unexpired members, and expired ones are pruned as users come
+and go. Without it, presence is kept in process, which is exact for a
+single worker. Redis errors are logged and answered from the local state.
+
+A user connected more than once to a session (e.g. from two tabs) is
+handled according to DUPLICATE_CONNECTIONS:
+
+    'all'     every connection is kept, the user counts once
+    'newest'  older connections are closed with CLOSE_REPLACED
+    'reject'  new connections are closed with CLOSE_DUPLICATE
+
+Whatever the policy, joins, leaves and attendance are only recorded for
+the first connection of a user and after their last one.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+
+import redis.asyncio as redis
+
+from .conf import get_setting
+from .metrics import metrics
+from .shared import get_redis
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('instructor', 'student')
+
+# Close codes of connections refused or replaced by a newer one of the user
+CLOSE_DUPLICATE = 4409
+CLOSE_REPLACED = 4410
+
+# Removes a connection, then the user once their last connection is gone.
+# Returns 1 if the user has no connection left.
+LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+if redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def role_key(session_id, role):
+    return f'presence:{session_id}:{role}'
+
+
+def user_key(session_id, user_id):
+    return f'presence:{session_id}:user:{user_id}'
+
+
+class PresenceRegistry:
+    def __init__(self):
+        # session id -> channel name -> (user id, role) of local connections
+        self.connections = defaultdict(dict)
+        # session id -> role -> local connections per user id
+        self.users = defaultdict(lambda: {role: Counter() for role in ROLES})
+        self.heartbeat_task = None
+
+    def roles(self, role=None):
+        return ROLES if role is None else (role,)
+
+    def failed(self, action, error):
+        metrics.incr('presence.errors')
+        logger.warning(f"Presence {action} failed, using local state: {error}")
+
+    async def join(self, session_id, user_id, role, channel_name):
+        """Count a connection in. Returns the number of connections of the user."""
+        session_id = str(session_id)
+        self.connections[session_id][channel_name] = (user_id, role)
+        self.users[session_id][role][user_id] += 1
+        local = self.users[session_id][role][user_id]
+
+        client = get_redis()
+        if client is None:
+            return local
+        self.start_heartbeats()
+        now = time.time()
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                self.refresh(pipe, session_id, user_id, role, channel_name, now)
+                pipe.zremrangebyscore(user_key(session_id, user_id), '-inf', now)
+                pipe.zcard(user_key(session_id, user_id))
+                return (await pipe.execute())[-1]
+        except redis.RedisError as e:
+            self.failed('join', e)
+            return local
+
+    async def leave(self, session_id, user_id, role, channel_name):
+        """Count a connection out. Returns True if the user has no connection left."""
+        session_id = str(session_id)
+        self.connections[session_id].pop(channel_name, None)
+        users = self.users[session_id][role]
+        users[user_id] -= 1
+        if users[user_id] <= 0:
+            del users[user_id]
+        gone = user_id not in users
+        if not self.connections[session_id]:
+            del self.connections[session_id]
+            del self.users[session_id]
+
+        client = get_redis()
+        if client is None:
+            return gone
+        try:
+            return bool(await client.eval(
+                LEAVE_SCRIPT, 2,
+                role_key(session_id, role), user_key(session_id, user_id),
+                channel_name, time.time(), user_id
+            ))
+        except redis.RedisError as e:
+            self.failed('leave', e)
+            return gone
+
+    async def count(self, session_id, role=None):
+        """Number of users connected to a session, with a role if given"""
+        session_id = str(session_id)
+        client = get_redis()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    for name in self.roles(role):
+                        pipe.zcount(role_key(session_id, name), time.time(), '+inf')
+                    return sum(await pipe.execute())
+            except redis.RedisError as e:
+                self.failed('count', e)
+        users = self.users.get(session_id)
+        return sum(len(users[name]) for name in self.roles(role)) if users else 0
+
+    def local_count(self, session_id, role=None):
+        """Number of users connected to a session through this process"""
+        users = self.users.get(str(session_id))
+        return sum(len(users[name]) for name in self.roles(role)) if users else 0
+
+    async def members(self, session_id, role=None):
+        """Sorted ids of the users connected to a session, with a role if given"""
+        session_id = str(session_id)
+        client = get_redis()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    for name in self.roles(role):
+                        pipe.zrangebyscore(role_key(session_id, name), time.time(), '+inf')
+                    return sorted({int(member) for members in await pipe.execute() for member in members})
+            except redis.RedisError as e:
+                self.failed('members', e)
+        users = self.users.get(session_id)
+        return sorted({user_id for name in self.roles(role) for user_id in users[name]}) if users else []
+
+    async def channels(self, session_id, user_id):
+        """Channel names of the connections of a user to a session"""
+        session_id = str(session_id)
+        client = get_redis()
+        if client is not None:
+            try:
+                members = await client.zrangebyscore(user_key(session_id, user_id), time.time(), '+inf')
+                return [member.decode() for member in members]
+            except redis.RedisError as e:
+                self.failed('channels', e)
+        return [
+            channel_name for channel_name, (connected_id, _) in self.connections.get(session_id, {}).items()
+            if connected_id == user_id
+        ]
+
+    def refresh(self, pipe, session_id, user_id, role, channel_name, now):
+        """Queue the commands pushing back the expiry of a connection"""
+        ttl = get_setting('PRESENCE_TTL')
+        pipe.zadd(user_key(session_id, user_id), {channel_name: now + ttl})
+        pipe.zadd(role_key(session_id, role), {user_id: now + ttl})
+        pipe.expire(user_key(session_id, user_id), ttl)
+        pipe.expire(role_key(session_id, role), ttl)
+
+    async def heartbeat(self):
+        """Refresh every local connection, in one round trip"""
+        client = get_redis()
+        if client is None or not self.connections:
+            return
+        now = time.time()
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for session_id, connections in self.connections.items():
+                    for channel_name, (user_id, role) in connections.items():
+                        self.refresh(pipe, session_id, user_id, role, channel_name, now)
+                await pipe.execute()
+        except redis.RedisError as e:
+            self.failed('heartbeat', e)
+
+    def start_heartbeats(self):
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self.run_heartbeats())
+
+    async def run_heartbeats(self):
+        # Heartbeats run on every worker, unlike ticker jobs which only run
+        # where the session lease is held
+        while self.connections:
+            await asyncio.sleep(get_setting('PRESENCE_HEARTBEAT_INTERVAL'))
+            await self.heartbeat()
+
+
+# Global presence registry instance
+presence = PresenceRegistry()
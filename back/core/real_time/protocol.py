@@ -0,0 +1,152 @@
+"""
+Validation of the messages sent by clients.
+
+The schemas of schemas.py are compiled once, at import, into validator
+functions: each field of a schema becomes a list of (test, error) pairs
+built from its keywords, so validating a message runs those tests without
+walking the schema again. Only the keywords the schemas use are supported
+(type, const, enum, minimum, maximum, minLength, maxLength, minItems,
+maxItems and required); any other keyword fails at import rather than being
+silently ignored.
+
+The consumer validates every message here before dispatching it to the
+handler of its type, so a malformed message is refused before any database
+or channel layer work. Message types are normalized as the consumer always
+did ("focus.update" is "focus_update"). Rejections are counted per message
+type in the metrics registry, as protocol.rejected.<type>, with "frame" for
+frames that do not decode and "unknown" for unknown types.
+"""
+import logging
+import math
+
+from .metrics import metrics
+from .schemas import CLIENT_SCHEMAS
+
+logger = logging.getLogger(__name__)
+
+# JSON types of the schemas, booleans are not numbers
+TYPES = {
+    'object': (dict,),
+    'array': (list,),
+    'string': (str,),
+    'boolean': (bool,),
+    'integer': (int,),
+    'number': (int, float),
+}
+
+
+def normalize_type(message_type):
+    return message_type.replace('.', '_').lower()
+
+
+def compile_type(name, kind):
+    types = TYPES[kind]
+    if kind == 'boolean':
+        test = lambda value: isinstance(value, bool)
+    elif kind == 'number':
+        test = lambda value: isinstance(value, types) and not isinstance(value, bool) and math.isfinite(value)
+    else:
+        test = lambda value: isinstance(value, types) and not isinstance(value, bool)
+    return test, f"'{name}' must be a{'n' if kind[0] in 'aeiou' else ''} {kind}"
+
+
+def compile_field(name, rules):
+    """(test, error) pairs checking the value of a field, type first"""
+    checks = []
+    if 'type' in rules:
+        checks.append(compile_type(name, rules['type']))
+    for keyword, bound in rules.items():
+        if keyword == 'type':
+            continue
+        if keyword == 'const':
+            checks.append((lambda value, bound=bound: value == bound, f"'{name}' must be {bound!r}"))
+        elif keyword == 'enum':
+            # A tuple, values may be lists or dicts which do not hash
+            choices = tuple(bound)
+            checks.append((lambda value: value in choices, f"'{name}' must be one of {', '.join(map(str, bound))}"))
+        elif keyword == 'minimum':
+            checks.append((lambda value, bound=bound: value >= bound, f"'{name}' must be at least {bound}"))
+        elif keyword == 'maximum':
+            checks.append((lambda value, bound=bound: value <= bound, f"'{name}' must be at most {bound}"))
+        elif keyword in ('minLength', 'minItems'):
+            unit = 'characters' if keyword == 'minLength' else 'items'
+            checks.append((lambda value, bound=bound: len(value) >= bound, f"'{name}' must have at least {bound} {unit}"))
+        elif keyword in ('maxLength', 'maxItems'):
+            unit = 'characters' if keyword == 'maxLength' else 'items'
+            checks.append((lambda value, bound=bound: len(value) <= bound, f"'{name}' must have at most {bound} {unit}"))
+        else:
+            raise ValueError(f"Unsupported schema keyword '{keyword}' for '{name}'")
+    return checks
+
+
+def compile_schema(schema):
+    """
+    Validator of a message schema: a function of the decoded message
+    returning None if valid, else a client-facing error message.
+    The type of the message is not checked, it was dispatched on.
+    """
+    required = tuple(name for name in schema.get('required', ()) if name != 'type')
+    fields = tuple(
+        (name, tuple(compile_field(name, rules)))
+        for name, rules in schema.get('properties', {}).items()
+        if name != 'type'
+    )
+
+    def validate(data):
+        for name in required:
+            if name not in data:
+                return f"Missing '{name}'"
+        for name, checks in fields:
+            if name in data:
+                value = data[name]
+                for test, error in checks:
+                    if not test(value):
+                        return error
+        return None
+    return validate
+
+
+class Protocol:
+    def __init__(self, schemas):
+        # Normalized message type -> validator
+        self.validators = {
+            normalize_type(schema['properties']['type']['const']): compile_schema(schema)
+            for schema in schemas
+        }
+
+    @property
+    def message_types(self):
+        return frozenset(self.validators)
+
+    def validate(self, data):
+        """
+        Validate a decoded message.
+        Returns (normalized type, None) if valid, else (type or None, error).
+        """
+        if not isinstance(data, dict):
+            return None, self.reject('frame', 'Invalid message')
+        message_type = data.get('type')
+        if not message_type or not isinstance(message_type, str):
+            return None, self.reject('frame', 'Missing message type')
+
+        normalized = normalize_type(message_type)
+        validator = self.validators.get(normalized)
+        if validator is None:
+            logger.warning(f"Unknown message type: {message_type} (normalized: {normalized})")
+            return None, self.reject('unknown', f'Unknown message type: {message_type}')
+        try:
+            error = validator(data)
+        except (TypeError, ValueError):
+            error = 'Invalid message'
+        if error is not None:
+            return normalized, self.reject(normalized, error)
+        return normalized, None
+
+    def reject(self, kind, error):
+        """Count a rejected message, returns its error"""
+        metrics.incr(f'protocol.rejected.{kind}')
+        return error
+
+
+# Global protocol instance
+protocol = Protocol(CLIENT_SCHEMAS)
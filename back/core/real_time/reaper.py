@@ -0,0 +1,98 @@
+"""
+Server-driven heartbeats and reaping of idle connections.
+
+A client that vanishes without closing its socket keeps its consumer, its
+outbound writer and its group memberships alive, and every broadcast is
+still sent to it until the channel layer's group expiry. The reaper tracks
+the open connections of the process and, every HEARTBEAT_INTERVAL seconds,
+sends each of them a heartbeat frame. A connection that has not sent
+anything (a pong, a ping or any message) for IDLE_TIMEOUT seconds is reaped:
+it is sent a connection.reap event on its own channel, whose handler runs
+the same cleanup as a disconnect, closes the socket and stops the consumer.
+
+Each sweep also checks the outbound queue of every connection, stalling
+(and so disconnecting) those whose oldest frame waited more than
+OUTBOUND_MAX_LAG seconds, and records the largest lag as the
+outbound.current_max_lag_ms gauge. lags() lists the lag of every connection
+for the metrics endpoint.
+
+A single task per process does this for all connections.
+"""
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from core import codec
+
+from .conf import get_setting
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Close code of reaped connections
+CLOSE_IDLE = 4009
+
+
+class ConnectionReaper:
+    def __init__(self):
+        self.connections = {}
+        self.task = None
+
+    def track(self, consumer):
+        consumer.last_seen = time.monotonic()
+        self.connections[consumer.channel_name] = consumer
+        metrics.set('connections.open', len(self.connections))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def untrack(self, consumer):
+        self.connections.pop(consumer.channel_name, None)
+        metrics.set('connections.open', len(self.connections))
+
+    async def run(self):
+        while self.connections:
+            await asyncio.sleep(get_setting('HEARTBEAT_INTERVAL'))
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception(f"Connection sweep failed: {e}")
+
+    async def sweep(self, now=None):
+        """Reap the idle connections and send a heartbeat to the others"""
+        now = time.monotonic() if now is None else now
+        deadline = now - get_setting('IDLE_TIMEOUT')
+        heartbeat = codec.dumps({'type': 'heartbeat'})
+        max_lag = 0.0
+        for consumer in list(self.connections.values()):
+            if consumer.last_seen < deadline:
+                self.untrack(consumer)
+                metrics.incr('connections.reaped')
+                await get_channel_layer().send(consumer.channel_name, {'type': 'connection.reap'})
+                continue
+            outbound = consumer.outbound
+            if outbound is not None:
+                max_lag = max(max_lag, outbound.current_lag(now))
+                if outbound.check(now):
+                    continue
+            await consumer.send(text_data=heartbeat)
+            metrics.incr('connections.heartbeats')
+        metrics.set('outbound.current_max_lag_ms', round(max_lag * 1000, 1))
+
+    def lags(self, now=None):
+        """Outbound lag and queued frames of every connection, the slowest first"""
+        now = time.monotonic() if now is None else now
+        lags = [
+            {
+                'session_id': consumer.session_id,
+                'user_id': getattr(consumer.user, 'id', None),
+                'lag_ms': round(consumer.outbound.current_lag(now) * 1000, 1),
+                'queued_frames': len(consumer.outbound),
+            }
+            for consumer in self.connections.values() if consumer.outbound is not None
+        ]
+        return sorted(lags, key=lambda lag: lag['lag_ms'], reverse=True)
+
+
+# Global connection reaper instance
+reaper = ConnectionReaper()
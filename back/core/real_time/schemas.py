@@ -6,9 +6,13 @@ WebSocket message schemas for EduFocus
 MESSAGE_TYPES = {
     'CONNECTION_ESTABLISHED': 'connection_established',
     'FOCUS_UPDATE': 'focus_update',
+    'FOCUS_BATCH': 'focus_batch',
     'TIMER_UPDATE': 'timer_update',
     'SESSION_CONTROL': 'session_control',
     'CHAT_MESSAGE': 'chat_message',
+    'REQUEST_SESSION_STATS': 'request_session_stats',
+    'PING': 'ping',
+    'PONG': 'pong',
     'USER_JOINED': 'user_joined',
     'USER_LEFT': 'user_left',
     'ERROR': 'error'
@@ -24,6 +28,17 @@ FOCUS_UPDATE_SCHEMA = {
     'required': ['type', 'focus_score']
 }
 
+# Focus batch schema, samples are checked by ingest.parse_batch
+FOCUS_BATCH_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'const': MESSAGE_TYPES['FOCUS_BATCH']},
+        'seq': {'type': 'integer', 'minimum': 0},
+        'samples': {'type': 'array', 'minItems': 1}
+    },
+    'required': ['type', 'seq', 'samples']
+}
+
 # Timer update schema
 TIMER_UPDATE_SCHEMA = {
     'type': 'object',
@@ -49,7 +64,44 @@ CHAT_MESSAGE_SCHEMA = {
     'type': 'object',
     'properties': {
         'type': {'const': MESSAGE_TYPES['CHAT_MESSAGE']},
-        'message': {'type': 'string', 'minLength': 1, 'maxLength': 500}
+        'message': {'type': 'string', 'minLength': 1, 'maxLength': 1000}
     },
     'required': ['type', 'message']
-}
\ No newline at end of file
+}
+# Stats request schema
+REQUEST_SESSION_STATS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'const': MESSAGE_TYPES['REQUEST_SESSION_STATS']}
+    },
+    'required': ['type']
+}
+
+# Ping and pong schemas, pongs answer server heartbeats
+PING_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'const': MESSAGE_TYPES['PING']}
+    },
+    'required': ['type']
+}
+
+PONG_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'type': {'const': MESSAGE_TYPES['PONG']}
+    },
+    'required': ['type']
+}
+
+# Schemas of the messages clients may send
+CLIENT_SCHEMAS = (
+    FOCUS_UPDATE_SCHEMA,
+    FOCUS_BATCH_SCHEMA,
+    TIMER_UPDATE_SCHEMA,
+    SESSION_CONTROL_SCHEMA,
+    CHAT_MESSAGE_SCHEMA,
+    REQUEST_SESSION_STATS_SCHEMA,
+    PING_SCHEMA,
+    PONG_SCHEMA,
+)
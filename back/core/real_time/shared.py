@@ -0,0 +1,22 @@
+"""
+Redis connection of the real-time state shared by workers.
+
+Presence and the session event log live in the Redis at REDIS_URL. When it
+is not set they are kept in process, which is exact for a single worker.
+"""
+import redis.asyncio as redis
+
+from .conf import get_setting
+
+# Clients by URL
+clients = {}
+
+
+def get_redis():
+    """Redis client of the shared state, None when it is kept in process"""
+    url = get_setting('REDIS_URL')
+    if not url:
+        return None
+    if url not in clients:
+        clients[url] = redis.from_url(url)
+    return clients[url]
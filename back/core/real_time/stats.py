@@ -0,0 +1,153 @@
+"""
+Coalesced, demand-driven session.stats broadcasting.
+
+Focus updates, new connections and explicit requests only mark a session's
+stats as pending. The session ticker recomputes and broadcasts them at most
+once per STATS_INTERVAL, and only while an instructor is subscribed, so the
+cost of stats scales with time rather than with the focus message rate. The
+stats themselves are read from the session aggregator, not the database,
+and the count of active participants from the presence registry.
+
+Students of webinar sessions get a lighter class.summary instead, every
+CLASS_SUMMARY_INTERVAL.
+
+Both run on every worker serving the session and only reach the
+connections of that worker (see groups.send_local): the aggregators of all
+workers hold the samples of the whole session, and whether an instructor is
+watching is read from the shared presence. Stats are pending after a
+request or a change of the aggregator window, wherever the sample came
+from.
+"""
+import time
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .aggregator import aggregators
+from .conf import get_setting
+from .groups import is_webinar, send_local
+from .presence import presence
+from .ticker import tickers
+
+
+class StatsBroadcaster:
+    """Tracks which sessions need fresh stats and who is watching them"""
+    def __init__(self):
+        self.pending = set()
+        self.last_sent = {}
+        self.versions = {}
+        self.instructors = defaultdict(int)
+
+    def request(self, session_id):
+        """Mark the stats of a session as stale"""
+        self.pending.add(str(session_id))
+
+    def subscribe(self, session_id):
+        """Count an instructor connection in. The newcomer gets fresh stats."""
+        self.instructors[str(session_id)] += 1
+        self.request(session_id)
+
+    def unsubscribe(self, session_id):
+        session_id = str(session_id)
+        self.instructors[session_id] -= 1
+        if self.instructors[session_id] <= 0:
+            del self.instructors[session_id]
+
+    def discard(self, session_id):
+        session_id = str(session_id)
+        self.pending.discard(session_id)
+        self.last_sent.pop(session_id, None)
+        self.versions.pop(session_id, None)
+
+    def is_due(self, session_id, now=None):
+        """True if stats are pending and not rate limited"""
+        aggregator = aggregators.get(session_id)
+        if session_id not in self.pending and (aggregator is None or aggregator.version == self.versions.get(session_id)):
+            return False
+        now = time.monotonic() if now is None else now
+        return now - self.last_sent.get(session_id, float('-inf')) >= get_setting('STATS_INTERVAL')
+
+    async def is_watched(self, session_id):
+        """True if an instructor, of any worker, gets stats from this one"""
+        if self.instructors.get(session_id):
+            return True
+        if is_webinar(session_id) or not presence.local_count(session_id, 'student'):
+            return False
+        return await presence.count(session_id, 'instructor') > 0
+
+    async def flush(self, ticker):
+        session_id = ticker.session_id
+        aggregator = aggregators.get(session_id)
+        if aggregator is None or not self.is_due(session_id):
+            return
+        # Unwatched stats are checked again after STATS_INTERVAL too
+        self.last_sent[session_id] = time.monotonic()
+        if not await self.is_watched(session_id):
+            return
+
+        self.pending.discard(session_id)
+        self.versions[session_id] = aggregator.version
+        stats = aggregator.get_stats(ticker.session.elapsed_seconds())
+        stats['active_participants'] = await presence.count(session_id, 'student')
+
+        await send_local(
+            session_id,
+            {
+                'type': 'session.stats',
+                'stats': stats,
+                'timestamp': timezone.now().isoformat()
+            }
+        )
+
+
+class ClassSummaryBroadcaster:
+    """Periodic class average sent to the students of webinar sessions"""
+    def __init__(self):
+        self.last_sent = {}
+
+    async def flush(self, ticker, now=None):
+        session_id = ticker.session_id
+        aggregator = aggregators.get(session_id)
+        if aggregator is None or not is_webinar(session_id) or not presence.local_count(session_id, 'student'):
+            return
+        now = time.monotonic() if now is None else now
+        if now - self.last_sent.get(session_id, float('-inf')) < get_setting('CLASS_SUMMARY_INTERVAL'):
+            return
+        self.last_sent[session_id] = now
+
+        stats = aggregator.get_stats(ticker.session.elapsed_seconds())
+        stats['active_participants'] = await presence.count(session_id, 'student')
+        await send_local(
+            session_id,
+            {
+                'type': 'class.summary',
+                'summary': {
+                    'total_participants': stats['total_participants'],
+                    'active_participants': stats['active_participants'],
+                    'average_focus_score': stats['average_focus_score'],
+                },
+                'timestamp': timezone.now().isoformat()
+            }
+        )
+
+    def discard(self, session_id):
+        self.last_sent.pop(str(session_id), None)
+
+
+# Global stats broadcaster instances
+stats_broadcaster = StatsBroadcaster()
+class_summaries = ClassSummaryBroadcaster()
+tickers.register_stop(stats_broadcaster.discard)
+tickers.register_stop(class_summaries.discard)
+
+
+@tickers.register
+async def broadcast_session_stats(ticker):
+    """Flush pending stats of the ticker's session"""
+    await stats_broadcaster.flush(ticker)
+
+
+@tickers.register
+async def broadcast_class_summary(ticker):
+    """Send the class summary of the ticker's session if it is a webinar"""
+    await class_summaries.flush(ticker)
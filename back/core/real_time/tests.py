@@ -1,17 +1,51 @@
 """
 Test suite for real_time app: SessionConsumer, WebSocket authentication, and real-time events.
 """
+import asyncio
+import io
 import json
+import sys
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import AsyncMock, Mock, patch
+from django.core.cache import caches
 from django.utils import timezone
 from channels.testing import WebsocketCommunicator
-from django.test import TransactionTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
+from core import codec
 from core.asgi import application
+from core.renderers import CodecJSONParser, CodecJSONRenderer
 print(f"Type of application: {type(application)}")
 print(f"Application object: {application}")
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 from classrooms.models import Classroom, Enrollment
-from session.models import Session
+from session.models import ChatMessage, Session
+from performance.models import FocusChunk, Performance
+from performance.rollups import live_rollups
+from performance.timeseries import read_session_series
+from real_time.admission import CLOSE_RETRY_LATER, Admission, admission
+from real_time.dashboard import DashboardStream
+from real_time.db import DatabaseExecutor
+from real_time.eventlog import EventLog, event_log
+from real_time.groups import local_group, route, send_event
+from real_time.ingest import FocusBatchLog, InvalidBatch, align_samples, focus_batches, parse_batch
+from real_time.metrics import metrics
+from real_time.outbound import CHAT, CONTROL, STATE, OutboundQueue
+from real_time.persistence import ChatWriteBuffer, FocusWriteBuffer, write_focus_rows
+from real_time.presence import CLOSE_DUPLICATE, CLOSE_REPLACED, PresenceRegistry, presence
+from real_time.protocol import Protocol, compile_schema, protocol
+from real_time.consumers import SessionConsumer
+from real_time.reaper import CLOSE_IDLE, ConnectionReaper, reaper
+from real_time import binary
+from real_time.aggregator import MAX_ROSTER, AggregatorRegistry, SessionAggregator, aggregators
+from real_time.stats import ClassSummaryBroadcaster, StatsBroadcaster
+from real_time.ticker import SessionTicker, TickerRegistry
 
 User = get_user_model()
 
@@ -27,6 +61,7 @@ class RealTimeWebSocketTests(TransactionTestCase):
 
         self.instructor_token = str(RefreshToken.for_user(self.instructor).access_token)
         self.student_token = str(RefreshToken.for_user(self.student).access_token)
+        admission.clear()
 
     async def test_student_connect_and_disconnect_successfully(self):
         communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.student_token}")
@@ -110,4 +145,1217 @@ class RealTimeWebSocketTests(TransactionTestCase):
 
         self.session.refresh_from_db()
         self.assertFalse(self.session.is_active)
-        await communicator.disconnect()
\ No newline at end of file
+        await communicator.disconnect()
+
+@override_settings(REAL_TIME={'CACHE_ALIAS': 'default', 'TICKER_INTERVAL': 0.01, 'TICKER_LEASE_TIMEOUT': 5})
+class SessionTickerTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    async def test_lease_is_owned_by_a_single_ticker(self):
+        registry = TickerRegistry()
+        first = SessionTicker(1, registry)
+        second = SessionTicker(1, registry)
+
+        self.assertTrue(await first.acquire_lease())
+        self.assertFalse(await second.acquire_lease())
+        self.assertTrue(await first.acquire_lease())
+
+        await first.release_lease()
+        self.assertTrue(await second.acquire_lease())
+
+    async def test_shared_lease_is_renewed_atomically(self):
+        client = Mock(eval=AsyncMock(side_effect=[1, 0, 1]))
+        ticker = SessionTicker(1, TickerRegistry())
+        with patch('real_time.ticker.get_redis', return_value=client):
+            self.assertTrue(await ticker.acquire_lease())
+            self.assertFalse(await ticker.acquire_lease())
+            await ticker.release_lease()
+
+        # One script call per acquire or release, never a get then a write
+        self.assertEqual(client.eval.await_count, 3)
+        self.assertEqual(client.eval.await_args_list[0].args[1:], (1, ticker.lease_key, ticker.owner, 5000))
+        self.assertEqual(client.eval.await_args_list[2].args[1:], (1, ticker.lease_key, ticker.owner))
+
+    @patch.object(SessionTicker, 'tick', new_callable=AsyncMock, return_value=True)
+    async def test_one_ticker_per_session_until_last_participant_leaves(self, mock_tick):
+        registry = TickerRegistry()
+        registry.register(AsyncMock())
+        ticker = registry.join(1)
+        self.assertIs(registry.join('1'), ticker)
+        self.assertEqual(ticker.participants, 2)
+
+        await asyncio.sleep(0.05)
+        self.assertTrue(mock_tick.await_count >= 1)
+
+        await registry.leave(1)
+        self.assertIs(registry.get(1), ticker)
+        await registry.leave(1)
+        self.assertIsNone(registry.get(1))
+        self.assertTrue(ticker.task.done())
+        self.assertIsNone(caches['default'].get(ticker.lease_key))
+
+    async def test_ticker_survives_transient_errors(self):
+        registry = TickerRegistry()
+        registry.register(AsyncMock())
+        hook = registry.register_stop(Mock())
+        leases = [ConnectionError('redis down')]
+        ticks = [RuntimeError('db down')]
+
+        async def acquire_lease():
+            if leases:
+                raise leases.pop()
+            return True
+
+        async def tick():
+            if ticks:
+                raise ticks.pop()
+            return True
+
+        with patch.object(SessionTicker, 'acquire_lease', side_effect=acquire_lease), \
+                patch.object(SessionTicker, 'tick', side_effect=tick) as mock_tick:
+            ticker = registry.join(1)
+            await asyncio.sleep(0.1)
+            self.assertFalse(ticker.task.done())
+            self.assertGreaterEqual(mock_tick.await_count, 2)
+            hook.assert_not_called()
+            await registry.leave(1)
+        hook.assert_called_once_with('1')
+
+    async def test_leased_jobs_only_run_on_the_owner(self):
+        registry = TickerRegistry()
+        job = registry.register(AsyncMock())
+        leased_job = registry.register(leased=True)(AsyncMock())
+        ticker = SessionTicker(1, registry)
+        ticker.session = Mock(is_active=True)
+        ticker.refreshed_at = time.monotonic()
+
+        self.assertTrue(await ticker.tick(owner=False))
+        job.assert_awaited_once_with(ticker)
+        leased_job.assert_not_awaited()
+        self.assertTrue(await ticker.tick(owner=True))
+        leased_job.assert_awaited_once_with(ticker)
+
+    @patch.object(SessionTicker, 'tick', new_callable=AsyncMock, return_value=False)
+    async def test_ticker_stops_when_session_is_over(self, mock_tick):
+        registry = TickerRegistry()
+        registry.register(AsyncMock())
+        ticker = registry.join(1)
+        await ticker.task
+        self.assertIsNone(registry.get(1))
+
+
+@override_settings(REAL_TIME={'STATS_INTERVAL': 2.0})
+class StatsBroadcasterTests(SimpleTestCase):
+    @override_settings(REAL_TIME={'STATS_INTERVAL': 2.0, 'REDIS_URL': None})
+    async def test_stats_are_skipped_without_instructors(self):
+        broadcaster = StatsBroadcaster()
+        registry = PresenceRegistry()
+        broadcaster.request(1)
+        self.assertTrue(broadcaster.is_due('1'))
+
+        with patch('real_time.stats.presence', registry):
+            self.assertFalse(await broadcaster.is_watched('1'))
+            broadcaster.subscribe(1)
+            self.assertTrue(await broadcaster.is_watched('1'))
+            broadcaster.unsubscribe(1)
+            self.assertFalse(await broadcaster.is_watched('1'))
+
+            # Students get the stats of instructors connected to other workers
+            await registry.join(1, 7, 'student', 'student-channel')
+            self.assertFalse(await broadcaster.is_watched('1'))
+            with patch.object(registry, 'count', new_callable=AsyncMock, return_value=1):
+                self.assertTrue(await broadcaster.is_watched('1'))
+
+    def test_remote_samples_make_stats_pending(self):
+        broadcaster = StatsBroadcaster()
+        aggregator = SessionAggregator([7], window=120)
+        with patch.dict(aggregators.aggregators, {'1': aggregator}):
+            aggregators.apply({'type': 'focus.sample', 'session_id': '1', 'user_id': 7, 'focus_score': 0.5, 'origin': 'elsewhere'})
+            self.assertTrue(broadcaster.is_due('1'))
+            broadcaster.versions['1'] = aggregator.version
+            self.assertFalse(broadcaster.is_due('1'))
+            aggregators.apply({'type': 'focus.remove', 'session_id': '1', 'user_id': 7, 'origin': 'elsewhere'})
+            self.assertTrue(broadcaster.is_due('1'))
+
+    @patch('real_time.groups.get_channel_layer')
+    async def test_pending_requests_are_coalesced(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        broadcaster = StatsBroadcaster()
+        ticker = SessionTicker(1, TickerRegistry())
+        ticker.session = Mock(**{'elapsed_seconds.return_value': 60.0})
+        aggregator = SessionAggregator([7], window=120)
+        aggregator.add(7, 0.9)
+        broadcaster.subscribe(1)
+
+        with patch.dict(aggregators.aggregators, {'1': aggregator}):
+            for _ in range(50):
+                broadcaster.request(1)
+            await broadcaster.flush(ticker)
+            broadcaster.request(1)
+            await broadcaster.flush(ticker)
+
+        mock_layer.return_value.group_send.assert_awaited_once()
+        event = json.loads(mock_layer.return_value.group_send.await_args.args[1]['text'])
+        self.assertEqual(event['stats']['average_focus_score'], 0.9)
+        self.assertEqual(event['stats']['session_duration'], 60.0)
+        self.assertTrue(broadcaster.is_due('1', now=time.monotonic() + 2))
+
+
+@override_settings(REAL_TIME={'DASHBOARD_INTERVAL': 0.5, 'DASHBOARD_THRESHOLD': 0.05})
+class DashboardStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.aggregator = SessionAggregator([1, 2, 3], window=120)
+        self.aggregator.add(1, 0.5)
+        self.aggregator.add(2, 0.8)
+        self.ticker = SessionTicker(1, TickerRegistry())
+
+    @patch('real_time.dashboard.get_channel_layer')
+    async def test_deltas_only_hold_changes_above_threshold(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        stream = DashboardStream()
+        with patch.dict(aggregators.aggregators, {'1': self.aggregator}):
+            snapshot = stream.subscribe(1)
+            self.assertEqual(snapshot['students'], {'1': 0.5, '2': 0.8})
+            self.assertEqual(snapshot['seq'], 0)
+
+            self.aggregator.add(1, 0.52)
+            self.aggregator.add(2, 0.6)
+            self.aggregator.add(3, 0.9)
+            self.aggregator.remove(1)
+            await stream.flush(self.ticker, now=100.0)
+
+            # Nothing moved, and frames are rate limited
+            await stream.flush(self.ticker, now=100.6)
+            self.aggregator.add(3, 0.1)
+            await stream.flush(self.ticker, now=100.7)
+
+        mock_layer.return_value.group_send.assert_awaited_once()
+        group, event = mock_layer.return_value.group_send.await_args.args
+        self.assertEqual(group, local_group('session_1_dashboard'))
+        event = json.loads(event['text'])
+        self.assertEqual(event['seq'], 1)
+        self.assertEqual(event['changes'], {'2': 0.6, '3': 0.9})
+        self.assertEqual(event['removed'], ['1'])
+
+    def test_new_dashboards_get_the_delta_baseline(self):
+        stream = DashboardStream()
+        with patch.dict(aggregators.aggregators, {'1': self.aggregator}):
+            stream.subscribe(1)
+            self.aggregator.add(1, 0.51)
+            stream.diff('1', {'1': 0.51, '2': 0.8})
+            self.assertEqual(stream.subscribe(1)['students'], {'1': 0.5, '2': 0.8})
+
+            stream.unsubscribe(1)
+            stream.unsubscribe(1)
+            self.assertNotIn('1', stream.state)
+
+    async def test_deltas_are_never_dropped(self):
+        sent, stalled = [], Mock()
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        consumer = SessionConsumer()
+        consumer.outbound = OutboundQueue(send, stalled, max_frames=2, max_lag=10)
+        await consumer.chat_message({'text': 'chat'})
+        await consumer.dashboard_delta({'text': 'delta 1'})
+        await consumer.dashboard_delta({'text': 'delta 2'})
+        await asyncio.sleep(0)
+        self.assertEqual(sent, ['delta 1', 'delta 2'])
+
+        # A queue full of deltas disconnects the dashboard, which gets a
+        # fresh snapshot when it reconnects
+        for i in range(2):
+            consumer.outbound.put(f'control {i}')
+        stalled.assert_not_called()
+        await consumer.dashboard_delta({'text': 'delta 3'})
+        stalled.assert_called_once()
+
+
+@override_settings(REAL_TIME={'WEBINAR_THRESHOLD': 3, 'CLASS_SUMMARY_INTERVAL': 5.0})
+class EventRoutingTests(SimpleTestCase):
+    def test_student_events_only_reach_instructors(self):
+        self.assertEqual(route(1, 'focus.update'), 'session_1_instructors')
+        self.assertEqual(route(1, 'session.left'), 'session_1_instructors')
+        self.assertEqual(route(1, 'session.stats'), 'session_1')
+        self.assertEqual(route(1, 'chat.message'), 'session_1')
+        self.assertEqual(route(1, 'broadcast_message'), 'session_1')
+
+    @patch('real_time.groups.get_channel_layer')
+    async def test_events_are_encoded_once(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        event = {'type': 'chat.message', 'user_id': 1, 'message': 'Hello'}
+        await send_event(1, event)
+        group, encoded = mock_layer.return_value.group_send.await_args.args
+        self.assertEqual(group, 'session_1')
+        self.assertEqual(encoded, {
+            'type': 'chat.message',
+            'seq': encoded['seq'],
+            'text': f'{{"seq": {encoded["seq"]}, {codec.dumps(event)[1:]}'
+        })
+
+    def test_webinar_mode_above_threshold(self):
+        with patch.dict(aggregators.aggregators, {'1': SessionAggregator([1, 2, 3], window=120)}):
+            self.assertEqual(route(1, 'session.stats'), 'session_1_instructors')
+            self.assertEqual(route(1, 'chat.message'), 'session_1_instructors')
+            self.assertEqual(route(1, 'chat.message', audience='all'), 'session_1')
+            self.assertEqual(route(1, 'session.control'), 'session_1')
+        with patch.dict(aggregators.aggregators, {'1': SessionAggregator([1, 2], window=120)}):
+            self.assertEqual(route(1, 'session.stats'), 'session_1')
+
+    @patch('real_time.groups.get_channel_layer')
+    async def test_class_summary_is_sent_to_webinar_students(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        summaries = ClassSummaryBroadcaster()
+        ticker = SessionTicker(1, TickerRegistry())
+        ticker.session = Mock(**{'elapsed_seconds.return_value': 60.0})
+        aggregator = SessionAggregator([1, 2], window=120)
+        aggregator.add(1, 0.5)
+        registry = PresenceRegistry()
+        await registry.join(1, 1, 'student', 'channel-1')
+        await registry.join(1, 2, 'student', 'channel-2')
+
+        with patch.dict(aggregators.aggregators, {'1': aggregator}), patch('real_time.stats.presence', registry):
+            await summaries.flush(ticker, now=100.0)
+            mock_layer.return_value.group_send.assert_not_awaited()
+
+            aggregator.enroll(3)
+            aggregator.add(3, 0.7)
+            await summaries.flush(ticker, now=101.0)
+            await summaries.flush(ticker, now=102.0)
+
+        mock_layer.return_value.group_send.assert_awaited_once()
+        group, event = mock_layer.return_value.group_send.await_args.args
+        self.assertEqual(group, local_group('session_1_students'))
+        event = json.loads(event['text'])
+        self.assertEqual(event['summary'], {
+            'total_participants': 3,
+            'active_participants': 2,
+            'average_focus_score': 0.6,
+        })
+
+
+@override_settings(REAL_TIME={'REDIS_URL': None})
+class PresenceRegistryTests(SimpleTestCase):
+    async def test_users_are_present_until_their_last_connection_leaves(self):
+        registry = PresenceRegistry()
+        self.assertEqual(await registry.join(1, 7, 'student', 'a'), 1)
+        self.assertEqual(await registry.join(1, 7, 'student', 'b'), 2)
+        await registry.join(1, 8, 'student', 'c')
+        await registry.join(1, 2, 'instructor', 'd')
+        await registry.join(2, 9, 'student', 'e')
+
+        self.assertEqual(await registry.count(1), 3)
+        self.assertEqual(await registry.count(1, 'student'), 2)
+        self.assertEqual(await registry.members(1), [2, 7, 8])
+        self.assertEqual(await registry.members(1, 'instructor'), [2])
+
+        self.assertFalse(await registry.leave(1, 7, 'student', 'a'))
+        self.assertEqual(await registry.count(1, 'student'), 2)
+        self.assertTrue(await registry.leave(1, 7, 'student', 'b'))
+        self.assertEqual(await registry.members(1, 'student'), [8])
+
+        await registry.leave(1, 8, 'student', 'c')
+        await registry.leave(1, 2, 'instructor', 'd')
+        self.assertEqual(await registry.count(1), 0)
+        self.assertNotIn('1', registry.users)
+        self.assertEqual(await registry.count(2), 1)
+
+
+@override_settings(REAL_TIME={'EVENT_LOG_SIZE': 3})
+class EventLogTests(SimpleTestCase):
+    async def test_missed_events_are_replayed_until_evicted(self):
+        log = EventLog()
+        for message in ('a', 'b', 'c'):
+            await log.append(1, 'session_1', {'type': 'chat.message', 'text': json.dumps({'type': 'chat.message', 'message': message})})
+        self.assertEqual(await log.latest(1), 3)
+
+        latest, events = await log.since(1, 1)
+        self.assertEqual(latest, 3)
+        self.assertEqual([event['seq'] for _, event in events], [2, 3])
+        self.assertEqual(json.loads(events[0][1]['text']), {'seq': 2, 'type': 'chat.message', 'message': 'b'})
+        self.assertEqual(await log.since(1, 3), (3, []))
+
+        await log.append(1, 'session_1', {'type': 'chat.message', 'text': json.dumps({'type': 'chat.message', 'message': 'd'})})
+        self.assertEqual(await log.since(1, 0), (4, None))
+        # Resuming from a seq the log never reached, e.g. after a restart
+        self.assertEqual(await log.since(1, 9), (4, None))
+
+    @override_settings(REAL_TIME={'EVENT_LOG_SIZE': 3, 'REDIS_URL': None})
+    @patch('real_time.groups.get_channel_layer')
+    async def test_state_events_do_not_evict_chat(self, mock_layer):
+        mock_layer.return_value.group_send = AsyncMock()
+        event_log.discard(1)
+        await send_event(1, {'type': 'chat.message', 'message': 'a'})
+        for score in range(50):
+            await send_event(1, {'type': 'focus.update', 'user_id': 7, 'focus_score': score / 50}, key='focus.7')
+        await send_event(1, {'type': 'timer.update', 'elapsed_time': 10})
+
+        latest, events = await event_log.since(1, 0)
+        self.assertEqual(latest, 1)
+        self.assertEqual([json.loads(event['text'])['message'] for _, event in events], ['a'])
+        self.assertNotIn('seq', mock_layer.return_value.group_send.await_args.args[1])
+        event_log.discard(1)
+
+
+@override_settings(REAL_TIME={'DB_EXECUTOR_THREADS': 2})
+class DatabaseExecutorTests(SimpleTestCase):
+    async def test_calls_run_in_parallel_off_the_event_loop(self):
+        executor = DatabaseExecutor()
+        barrier = threading.Barrier(2, timeout=2)
+
+        def work(value):
+            # Both calls must be running at once to get through
+            barrier.wait()
+            return value, threading.current_thread().name
+
+        results = await asyncio.gather(executor.call(work, 1), executor.call(work, 2))
+        self.assertEqual([value for value, _ in results], [1, 2])
+        self.assertTrue(all(name.startswith('real-time-db') for _, name in results))
+        self.assertEqual(executor.queued, 0)
+        self.assertIn('db.max_wait_ms', metrics.snapshot()['gauges'])
+
+    async def test_write_buffers_flush_on_the_executor(self):
+        threads = []
+        record = lambda *args, **kwargs: threads.append(threading.current_thread().name)
+        focus, chat = FocusWriteBuffer(), ChatWriteBuffer()
+        focus.add(1, 2, 0.5)
+        chat.add(1, 2, 'hello', timezone.now())
+
+        with patch('real_time.persistence.write_focus_rows', side_effect=record), \
+                patch.object(ChatMessage.objects, 'bulk_create', side_effect=record):
+            await focus.flush(final=True)
+            await chat.flush()
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('real-time-db') for name in threads))
+
+
+class SessionAggregatorTests(SimpleTestCase):
+    def test_stats_follow_latest_score_per_student(self):
+        aggregator = SessionAggregator([1, 2, 3], window=120, now=0)
+        aggregator.add(1, 0.9, now=1)
+        aggregator.add(2, 0.7, now=2)
+        aggregator.add(1, 0.5, now=3)
+
+        stats = aggregator.get_stats(session_duration=10, now=4)
+        self.assertEqual(stats, {
+            'total_participants': 3,
+            'active_participants': 2,
+            'average_focus_score': 0.6,
+            'session_duration': 10,
+            'focus_distribution': {'high': 0, 'medium': 1, 'low': 1}
+        })
+
+    def test_samples_expire_after_the_window(self):
+        aggregator = SessionAggregator([1, 2], window=120, now=0)
+        aggregator.add(1, 0.9, now=0)
+        aggregator.add(2, 0.3, now=60)
+        aggregator.enroll(3)
+        aggregator.add(3, 0.8, now=100)
+
+        stats = aggregator.get_stats(now=150)
+        self.assertEqual(stats['total_participants'], 3)
+        self.assertEqual(stats['active_participants'], 2)
+        self.assertEqual(stats['focus_distribution'], {'high': 1, 'medium': 0, 'low': 1})
+
+        aggregator.remove(3)
+        stats = aggregator.get_stats(now=200)
+        self.assertEqual(stats['active_participants'], 0)
+        self.assertEqual(stats['average_focus_score'], 0)
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    async def test_samples_reach_the_aggregators_of_every_worker(self):
+        workers = [AggregatorRegistry(), AggregatorRegistry()]
+        for registry in workers:
+            registry.aggregators['1'] = SessionAggregator([7, 8], window=120)
+            await registry.subscribe(1)
+
+        await workers[0].record(1, 7, 0.9)
+        await workers[1].record(1, 8, 0.5)
+        await asyncio.sleep(0.05)
+        for registry in workers:
+            self.assertEqual(registry.get(1).focus_map(), {7: 0.9, 8: 0.5})
+
+        await workers[1].remove(1, 7)
+        await asyncio.sleep(0.05)
+        self.assertEqual(workers[0].get(1).focus_map(), {8: 0.5})
+        for registry in workers:
+            registry.task.cancel()
+
+    def test_samples_of_unknown_users_are_ignored(self):
+        metrics.reset()
+        aggregator = SessionAggregator([1, 2], window=120, now=0)
+        self.assertTrue(aggregator.add(1, 0.9, now=1))
+        self.assertFalse(aggregator.add(99, 0.5, now=2))
+
+        stats = aggregator.get_stats(now=3)
+        self.assertEqual(stats['total_participants'], 2)
+        self.assertEqual(stats['active_participants'], 1)
+        self.assertEqual(len(aggregator.user_ids), 2)
+        self.assertEqual(metrics.snapshot()['counters']['aggregator.unknown_samples'], 1)
+
+    def test_roster_state_is_compact(self):
+        aggregator = SessionAggregator(range(1000), window=120)
+        for user_id in range(1000):
+            aggregator.add(user_id, user_id / 1000)
+        # Everything the aggregator holds, roster lookup included
+        self.assertLessEqual(sum(sys.getsizeof(value) for value in vars(aggregator).values()), 16 * 1000)
+
+    def test_late_students_keep_the_window(self):
+        aggregator = SessionAggregator([10, 30], window=120, now=0)
+        aggregator.add(30, 0.9, now=1)
+        aggregator.add(10, 0.5, now=2)
+        aggregator.enroll(20)
+        aggregator.enroll(5)
+        aggregator.add(20, 0.7, now=3)
+        self.assertEqual(list(aggregator.user_ids), [5, 10, 20, 30])
+        self.assertEqual(aggregator.focus_map(now=4), {30: 0.9, 10: 0.5, 20: 0.7})
+
+        # Expiry follows the recency order across the moved positions
+        self.assertEqual(aggregator.focus_map(now=121.5), {10: 0.5, 20: 0.7})
+        aggregator.remove(10)
+        self.assertEqual(aggregator.focus_map(now=122), {20: 0.7})
+
+    def test_roster_is_capped_below_the_nil_position(self):
+        aggregator = SessionAggregator(range(MAX_ROSTER), window=120)
+        self.assertIsNone(aggregator.enroll(MAX_ROSTER))
+        self.assertEqual(len(aggregator), MAX_ROSTER)
+        self.assertTrue(aggregator.add(MAX_ROSTER - 1, 0.5))
+        self.assertFalse(aggregator.add(MAX_ROSTER, 0.5))
+
+
+class FocusWriteBufferTests(TestCase):
+    def setUp(self):
+        self.instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        self.students = [
+            User.objects.create_user(email=f'student{i}@test.com', password='password', role='student', full_name=f'Student {i}')
+            for i in range(3)
+        ]
+        self.classroom = Classroom.objects.create(name='Test Class', instructor=self.instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=self.classroom, is_active=True, start_time=timezone.now())
+        Performance.objects.create(session=self.session, student=self.students[0], focus_score=0.1)
+        metrics.reset()
+        live_rollups.take(final=True)
+
+    def test_only_the_latest_score_per_student_is_written(self):
+        buffer = FocusWriteBuffer()
+        for score in (0.2, 0.4, 0.6):
+            for student in self.students:
+                buffer.add(self.session.id, student.id, score)
+
+        with self.assertNumQueries(7):
+            buffer.flush_sync()
+
+        self.assertEqual(buffer.pending, {})
+        self.assertEqual(
+            sorted(Performance.objects.filter(session=self.session).values_list('focus_score', flat=True)),
+            [0.6, 0.6, 0.6]
+        )
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['focus_buffer.flushes'], 1)
+        self.assertEqual(snapshot['counters']['focus_buffer.rows_flushed'], 3)
+        self.assertIn('focus_buffer.flush_lag_ms', snapshot['gauges'])
+
+    def test_rows_created_concurrently_take_the_score(self):
+        # The row of students[0] exists but is not seen by the lookup, as if
+        # it was created between the lookup and the insert
+        with patch.object(Performance.objects, 'filter', return_value=Performance.objects.none()):
+            write_focus_rows({(self.session.id, self.students[0].id): (0.7, timezone.now())})
+
+        performance = Performance.objects.get(session=self.session, student=self.students[0])
+        self.assertEqual(performance.focus_score, 0.7)
+        self.assertEqual(Performance.objects.filter(session=self.session).count(), 1)
+
+    def test_failed_flush_keeps_newer_scores(self):
+        buffer = FocusWriteBuffer()
+        buffer.add(self.session.id, self.students[0].id, 0.2)
+        rows, chunks, rollups, _ = buffer.take(final=True)
+        buffer.add(self.session.id, self.students[0].id, 0.9)
+        buffer.restore(rows, chunks, rollups)
+        self.assertEqual(buffer.pending[(self.session.id, self.students[0].id)][0], 0.9)
+        self.assertEqual(len(buffer.sealed), 1)
+
+    def test_chat_messages_are_written_in_order(self):
+        buffer = ChatWriteBuffer()
+        start = timezone.now()
+        for i in range(3):
+            buffer.add(self.session.id, self.students[i % 2].id, f'message {i}', start + timedelta(seconds=i))
+        self.assertEqual(ChatMessage.objects.count(), 0)
+
+        buffer.flush_sync()
+        self.assertEqual(buffer.pending, [])
+        self.assertEqual(
+            list(ChatMessage.objects.filter(session=self.session).values_list('message', flat=True)),
+            ['message 2', 'message 1', 'message 0']
+        )
+
+    def test_samples_are_appended_to_chunks(self):
+        buffer = FocusWriteBuffer()
+        start = timezone.now()
+        for i in range(300):
+            buffer.add(self.session.id, self.students[1].id, 0.5, start + timedelta(milliseconds=200 * i))
+        self.assertEqual(len(buffer.sealed), 1)
+
+        buffer.flush_sync()
+        self.assertEqual(FocusChunk.objects.filter(session=self.session).count(), 2)
+        timestamps, scores = read_session_series(self.session.id)[self.students[1].id]
+        self.assertEqual(len(scores), 300)
+
+    def test_metrics_are_exposed_to_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(user=self.students[0])
+        self.assertEqual(client.get('/api/realtime/metrics/').status_code, 403)
+
+        self.instructor.is_staff = True
+        self.instructor.save()
+        client.force_authenticate(user=self.instructor)
+        metrics.incr('focus_buffer.flushes')
+        response = client.get('/api/realtime/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['counters']['focus_buffer.flushes'], 1)
+
+
+class BinaryProtocolTests(SimpleTestCase):
+    def setUp(self):
+        self.encoder = binary.RosterEncoder(now=1000.0)
+        self.event = {
+            'type': 'focus.update',
+            'user_id': 42,
+            'user_name': 'Student Name',
+            'user_role': 'student',
+            'focus_score': 0.5,
+            'timestamp': '1970-01-01T00:16:41.500000+00:00',
+        }
+
+    def test_roster_frame(self):
+        frame = self.encoder.roster([(7, 'Ana', 'student'), (42, 'Émile', 'student')])
+        opcode, base, count = binary.ROSTER_HEADER.unpack_from(frame)
+        self.assertEqual((opcode, base, count), (binary.OP_ROSTER, 1000000, 2))
+        index, user_id, role, length = binary.ROSTER_ENTRY.unpack_from(frame, binary.ROSTER_HEADER.size + binary.ROSTER_ENTRY.size + 3)
+        self.assertEqual((index, user_id, role), (1, 42, 0))
+        self.assertEqual(frame[-length:].decode('utf-8'), 'Émile')
+
+    def test_focus_frame_refers_to_roster_index(self):
+        self.encoder.roster([(7, 'Ana', 'student'), (42, 'Student Name', 'student')])
+        frames = self.encoder.focus(self.event)
+        self.assertEqual(len(frames), 1)
+        opcode, index, offset, level = binary.FOCUS.unpack(frames[0])
+        self.assertEqual((opcode, index, offset), (binary.OP_FOCUS, 1, 1500))
+        self.assertEqual(level, round(0.5 * binary.SCORE_LEVELS))
+        # The JSON text frame sent for the same event is an order of magnitude larger
+        self.assertGreater(len(json.dumps(self.event)), 10 * len(frames[0]))
+
+    def test_unknown_users_are_added_to_the_roster(self):
+        self.encoder.roster([])
+        entry, frame = self.encoder.presence(binary.OP_JOINED, self.event)
+        self.assertEqual(entry[0], binary.OP_ROSTER_ENTRY)
+        self.assertEqual(binary.PRESENCE.unpack(frame), (binary.OP_JOINED, 0, 1500))
+        self.assertEqual(len(self.encoder.focus(self.event)), 1)
+
+    def test_client_focus_frames(self):
+        message = binary.decode_client_frame(bytes([binary.OP_FOCUS_SAMPLE, 255]))
+        self.assertEqual(message, {'type': 'focus_update', 'focus_score': 1.0})
+        with self.assertRaises(ValueError):
+            binary.decode_client_frame(bytes([binary.OP_FOCUS_SAMPLE]))
+        with self.assertRaises(ValueError):
+            binary.decode_client_frame(b'\xff')
+
+
+class FocusBatchTests(SimpleTestCase):
+    def test_batches_are_validated(self):
+        seq, samples = parse_batch({'seq': 3, 'samples': [[1000, 0.5], [1200, 1.4]]})
+        self.assertEqual(seq, 3)
+        self.assertEqual(samples, [(1000.0, 0.5), (1200.0, 1.0)])
+
+        invalid = [
+            {'samples': [[1000, 0.5]]},
+            {'seq': -1, 'samples': [[1000, 0.5]]},
+            {'seq': 1, 'samples': []},
+            {'seq': 1, 'samples': [[1000]]},
+            {'seq': 1, 'samples': [[1000, 'high']]},
+            {'seq': 1, 'samples': [[1200, 0.5], [1000, 0.5]]},
+            {'seq': 1, 'samples': [[i, 0.5] for i in range(101)]},
+            {'seq': 1, 'samples': [[0, 0.5], [1e15, 0.6]]},
+            {'seq': 1, 'samples': [[0, 0.5], [float('inf'), 0.6]]},
+        ]
+        for data in invalid:
+            with self.subTest(data=data), self.assertRaises(InvalidBatch):
+                parse_batch(data)
+
+    def test_samples_are_anchored_at_reception(self):
+        received_at = timezone.now()
+        aligned = align_samples([(5000.0, 0.1), (5200.0, 0.2), (5400.0, 0.3)], received_at)
+        self.assertEqual([timestamp for _, timestamp in aligned], [
+            received_at - timedelta(milliseconds=400),
+            received_at - timedelta(milliseconds=200),
+            received_at,
+        ])
+
+        aligned = align_samples([(0.0, 0.1), (400.0, 0.2)], received_at, not_before=received_at - timedelta(milliseconds=100))
+        self.assertEqual(aligned[0][1], received_at - timedelta(milliseconds=100))
+
+    def test_duplicate_batches_are_dropped(self):
+        log = FocusBatchLog()
+        now = timezone.now()
+        self.assertEqual(log.accept(1, 7, 0), (True, None))
+        log.record(1, 7, 0, now)
+        self.assertEqual(log.accept(1, 7, 0), (False, now))
+        self.assertEqual(log.accept('1', 7, 1), (True, now))
+        log.discard(1)
+        self.assertEqual(log.accept(1, 7, 0), (True, None))
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    REAL_TIME={'CACHE_ALIAS': 'default'}
+)
+class FocusBatchConsumerTests(TransactionTestCase):
+    def setUp(self):
+        instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        self.student = User.objects.create_user(email='student@test.com', password='password', role='student', full_name='Student')
+        classroom = Classroom.objects.create(name='Test Class', instructor=instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=classroom, is_active=True, start_time=timezone.now())
+        Enrollment.objects.create(student=self.student, classroom=classroom)
+        self.token = str(RefreshToken.for_user(self.student).access_token)
+        self.instructor_token = str(RefreshToken.for_user(instructor).access_token)
+        focus_batches.discard(self.session.id)
+        event_log.discard(self.session.id)
+        admission.clear()
+
+    async def receive_types(self, communicator, *message_types):
+        """Latest message of each type, in whatever order they arrive"""
+        received = {}
+        while not all(message_type in received for message_type in message_types):
+            message = await communicator.receive_json_from(timeout=2)
+            received[message['type']] = message
+        return received
+
+    async def drain(self, communicator):
+        messages = []
+        while not await communicator.receive_nothing(timeout=0.2):
+            messages.append(await communicator.receive_json_from())
+        return messages
+
+    async def test_reconnecting_clients_get_the_events_they_missed(self):
+        instructor = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.instructor_token}")
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await instructor.connect())[0])
+        self.assertTrue((await student.connect())[0])
+        established = (await self.receive_types(student, 'connection.established'))['connection.established']
+        await student.disconnect()
+
+        for message in ('first', 'second'):
+            await instructor.send_json_to({'type': 'chat_message', 'message': message})
+        await self.receive_types(instructor, 'chat.message')
+
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}&resume_from={established['seq']}")
+        self.assertTrue((await student.connect())[0])
+        chats = [message for message in await self.drain(student) if message['type'] == 'chat.message']
+        self.assertEqual([chat['message'] for chat in chats], ['first', 'second'])
+        self.assertEqual(chats[1]['seq'], chats[0]['seq'] + 1)
+        await student.disconnect()
+
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}&resume_from=100000")
+        self.assertTrue((await student.connect())[0])
+        self.assertIn('snapshot.required', [message['type'] for message in await self.drain(student)])
+        await student.disconnect()
+        await instructor.disconnect()
+
+    @patch('real_time.consumers.focus_buffer.write_many', new_callable=AsyncMock)
+    async def test_batch_is_acked_once_and_deduplicated(self, mock_write):
+        instructor = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.instructor_token}")
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await instructor.connect())[0])
+        self.assertTrue((await student.connect())[0])
+
+        batch = {'type': 'focus_batch', 'seq': 1, 'samples': [[0, 0.2], [200, 0.4], [400, 0.9]]}
+        await student.send_json_to(batch)
+        received = await self.receive_types(student, 'focus_batch.ack')
+        self.assertEqual(received['focus_batch.ack'], {'type': 'focus_batch.ack', 'seq': 1, 'accepted': 3, 'duplicate': False})
+        self.assertEqual(len(mock_write.call_args.args[2]), 3)
+        received = await self.receive_types(instructor, 'focus.update')
+        self.assertEqual(received['focus.update']['focus_score'], 0.9)
+
+        await student.send_json_to(batch)
+        received = await self.receive_types(student, 'focus_batch.ack')
+        self.assertTrue(received['focus_batch.ack']['duplicate'])
+        self.assertEqual(mock_write.call_count, 1)
+
+        # Students never get focus updates
+        self.assertNotIn('focus.update', [message['type'] for message in await self.drain(student)])
+
+        await student.disconnect()
+        await instructor.disconnect()
+
+    async def test_failing_messages_do_not_close_the_connection(self):
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await student.connect())[0])
+        await self.drain(student)
+
+        await student.send_json_to({'type': 'focus_batch', 'seq': 1, 'samples': [[0, 0.5], [1e15, 0.6]]})
+        self.assertEqual(await student.receive_json_from(timeout=2), {'type': 'error', 'message': 'Batch spans too long'})
+
+        with patch('real_time.consumers.align_samples', side_effect=OverflowError):
+            await student.send_json_to({'type': 'focus_batch', 'seq': 1, 'samples': [[0, 0.5]]})
+            self.assertEqual(await student.receive_json_from(timeout=2), {'type': 'error', 'message': 'Failed to process message'})
+
+        await student.send_json_to({'type': 'ping'})
+        self.assertEqual((await self.receive_types(student, 'pong'))['pong']['type'], 'pong')
+        await student.disconnect()
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.stalled = Mock()
+        metrics.reset()
+
+    async def test_stalled_connections_are_closed(self):
+        consumer = SessionConsumer()
+        consumer.close = AsyncMock()
+        consumer.outbound_stalled()
+        consumer.outbound_stalled()
+        await consumer.close_task
+        consumer.close.assert_awaited_once_with(code=4008)
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(text_data if text_data is not None else bytes_data)
+
+    async def test_lanes_are_sent_by_priority_keeping_the_newest_state(self):
+        queue = OutboundQueue(self.send, self.stalled, max_frames=10, max_lag=10)
+        queue.put('focus 1 a', STATE, 'focus.1')
+        queue.put('stats', STATE, 'session.stats')
+        queue.put('chat', CHAT)
+        queue.put('focus 1 b', STATE, 'focus.1')
+        queue.put(b'control', CONTROL)
+        self.assertEqual(len(queue), 4)
+
+        await asyncio.sleep(0)
+        self.assertEqual(self.sent, [b'control', 'chat', 'focus 1 b', 'stats'])
+        self.assertEqual(metrics.snapshot()['counters']['outbound.replaced'], 1)
+        queue.close()
+
+    async def test_state_then_chat_frames_are_dropped_when_full(self):
+        queue = OutboundQueue(self.send, self.stalled, max_frames=3, max_lag=10)
+        queue.put('chat 1', CHAT)
+        queue.put('focus 1', STATE, 'focus.1')
+        queue.put('control 1', CONTROL)
+        queue.put('control 2', CONTROL)
+        queue.put('control 3', CONTROL)
+        self.assertEqual([frame for _, frame in queue.lanes[CONTROL]], ['control 1', 'control 2', 'control 3'])
+        self.assertEqual(metrics.snapshot()['counters']['outbound.dropped'], 2)
+        self.stalled.assert_not_called()
+
+        # Only control frames are left, the client is disconnected
+        queue.put('control 4', CONTROL)
+        self.stalled.assert_called_once()
+        self.assertEqual(len(queue), 0)
+        queue.put('control 5', CONTROL)
+        self.assertEqual(len(queue), 0)
+
+    async def test_clients_lagging_behind_are_disconnected(self):
+        blocked = asyncio.Event()
+
+        async def send(text_data=None, bytes_data=None):
+            await blocked.wait()
+
+        queue = OutboundQueue(send, self.stalled, max_frames=10, max_lag=5)
+        queue.put('first')
+        await asyncio.sleep(0)
+        with patch('real_time.outbound.time.monotonic', return_value=time.monotonic() + 1):
+            queue.put('second')
+        self.stalled.assert_not_called()
+        with patch('real_time.outbound.time.monotonic', return_value=time.monotonic() + 6):
+            queue.put('third')
+        self.stalled.assert_called_once()
+        self.assertEqual(OutboundQueue.queued, 0)
+        self.assertEqual(metrics.snapshot()['counters']['outbound.disconnects'], 1)
+
+    @override_settings(REAL_TIME={'IDLE_TIMEOUT': 45})
+    async def test_stuck_writers_are_disconnected_by_the_reaper(self):
+        blocked = asyncio.Event()
+
+        async def send(text_data=None, bytes_data=None):
+            await blocked.wait()
+
+        queue = OutboundQueue(send, self.stalled, max_frames=10, max_lag=5)
+        queue.put('first')
+        queue.put('second')
+        await asyncio.sleep(0)
+        now = time.monotonic()
+        consumer = Mock(channel_name='stuck', session_id='1', user=Mock(id=7), outbound=queue, last_seen=now, send=AsyncMock())
+        connections = ConnectionReaper()
+        connections.connections['stuck'] = consumer
+
+        self.assertEqual(connections.lags(now=now + 2)[0]['queued_frames'], 1)
+        await connections.sweep(now=now + 2)
+        self.stalled.assert_not_called()
+        self.assertAlmostEqual(metrics.snapshot()['gauges']['outbound.current_max_lag_ms'], 2000, delta=50)
+
+        # Nothing else is queued for the client, the sweep finds it behind
+        await connections.sweep(now=now + 6)
+        self.stalled.assert_called_once()
+        consumer.send.assert_awaited_once()
+
+    async def test_frames_are_batched_over_the_window(self):
+        queue = OutboundQueue(self.send, self.stalled, max_frames=10, max_lag=10, batch_window=0.01)
+        queue.put(json.dumps({'type': 'session.stats'}), STATE, 'session.stats')
+        queue.put(json.dumps({'type': 'chat.message'}), CHAT)
+        queue.put(json.dumps({'type': 'session.control'}))
+        await asyncio.sleep(0)
+        self.assertEqual(self.sent, [])
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.sent), 1)
+        batch = json.loads(self.sent[0])
+        self.assertEqual(batch['type'], 'batch')
+        self.assertEqual([event['type'] for event in batch['events']], ['session.control', 'chat.message', 'session.stats'])
+
+        queue.put(json.dumps({'type': 'timer.sync'}))
+        await asyncio.sleep(0.05)
+        self.assertEqual(json.loads(self.sent[1]), {'type': 'timer.sync'})
+        queue.close()
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    REAL_TIME={'CACHE_ALIAS': 'default', 'IDLE_TIMEOUT': 45}
+)
+class ConnectionReaperTests(TransactionTestCase):
+    def setUp(self):
+        instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        self.student = User.objects.create_user(email='student@test.com', password='password', role='student', full_name='Student')
+        classroom = Classroom.objects.create(name='Test Class', instructor=instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=classroom, is_active=True, start_time=timezone.now())
+        Enrollment.objects.create(student=self.student, classroom=classroom)
+        self.token = str(RefreshToken.for_user(self.student).access_token)
+        self.instructor_token = str(RefreshToken.for_user(instructor).access_token)
+        admission.clear()
+
+    async def test_idle_connections_are_reaped(self):
+        instructor = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.instructor_token}")
+        student = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await instructor.connect())[0])
+        self.assertTrue((await student.connect())[0])
+        reaped_before = metrics.snapshot()['counters'].get('connections.reaped', 0)
+
+        consumer = next(c for c in reaper.connections.values() if c.user.id == self.student.id)
+        consumer.last_seen -= 60
+        await reaper.sweep()
+
+        while True:
+            output = await student.receive_output(timeout=1)
+            if output['type'] == 'websocket.close':
+                break
+        self.assertEqual(output['code'], CLOSE_IDLE)
+        self.assertEqual(await presence.count(self.session.id, 'student'), 0)
+        self.assertEqual(metrics.snapshot()['counters']['connections.reaped'], reaped_before + 1)
+
+        # The live connection got a heartbeat instead
+        messages = []
+        while not await instructor.receive_nothing(timeout=0.2):
+            messages.append((await instructor.receive_json_from())['type'])
+        self.assertIn('heartbeat', messages)
+        self.assertIn('session.left', messages)
+        await instructor.disconnect()
+
+    @override_settings(REAL_TIME={'CACHE_ALIAS': 'default', 'REDIS_URL': None, 'HEARTBEAT_INTERVAL': 0.1, 'IDLE_TIMEOUT': 0.25})
+    async def test_passive_connections_answering_heartbeats_are_kept(self):
+        instructor = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.instructor_token}&dashboard=1")
+        self.assertTrue((await instructor.connect())[0])
+
+        # Like the web client, only answer heartbeats for half a second
+        heartbeats = 0
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            if await instructor.receive_nothing(timeout=0.05):
+                continue
+            output = await instructor.receive_output()
+            self.assertEqual(output['type'], 'websocket.send')
+            if codec.loads(output['text'])['type'] == 'heartbeat':
+                heartbeats += 1
+                await instructor.send_json_to({'type': 'pong'})
+
+        self.assertGreaterEqual(heartbeats, 2)
+        self.assertTrue(any(c.user.role == 'instructor' for c in reaper.connections.values()))
+        await instructor.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class DuplicateConnectionTests(TransactionTestCase):
+    def setUp(self):
+        instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        self.student = User.objects.create_user(email='student@test.com', password='password', role='student', full_name='Student')
+        classroom = Classroom.objects.create(name='Test Class', instructor=instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=classroom, is_active=True, start_time=timezone.now())
+        Enrollment.objects.create(student=self.student, classroom=classroom)
+        self.token = str(RefreshToken.for_user(self.student).access_token)
+        self.instructor_token = str(RefreshToken.for_user(instructor).access_token)
+        admission.clear()
+
+    def communicator(self, token):
+        return WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={token}")
+
+    async def closed_with(self, communicator):
+        while True:
+            output = await communicator.receive_output(timeout=1)
+            if output['type'] == 'websocket.close':
+                return output.get('code')
+
+    async def presence_events(self, communicator):
+        events = []
+        while not await communicator.receive_nothing(timeout=0.2):
+            message = await communicator.receive_json_from()
+            if message['type'] in ('session.joined', 'session.left'):
+                events.append(message['type'])
+        return events
+
+    async def test_users_count_once_with_every_connection_kept(self):
+        with self.settings(REAL_TIME={'CACHE_ALIAS': 'default', 'DUPLICATE_CONNECTIONS': 'all'}):
+            instructor = self.communicator(self.instructor_token)
+            first, second = self.communicator(self.token), self.communicator(self.token)
+            self.assertTrue((await instructor.connect())[0])
+            self.assertTrue((await first.connect())[0])
+            self.assertTrue((await second.connect())[0])
+            self.assertEqual(await presence.count(self.session.id, 'student'), 1)
+
+            await first.disconnect()
+            self.assertEqual(await self.presence_events(instructor), ['session.joined'])
+            await second.disconnect()
+            self.assertEqual(await self.presence_events(instructor), ['session.left'])
+            await instructor.disconnect()
+
+    async def test_newest_connection_replaces_older_ones(self):
+        with self.settings(REAL_TIME={'CACHE_ALIAS': 'default', 'DUPLICATE_CONNECTIONS': 'newest'}):
+            first, second = self.communicator(self.token), self.communicator(self.token)
+            self.assertTrue((await first.connect())[0])
+            self.assertTrue((await second.connect())[0])
+            self.assertEqual(await self.closed_with(first), CLOSE_REPLACED)
+            self.assertEqual(len(await presence.channels(self.session.id, self.student.id)), 1)
+            await second.disconnect()
+
+    async def test_new_connections_can_be_rejected(self):
+        with self.settings(REAL_TIME={'CACHE_ALIAS': 'default', 'DUPLICATE_CONNECTIONS': 'reject'}):
+            first, second = self.communicator(self.token), self.communicator(self.token)
+            self.assertTrue((await first.connect())[0])
+            self.assertTrue((await second.connect())[0])
+            self.assertEqual(await self.closed_with(second), CLOSE_DUPLICATE)
+            await second.disconnect()
+            self.assertEqual(await presence.count(self.session.id, 'student'), 1)
+            await first.disconnect()
+
+
+@override_settings(REAL_TIME={
+    'ADMISSION_MAX_HANDSHAKES': 2,
+    'ADMISSION_IP_RATE': 1.0,
+    'ADMISSION_IP_BURST': 3,
+    'ADMISSION_USER_RATE': 0.5,
+    'ADMISSION_USER_BURST': 1,
+    'ADMISSION_RETRY_AFTER': 1.0,
+    'ADMISSION_RETRY_JITTER': 2.0,
+})
+class AdmissionTests(SimpleTestCase):
+    def test_concurrent_handshakes_are_limited(self):
+        admission = Admission()
+        self.assertIsNone(admission.enter())
+        self.assertIsNone(admission.enter())
+        retry_after = admission.enter()
+        self.assertGreaterEqual(retry_after, 1.0)
+        self.assertLessEqual(retry_after, 3.0)
+
+        admission.leave()
+        self.assertIsNone(admission.enter())
+
+    def test_token_buckets_refill_over_time(self):
+        admission = Admission()
+        for _ in range(3):
+            self.assertIsNone(admission.enter('10.0.0.1', now=100.0))
+            admission.leave()
+        self.assertIsNotNone(admission.enter('10.0.0.1', now=100.0))
+        self.assertIsNone(admission.enter('10.0.0.2', now=100.0))
+        admission.leave()
+        self.assertIsNone(admission.enter('10.0.0.1', now=101.0))
+        admission.leave()
+
+        self.assertIsNone(admission.throttle(7, now=100.0))
+        # The next token is 2s away, jitter comes on top
+        retry_after = admission.throttle(7, now=100.0)
+        self.assertGreaterEqual(retry_after, 2.0)
+        self.assertLessEqual(retry_after, 4.0)
+        self.assertIsNone(admission.throttle(7, now=104.0))
+
+    def test_bad_tokens_are_remembered(self):
+        admission = Admission()
+        self.assertFalse(admission.is_bad_token('expired'))
+        admission.remember_bad_token('expired')
+        self.assertTrue(admission.is_bad_token('expired'))
+        self.assertFalse(admission.is_bad_token('other'))
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    REAL_TIME={'CACHE_ALIAS': 'default', 'ADMISSION_USER_BURST': 1, 'ADMISSION_USER_RATE': 0.1}
+)
+class AdmissionConsumerTests(TransactionTestCase):
+    def setUp(self):
+        instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        classroom = Classroom.objects.create(name='Test Class', instructor=instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=classroom, is_active=True, start_time=timezone.now())
+        self.token = str(RefreshToken.for_user(instructor).access_token)
+        admission.clear()
+
+    @patch('real_time.middleware.WebSocketJWTAuthMiddleware.get_user_from_token', new_callable=AsyncMock, return_value=None)
+    async def test_bad_tokens_are_only_checked_once(self, mock_authenticate):
+        for _ in range(2):
+            communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token=invalidtoken")
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+        mock_authenticate.assert_called_once()
+
+    async def test_reconnecting_users_are_told_to_retry_later(self):
+        communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await communicator.connect())[0])
+        await communicator.disconnect()
+
+        communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        self.assertTrue((await communicator.connect())[0])
+        while True:
+            output = await communicator.receive_output(timeout=1)
+            if output['type'] == 'websocket.close':
+                break
+        self.assertEqual(output['code'], CLOSE_RETRY_LATER)
+        self.assertRegex(output['reason'], r'^retry_after=\d+(\.\d)?$')
+
+    @override_settings(REAL_TIME={'CACHE_ALIAS': 'default', 'ADMISSION_IP_BURST': 1, 'ADMISSION_IP_RATE': 0.1})
+    async def test_reconnect_storms_are_shed_before_authentication(self):
+        def communicator(token):
+            communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={token}")
+            communicator.scope['client'] = ['10.0.0.1', 50000]
+            return communicator
+
+        with patch('real_time.middleware.WebSocketJWTAuthMiddleware.get_user_from_token', new_callable=AsyncMock, return_value=None) as mock_authenticate:
+            for attempt in range(3):
+                await communicator(f'token-{attempt}').connect()
+        mock_authenticate.assert_called_once()
+        self.assertEqual(admission.handshakes, 0)
+
+        communicator = communicator(self.token)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        output = await communicator.receive_output(timeout=1)
+        self.assertEqual(output['type'], 'websocket.close')
+        self.assertEqual(output['code'], CLOSE_RETRY_LATER)
+
+
+class CodecTests(SimpleTestCase):
+    def test_round_trip(self):
+        payload = {'type': 'session.stats', 'stats': {'average_focus_score': 0.734, 'low': 3}, 'names': ['é', None]}
+        self.assertEqual(codec.loads(codec.dumps(payload)), payload)
+        self.assertEqual(codec.loads(codec.dumps_bytes(payload)), payload)
+        self.assertEqual(json.loads(codec.dumps(payload)), payload)
+
+    def test_malformed_input_raises_decode_error(self):
+        with self.assertRaises(codec.DecodeError):
+            codec.loads('{"type": ')
+
+    def test_renderer_matches_drf(self):
+        data = {'id': 1, 'score': Decimal('0.5'), 'message': 'a\u2028b', 'items': [1, 2]}
+        rendered = CodecJSONRenderer().render(data)
+        self.assertIn(b'\\u2028', rendered)
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(CodecJSONRenderer().render(None), b'')
+
+    def test_parser_rejects_malformed_body(self):
+        self.assertEqual(CodecJSONParser().parse(io.BytesIO(b'{"message": "hi"}')), {'message': 'hi'})
+        with self.assertRaises(ParseError):
+            CodecJSONParser().parse(io.BytesIO(b'{"message": '))
+
+
+class ProtocolTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_valid_messages(self):
+        for data in (
+            {'type': 'focus_update', 'focus_score': 0.5},
+            {'type': 'focus.update', 'focus_score': 1},
+            {'type': 'focus_batch', 'seq': 3, 'samples': [[0, 0.5]]},
+            {'type': 'timer_update', 'elapsed_time': 120},
+            {'type': 'session_control', 'control_type': 'pause'},
+            {'type': 'chat_message', 'message': 'x' * 1000},
+            {'type': 'request_session_stats'},
+            {'type': 'ping'},
+        ):
+            with self.subTest(data=data):
+                self.assertIsNone(protocol.validate(data)[1])
+        self.assertEqual(metrics.snapshot()['counters'], {})
+
+    def test_malformed_messages_are_rejected_and_counted(self):
+        for data, error in (
+            ([1, 2], 'Invalid message'),
+            ({'focus_score': 0.5}, 'Missing message type'),
+            ({'type': 'focus_update'}, "Missing 'focus_score'"),
+            ({'type': 'focus_update', 'focus_score': '0.5'}, "'focus_score' must be a number"),
+            ({'type': 'focus_update', 'focus_score': True}, "'focus_score' must be a number"),
+            ({'type': 'focus_update', 'focus_score': float('nan')}, "'focus_score' must be a number"),
+            ({'type': 'focus_update', 'focus_score': 1.5}, "'focus_score' must be at most 1"),
+            ({'type': 'focus_batch', 'seq': 1.5, 'samples': [[0, 0.5]]}, "'seq' must be an integer"),
+            ({'type': 'focus_batch', 'seq': 1, 'samples': []}, "'samples' must have at least 1 items"),
+            ({'type': 'session_control', 'control_type': 'restart'}, "'control_type' must be one of start, pause, resume, end"),
+            ({'type': 'session_control', 'control_type': [1]}, "'control_type' must be one of start, pause, resume, end"),
+            ({'type': 'session_control', 'control_type': {'a': 1}}, "'control_type' must be one of start, pause, resume, end"),
+            ({'type': 'chat_message', 'message': 'x' * 1001}, "'message' must have at most 1000 characters"),
+            ({'type': 'shout'}, 'Unknown message type: shout'),
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(protocol.validate(data)[1], error)
+
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['protocol.rejected.frame'], 2)
+        self.assertEqual(counters['protocol.rejected.focus_update'], 5)
+        self.assertEqual(counters['protocol.rejected.unknown'], 1)
+
+    def test_unsupported_keywords_fail_to_compile(self):
+        with self.assertRaises(ValueError):
+            compile_schema({'properties': {'message': {'type': 'string', 'pattern': '^a'}}})
+
+    def test_every_message_type_has_a_handler(self):
+        self.assertEqual(set(SessionConsumer.handlers), protocol.message_types)
+        self.assertEqual(Protocol([]).message_types, frozenset())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ProtocolConsumerTests(TransactionTestCase):
+    def setUp(self):
+        instructor = User.objects.create_user(email='instructor@test.com', password='password', role='instructor', full_name='Instructor')
+        student = User.objects.create_user(email='student@test.com', password='password', role='student', full_name='Student')
+        classroom = Classroom.objects.create(name='Test Class', instructor=instructor, join_code='TEST')
+        self.session = Session.objects.create(classroom=classroom, is_active=True, start_time=timezone.now())
+        Enrollment.objects.create(student=student, classroom=classroom)
+        self.token = str(RefreshToken.for_user(student).access_token)
+        admission.clear()
+
+    @patch('real_time.consumers.send_event', new_callable=AsyncMock)
+    @patch('real_time.consumers.focus_buffer.write_many', new_callable=AsyncMock)
+    async def test_malformed_messages_never_reach_handlers(self, mock_write, mock_send_event):
+        communicator = WebsocketCommunicator(application, f"/ws/session/{self.session.id}/?token={self.token}")
+        await communicator.connect()
+        while not await communicator.receive_nothing(timeout=0.2):
+            await communicator.receive_json_from()
+        mock_send_event.reset_mock()
+
+        await communicator.send_json_to({'type': 'focus_update', 'focus_score': 'high'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': "'focus_score' must be a number"})
+        await communicator.send_to(text_data='{"type": ')
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'message': 'Invalid JSON format'})
+        for control_type in ([1], {'a': 1}):
+            await communicator.send_json_to({'type': 'session_control', 'control_type': control_type})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+        mock_write.assert_not_called()
+        mock_send_event.assert_not_called()
+
+        await communicator.send_json_to({'type': 'focus_update', 'focus_score': 0.5})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'focus.update.ack')
+        mock_write.assert_awaited_once()
+        await communicator.disconnect()
@@ -0,0 +1,226 @@
+"""
+Per-session ticker service for EduFocus.
+
+A single ticker runs for every live session instead of one timer loop per
+WebSocket connection. Every worker serving participants of a session ticks
+it, running the jobs that serve its own connections. Work that must happen
+once per session, whatever the number of workers, is registered as leased:
+ownership of the session is arbitrated through a lease, and only the owner
+runs those jobs.
+
+With REDIS_URL set (see shared.py) the lease lives in Redis and is taken,
+renewed and released by Lua scripts, so an owner can never extend or delete
+a lease another worker has taken since. Otherwise it is kept in the
+CACHE_ALIAS cache, which is exact within a single worker.
+"""
+import asyncio
+import logging
+import time
+import uuid
+
+from django.core.cache import caches
+
+from session.models import Session
+from .conf import get_setting
+from .db import db_sync_to_async
+from .shared import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Takes the lease if free, renews it if held by ARGV[1]. Returns 1 if owned.
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Deletes the lease if still held by ARGV[1]
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SessionTicker:
+    """
+    Drives the periodic work of one session.
+
+    The ticker starts when the first local participant arrives and stops when
+    the last one leaves or the session ends. On every tick it renews its
+    lease and runs the jobs registered on the registry, the leased ones only
+    if it owns the session.
+    """
+    def __init__(self, session_id, registry):
+        self.session_id = str(session_id)
+        self.group_name = f'session_{self.session_id}'
+        self.registry = registry
+        self.participants = 0
+        self.session = None
+        self.task = None
+        self.owner = uuid.uuid4().hex
+        self.lease_key = f'session_ticker_lease_{self.session_id}'
+        self.refreshed_at = 0.0
+
+    def invalidate(self):
+        """Reload the session row on the next tick, e.g. after a pause"""
+        self.session = None
+
+    @property
+    def cache(self):
+        return caches[get_setting('CACHE_ALIAS')]
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task and not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.release_lease()
+
+    async def acquire_lease(self):
+        """Take or renew the lease. Returns True if this ticker owns the session."""
+        timeout = get_setting('TICKER_LEASE_TIMEOUT')
+        client = get_redis()
+        if client is not None:
+            return bool(await client.eval(ACQUIRE_SCRIPT, 1, self.lease_key, self.owner, int(timeout * 1000)))
+        if await self.cache.aadd(self.lease_key, self.owner, timeout):
+            return True
+        if await self.cache.aget(self.lease_key) == self.owner:
+            await self.cache.atouch(self.lease_key, timeout)
+            return True
+        return False
+
+    async def release_lease(self):
+        try:
+            client = get_redis()
+            if client is not None:
+                await client.eval(RELEASE_SCRIPT, 1, self.lease_key, self.owner)
+            elif await self.cache.aget(self.lease_key) == self.owner:
+                await self.cache.adelete(self.lease_key)
+        except Exception as e:
+            logger.warning(f"Could not release ticker lease for session {self.session_id}: {e}")
+
+    async def run(self):
+        interval = get_setting('TICKER_INTERVAL')
+        try:
+            while True:
+                # Errors only cost a tick, the session state is kept as long
+                # as participants are connected
+                try:
+                    owner = await self.acquire_lease()
+                except Exception as e:
+                    logger.warning(f"Could not renew ticker lease for session {self.session_id}: {e}")
+                    owner = False
+                try:
+                    if not await self.tick(owner):
+                        break
+                except Exception as e:
+                    logger.exception(f"Ticker error for session {self.session_id}: {e}")
+                await asyncio.sleep(interval)
+        finally:
+            await self.release_lease()
+            self.registry.discard(self)
+
+    async def tick(self, owner=True):
+        """Run one tick. Returns False once the session is no longer live."""
+        now = time.monotonic()
+        if self.session is None or now - self.refreshed_at >= get_setting('TICKER_REFRESH_INTERVAL'):
+            self.session = await self.load_session()
+            self.refreshed_at = now
+
+        if not self.session or not self.session.is_active:
+            logger.info(f"Session {self.session_id} is no longer active, stopping ticker")
+            return False
+
+        jobs = self.registry.jobs + self.registry.leased_jobs if owner else self.registry.jobs
+        for job in jobs:
+            try:
+                await job(self)
+            except Exception as e:
+                logger.exception(f"Ticker job {job.__name__} failed for session {self.session_id}: {e}")
+        return True
+
+    @db_sync_to_async
+    def load_session(self):
+        try:
+            return Session.objects.get(id=self.session_id)
+        except (Session.DoesNotExist, ValueError):
+            return None
+
+
+class TickerRegistry:
+    """Process-wide registry of the tickers of the sessions served locally."""
+    def __init__(self):
+        self.tickers = {}
+        self.jobs = []
+        self.leased_jobs = []
+        self.stop_hooks = []
+
+    def register(self, job=None, leased=False):
+        """
+        Register a coroutine function run on every tick of every session.
+        Leased jobs only run on the worker owning the session.
+        """
+        if job is None:
+            return lambda job: self.register(job, leased)
+        (self.leased_jobs if leased else self.jobs).append(job)
+        return job
+
+    def register_stop(self, hook):
+        """Register a function called with the session id when a ticker stops."""
+        self.stop_hooks.append(hook)
+        return hook
+
+    def get(self, session_id):
+        return self.tickers.get(str(session_id))
+
+    def join(self, session_id):
+        """Count a local participant in, starting the ticker for the first one."""
+        ticker = self.tickers.get(str(session_id))
+        if ticker is None:
+            ticker = self.tickers[str(session_id)] = SessionTicker(session_id, self)
+        ticker.participants += 1
+        if self.jobs or self.leased_jobs:
+            ticker.start()
+        return ticker
+
+    async def leave(self, session_id):
+        """Count a local participant out, stopping the ticker after the last one."""
+        ticker = self.tickers.get(str(session_id))
+        if ticker is None:
+            return
+        ticker.participants -= 1
+        if ticker.participants <= 0:
+            await self.stop(session_id)
+
+    async def stop(self, session_id):
+        ticker = self.tickers.pop(str(session_id), None)
+        if ticker is not None:
+            await ticker.stop()
+            self.stopped(ticker)
+
+    def discard(self, ticker):
+        if self.tickers.get(ticker.session_id) is ticker:
+            del self.tickers[ticker.session_id]
+            self.stopped(ticker)
+
+    def stopped(self, ticker):
+        for hook in self.stop_hooks:
+            hook(ticker.session_id)
+
+
+# Global ticker registry instance
+tickers = TickerRegistry()
+
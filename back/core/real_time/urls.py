@@ -0,0 +1,10 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .views import RealTimeMetricsViewSet
+
+router = DefaultRouter()
+router.register(r'realtime/metrics', RealTimeMetricsViewSet, basename='realtime-metrics')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
@@ -1,5 +1,6 @@
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from .presence import presence
 
 async def send_to_session_group(session_id, message):
     """
@@ -18,13 +19,6 @@ async def send_to_session_group(session_id, message):
 
 async def get_session_participants(session_id):
     """
-    Get list of participants in a session (for debugging/monitoring)
+    Ids of the users connected to a session (for debugging/monitoring)
     """
-    channel_layer = get_channel_layer()
-    group_name = f'session_{session_id}'
-    
-    # This is a simplified implementation - in production you might want
-    # to track participants in a more robust way (e.g., Redis)
-    return await channel_layer.group_send(group_name, {
-        'type': 'list_participants'
-    })
\ No newline at end of file
+    return await presence.members(session_id)
@@ -0,0 +1,15 @@
+from rest_framework import viewsets
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from .metrics import metrics
+from .reaper import reaper
+
+class RealTimeMetricsViewSet(viewsets.ViewSet):
+    """
+    Metrics of the real-time path in this process (staff only), with the
+    outbound lag of every connection.
+    """
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        return Response({**metrics.snapshot(), 'connections': reaper.lags()})
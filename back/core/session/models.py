@@ -3,6 +3,8 @@ from classrooms.models import Classroom
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
 import json
 import logging
 
@@ -13,6 +15,8 @@ class Session(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    paused_at = models.DateTimeField(null=True, blank=True)
+    paused_duration = models.DurationField(default=timedelta(0))
     
     def __str__(self):
         return f"{self.classroom.name} - {self.start_time}"
@@ -34,6 +38,46 @@ class Session(models.Model):
         domain = settings.DOMAIN if hasattr(settings, 'DOMAIN') else 'localhost:8000'
         return f"ws://{domain}/ws/session/{self.id}/"
     
+    @property
+    def is_paused(self):
+        return self.paused_at is not None
+
+    def elapsed_seconds(self, now=None):
+        """Running time of the session, excluding the time spent paused"""
+        end = self.end_time or self.paused_at or now or timezone.now()
+        return max((end - self.start_time - self.paused_duration).total_seconds(), 0.0)
+
+    def pause(self, now=None, save=True):
+        """Freeze the session clock. Returns False if it cannot be paused."""
+        if not self.is_active or self.is_paused:
+            return False
+        self.paused_at = now or timezone.now()
+        if save:
+            self.save(update_fields=['paused_at'])
+        return True
+
+    def resume(self, now=None, save=True):
+        """Restart the session clock, adding the pause to paused_duration."""
+        if not self.is_paused:
+            return False
+        self.paused_duration += (now or timezone.now()) - self.paused_at
+        self.paused_at = None
+        if save:
+            self.save(update_fields=['paused_at', 'paused_duration'])
+        return True
+
+    def get_clock_state(self):
+        """Everything a client needs to run the session timer locally"""
+        return {
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'is_active': self.is_active,
+            'is_paused': self.is_paused,
+            'paused_at': self.paused_at.isoformat() if self.paused_at else None,
+            'paused_duration': self.paused_duration.total_seconds(),
+            'elapsed_time': self.elapsed_seconds(),
+        }
+    
     def broadcast_to_session(self, message_type, data):
         """Broadcast message to session group - FIXED VERSION"""
         try:
@@ -54,7 +98,6 @@ class Session(models.Model):
     
     def end_session(self):
         """End session - FIXED VERSION"""
-        from django.utils import timezone
         from performance.models import Performance
 
         # Only end if not already ended
@@ -62,6 +105,7 @@ class Session(models.Model):
             return False
 
         self.end_time = timezone.now()
+        self.resume(self.end_time, save=False)
         self.is_active = False
         self.save()
         
@@ -75,4 +119,25 @@ class Session(models.Model):
         })
         
         logger.info(f"Session {self.id} ended at {self.end_time}")
-        return True
\ No newline at end of file
+        return True
+
+
+class ChatMessage(models.Model):
+    """
+    Chat message sent during a session, written in batches by
+    real_time.persistence.ChatWriteBuffer.
+    """
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='chat_messages')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='chat_messages')
+    message = models.TextField()
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            # History pages are read newest first from any (timestamp, id) position
+            models.Index(fields=['session', '-timestamp', '-id'], name='chat_session_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.session} - {self.user} @ {self.timestamp}"
@@ -0,0 +1,59 @@
+import base64
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class ChatCursorPagination(BasePagination):
+    """
+    Keyset pagination of chat history, newest first.
+
+    The cursor is the (timestamp, id) of the last message of the previous
+    page, so every page is a single range scan of the
+    (session, -timestamp, -id) index however deep it is.
+    """
+    page_size = 50
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.limit = min(max(int(request.query_params.get('limit', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            self.limit = self.page_size
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            timestamp, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        page = list(queryset.order_by('-timestamp', '-id')[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def encode_cursor(self, message):
+        return base64.urlsafe_b64encode(f'{message.timestamp.isoformat()}|{message.id}'.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError
+            return timestamp, int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        params = {**self.request.query_params.dict(), 'cursor': self.encode_cursor(self.page[-1])}
+        return self.request.build_absolute_uri(f'{self.request.path}?{urlencode(params)}')
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
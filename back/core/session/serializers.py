@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Session
+from .models import ChatMessage, Session
 from classrooms.models import Classroom
 
 class SessionSerializer(serializers.ModelSerializer):
@@ -9,8 +9,8 @@ class SessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Session
         fields = ['id', 'classroom', 'classroom_name', 'start_time', 'end_time', 
-                 'is_active', 'websocket_url']
-        read_only_fields = ['end_time', 'is_active']
+                 'is_active', 'paused_at', 'paused_duration', 'websocket_url']
+        read_only_fields = ['end_time', 'is_active', 'paused_at', 'paused_duration']
     
     def get_websocket_url(self, obj):
         return obj.get_websocket_url()
@@ -22,4 +22,13 @@ class SessionCreateSerializer(serializers.ModelSerializer):
         fields = ['classroom']
 
 class SessionEndSerializer(serializers.Serializer):
-    end_time = serializers.DateTimeField(read_only=True)
\ No newline at end of file
+    end_time = serializers.DateTimeField(read_only=True)
+
+
+class ChatMessageSerializer(serializers.ModelSerializer):
+    user_name = serializers.CharField(source='user.full_name', read_only=True, default=None)
+    user_role = serializers.CharField(source='user.role', read_only=True, default=None)
+
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'user', 'user_name', 'user_role', 'message', 'timestamp']
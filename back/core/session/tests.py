@@ -3,9 +3,10 @@ from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Session
-from classrooms.models import Classroom
+from .models import ChatMessage, Session
+from classrooms.models import Classroom, Enrollment
 from django.utils import timezone
+from datetime import timedelta
 import uuid
 from unittest.mock import patch
 
@@ -34,6 +35,31 @@ class SessionModelsTest(TestCase):
         self.assertEqual(session.classroom, self.classroom)
         self.assertTrue(session.is_active)
 
+    def test_session_clock_excludes_pauses(self):
+        start = timezone.now() - timedelta(minutes=10)
+        session = Session.objects.create(classroom=self.classroom, start_time=start)
+
+        self.assertTrue(session.pause(now=start + timedelta(minutes=2)))
+        self.assertFalse(session.pause())
+        self.assertEqual(session.elapsed_seconds(), 120)
+
+        self.assertTrue(session.resume(now=start + timedelta(minutes=5)))
+        self.assertFalse(session.resume())
+        session.refresh_from_db()
+        self.assertIsNone(session.paused_at)
+        self.assertEqual(session.paused_duration, timedelta(minutes=3))
+        self.assertEqual(session.elapsed_seconds(now=start + timedelta(minutes=6)), 180)
+
+    def test_ending_a_paused_session_closes_the_pause(self):
+        session = Session.objects.create(classroom=self.classroom, start_time=timezone.now())
+        session.pause()
+        session.end_session()
+        session.refresh_from_db()
+        self.assertFalse(session.is_paused)
+        clock = session.get_clock_state()
+        self.assertFalse(clock['is_active'])
+        self.assertEqual(clock['end_time'], session.end_time.isoformat())
+
 @patch('reports.tasks.generate_session_report_task.delay')
 class SessionViewSetTest(TestCase):
     def setUp(self):
@@ -95,3 +121,45 @@ class SessionViewSetTest(TestCase):
         url = f'/api/sessions/{self.session.id}/leave/'
         response = self.client.post(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND) # No performance record yet
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.instructor = User.objects.create_user(email='instructor@example.com', password='password123', full_name='Instructor User', role='instructor')
+        self.student = User.objects.create_user(email='student@example.com', password='password123', full_name='Student User', role='student')
+        self.outsider = User.objects.create_user(email='outsider@example.com', password='password123', full_name='Outsider', role='student')
+        self.classroom = Classroom.objects.create(name='Test Classroom', instructor=self.instructor, join_code=str(uuid.uuid4()).split('-')[0])
+        Enrollment.objects.create(student=self.student, classroom=self.classroom)
+        self.session = Session.objects.create(classroom=self.classroom, start_time=timezone.now())
+
+        # Two messages share a timestamp, the cursor must not skip either
+        start = timezone.now()
+        times = [start, start + timedelta(seconds=1), start + timedelta(seconds=1), start + timedelta(seconds=2), start + timedelta(seconds=3)]
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=self.session, user=self.student, message=f'message {i}', timestamp=timestamp)
+            for i, timestamp in enumerate(times)
+        ])
+
+    def test_history_is_paginated_newest_first(self):
+        self.client.force_authenticate(user=self.student)
+        url = f'/api/sessions/{self.session.id}/chat/?limit=2'
+        messages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            messages += response.data['results']
+            url = response.data['next']
+
+        self.assertEqual([m['message'] for m in messages], ['message 4', 'message 3', 'message 2', 'message 1', 'message 0'])
+        self.assertEqual(messages[0]['user_name'], 'Student User')
+
+    def test_only_participants_read_the_history(self):
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(f'/api/sessions/{self.session.id}/chat/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.instructor)
+        response = self.client.get(f'/api/sessions/{self.session.id}/chat/?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
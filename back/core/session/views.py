@@ -5,7 +5,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from .models import Session
-from .serializers import SessionSerializer, SessionCreateSerializer, SessionEndSerializer
+from .pagination import ChatCursorPagination
+from .serializers import ChatMessageSerializer, SessionSerializer, SessionCreateSerializer, SessionEndSerializer
+from classrooms.cache import get_session_role
 from classrooms.models import Classroom
 from performance.models import Performance
 from real_time.utils import send_to_session_group
@@ -103,4 +105,19 @@ class SessionViewSet(viewsets.ModelViewSet):
         logger.info(f"Session {session.id} ended by instructor {request.user.id}")
         
         serializer = SessionEndSerializer(session)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def chat(self, request, pk=None):
+        # Chat history of the session, newest first, for its participants
+        session = self.get_object()
+        if get_session_role(request.user, session.id) is None:
+            return Response(
+                {'error': 'You do not have access to this session'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        paginator = ChatCursorPagination()
+        messages = paginator.paginate_queryset(session.chat_messages.select_related('user'), request, view=self)
+        serializer = ChatMessageSerializer(messages, many=True)
+        return paginator.get_paginated_response(serializer.data)
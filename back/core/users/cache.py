@@ -0,0 +1,36 @@
+"""
+Cache of users by id, shared by the REST and WebSocket JWT authentication.
+
+Entries are dropped when a user is saved or deleted, which includes
+password changes, so a revoked or changed account is never served from
+the cache of the process that changed it, and from the other processes for
+at most LOCAL_TIMEOUT seconds.
+"""
+import copy
+
+from core.caching import configured_cache
+from .models import User
+
+# Global user cache instance, configured by the USER_CACHE setting
+user_cache = configured_cache('user', 'USER_CACHE')
+
+
+def load_user(user_id):
+    try:
+        return User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return None
+
+
+def get_user(user_id):
+    """Return the user with this id, or None. Callers get their own copy."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    user = user_cache.get_or_load(user_id, lambda: load_user(user_id))
+    return copy.copy(user) if user is not None else None
+
+
+def invalidate_user(user_id):
+    user_cache.delete(int(user_id))
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
+from core.caching import TieredCache
+from .cache import get_user, invalidate_user, user_cache
 
 User = get_user_model()
 
@@ -86,4 +88,59 @@ class AuthViewSetTest(TestCase):
         logout_url = '/api/auth/logout/'
         data = {'refresh': str(refresh)}
         response = self.client.post(logout_url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+
+class UserCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            password='password123',
+            full_name='Test User',
+            role='student'
+        )
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_users_are_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user(self.user.id).email, 'test@example.com')
+            self.assertEqual(get_user(str(self.user.id)).email, 'test@example.com')
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_user(self.user.id + 1))
+            self.assertIsNone(get_user(self.user.id + 1))
+
+    def test_cached_users_are_copies(self):
+        get_user(self.user.id).full_name = 'Changed'
+        self.assertEqual(get_user(self.user.id).full_name, 'Test User')
+
+    def test_saving_or_deleting_a_user_invalidates_it(self):
+        get_user(self.user.id)
+        self.user.set_password('new-password123')
+        self.user.save()
+        self.assertTrue(get_user(self.user.id).check_password('new-password123'))
+
+        self.user.delete()
+        self.assertIsNone(get_user(self.user.id))
+
+    def test_rest_authentication_uses_the_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get('/api/users/profile/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'test@example.com')
+
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        invalidate_user(self.user.id)
+        response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_shared_tier_is_read_through(self):
+        first = TieredCache('test', local_timeout=30, alias='default')
+        second = TieredCache('test', local_timeout=30, alias='default')
+        first.set(1, 'value')
+        self.assertEqual(second.get(1), 'value')
+        second.delete(1)
+        first.clear()
+        self.assertIsNone(first.get(1))
@@ -19,6 +19,20 @@ interface ChatMessage {
   user_role: string
 }
 
+// Session clock received from "timer.sync", used to run the timer locally
+interface SessionClock {
+  offsetMs: number
+  startMs: number
+  endMs: number | null
+  pausedAtMs: number | null
+  pausedMs: number
+}
+
+const clockElapsedSeconds = (clock: SessionClock) => {
+  const end = clock.endMs ?? clock.pausedAtMs ?? Date.now() + clock.offsetMs
+  return Math.max(0, (end - clock.startMs - clock.pausedMs) / 1000)
+}
+
 interface SessionWebSocketState {
   connected: boolean
   connecting: boolean
@@ -34,6 +48,7 @@ interface SessionWebSocketState {
 export function useSessionWebSocket({ sessionId, onError, onFocusUpdate }: UseSessionWebSocketProps) {
   const { user } = useAuth()
   const wsRef = useRef<SessionWebSocket | null>(null)
+  const clockRef = useRef<SessionClock | null>(null)
   const onErrorRef = useRef(onError)
   const onFocusUpdateRef = useRef(onFocusUpdate)
   onErrorRef.current = onError
@@ -235,6 +250,20 @@ export function useSessionWebSocket({ sessionId, onError, onFocusUpdate }: UseSe
         }
       }
 
+      // Clock sync: the server sends its clock on connect and on every
+      // pause/resume/end, the timer then runs locally
+      const handleTimerSync = (data: any) => {
+        const serverNow = Date.parse(data.server_time)
+        clockRef.current = {
+          offsetMs: Number.isNaN(serverNow) ? 0 : serverNow - Date.now(),
+          startMs: Date.parse(data.start_time),
+          endMs: data.end_time ? Date.parse(data.end_time) : null,
+          pausedAtMs: data.paused_at ? Date.parse(data.paused_at) : null,
+          pausedMs: Number(data.paused_duration || 0) * 1000,
+        }
+        updateState({ elapsedTime: clockElapsedSeconds(clockRef.current) })
+      }
+
       // Chat messages
       const handleChatMessage = (data: any) => {
         try {
@@ -274,11 +303,17 @@ export function useSessionWebSocket({ sessionId, onError, onFocusUpdate }: UseSe
       ws.onMessage("session.control", handleSessionControl)
       ws.onMessage("session.ended", handleSessionEnded)
       ws.onMessage("timer.update", handleTimerUpdate)
+      ws.onMessage("timer.sync", handleTimerSync)
       ws.onMessage("chat.message", handleChatMessage)
       ws.onMessage("session.stats", handleSessionStats)
 
       ws.onMessage("pong", () => {})
 
+      // The server reaps connections that stay silent, answer its heartbeats
+      ws.onMessage("heartbeat", () => {
+        ws.send({ type: "pong" })
+      })
+
       ws.onMessage("error", (data: any) => {
         console.error("WebSocket error:", data)
         onErrorRef.current?.(data?.message || "WebSocket error")
@@ -339,6 +374,16 @@ export function useSessionWebSocket({ sessionId, onError, onFocusUpdate }: UseSe
     }
   }, [])
 
+  // Run the session timer locally from the last clock sync
+  useEffect(() => {
+    const interval = setInterval(() => {
+      if (clockRef.current) {
+        updateState({ elapsedTime: clockElapsedSeconds(clockRef.current) })
+      }
+    }, 1000)
+    return () => clearInterval(interval)
+  }, [updateState])
+
   // Cleanup on unmount
   useEffect(() => {
     return () => {